@@ -0,0 +1,27 @@
+# bot/config.py
+"""
+Загрузка конфигурации из .env — один раз на процесс.
+
+Модули читают настройки через os.getenv при импорте, поэтому load_config()
+вызывается в начале тех из них, что могут запускаться отдельно (CLI, скрипты);
+повторные вызовы ничего не делают и не ищут .env заново.
+"""
+import os
+from typing import Optional
+
+# Путь к .env можно переопределить (например, для нескольких инстансов на одной машине)
+ENV_FILE = os.getenv("ENV_FILE")
+
+_loaded = False
+
+
+def load_config(path: Optional[str] = None) -> None:
+    """Загружает .env в os.environ; уже заданные переменные окружения не перезаписываются"""
+    global _loaded
+    if _loaded:
+        return
+    from dotenv import load_dotenv
+
+    # Без пути .env ищется вверх от каталога пакета, как и раньше
+    load_dotenv(path or ENV_FILE)
+    _loaded = True
@@ -0,0 +1,214 @@
+# bot/devtools/api_stubs.py
+"""
+Локальные заглушки внешних API для нагрузочных прогонов без сети:
+GigaChat (OAuth и эмбеддинги) и OpenRouter (chat/completions).
+
+Задержка и доля ошибок задаются профилем на каждый эндпоинт. Эмбеддинги
+детерминированные (хэширование слов), поэтому поиск по Chroma
+возвращает осмысленные фрагменты, а не случайные. Запуск отдельно:
+
+    python -m bot.devtools.api_stubs --port 8090 --embeddings latency=0.15,errors=0.01
+
+Настройки бота для работы с заглушками выводятся при старте
+(GIGACHAT_OAUTH_URL, GIGACHAT_EMBEDDINGS_URL, OPENROUTER_URL).
+"""
+import argparse
+import asyncio
+import logging
+import math
+import random
+import re
+import zlib
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 256
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+@dataclass
+class StubProfile:
+    """Поведение эндпоинта: задержка (с), разброс (доля от задержки), доля ошибок и их код"""
+
+    latency: float = 0.0
+    jitter: float = 0.3
+    errors: float = 0.0
+    status: int = 503
+
+    @classmethod
+    def parse(cls, spec: str) -> "StubProfile":
+        """Разбор строки вида "latency=0.2,jitter=0.5,errors=0.02,status=429" """
+        profile = cls()
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            name, _, value = item.partition("=")
+            if name not in ("latency", "jitter", "errors", "status"):
+                raise ValueError(f"Неизвестный параметр профиля: {name}")
+            setattr(profile, name, int(value) if name == "status" else float(value))
+        return profile
+
+    def delay(self, rng: random.Random) -> float:
+        if self.latency <= 0:
+            return 0.0
+        return max(0.0, self.latency * (1 + rng.uniform(-self.jitter, self.jitter)))
+
+
+@dataclass
+class EndpointStats:
+    requests: int = 0
+    errors: int = 0
+
+
+def hash_embedding(text: str, dim: int = EMBEDDING_DIM) -> List[float]:
+    """Мешок слов, разложенный по dim корзинам crc32 и нормированный"""
+    vector = [0.0] * dim
+    for word in _WORD_RE.findall(text.lower()):
+        vector[zlib.crc32(word.encode()) % dim] += 1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+@dataclass
+class APIStubs:
+    """aiohttp-сервер с заглушками GigaChat и OpenRouter"""
+
+    host: str = "127.0.0.1"
+    port: int = 0
+    oauth: StubProfile = field(default_factory=StubProfile)
+    embeddings: StubProfile = field(default_factory=StubProfile)
+    completions: StubProfile = field(default_factory=StubProfile)
+    # Токен «истекает» после стольких запросов эмбеддингов (0 — никогда): проверка обновления
+    token_requests: int = 0
+    seed: Optional[int] = None
+    stats: Dict[str, EndpointStats] = field(default_factory=dict)
+    _runner: Optional[web.AppRunner] = None
+
+    def __post_init__(self):
+        self._rng = random.Random(self.seed)
+        self._token_serial = 0
+        self._token_used = 0
+        self.stats = {name: EndpointStats() for name in ("oauth", "embeddings", "completions")}
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def env(self) -> Dict[str, str]:
+        """Переменные окружения, направляющие бота на заглушки"""
+        return {
+            "GIGACHAT_OAUTH_URL": f"{self.base_url}/api/v2/oauth",
+            "GIGACHAT_EMBEDDINGS_URL": f"{self.base_url}/api/v1/embeddings",
+            "OPENROUTER_URL": f"{self.base_url}/api/v1/chat/completions",
+        }
+
+    async def start(self) -> "APIStubs":
+        app = web.Application()
+        app.router.add_post("/api/v2/oauth", self._oauth)
+        app.router.add_post("/api/v1/embeddings", self._embeddings)
+        app.router.add_post("/api/v1/chat/completions", self._completions)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self.port = self._runner.addresses[0][1]
+        logger.info("Заглушки API слушают %s", self.base_url)
+        return self
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _simulate(self, name: str, profile: StubProfile) -> Optional[web.Response]:
+        """Задержка по профилю; возвращает ответ-ошибку, если запрос должен упасть"""
+        self.stats[name].requests += 1
+        delay = profile.delay(self._rng)
+        if delay:
+            await asyncio.sleep(delay)
+        if profile.errors and self._rng.random() < profile.errors:
+            self.stats[name].errors += 1
+            return web.json_response({"message": "stub error"}, status=profile.status)
+        return None
+
+    async def _oauth(self, request: web.Request) -> web.Response:
+        error = await self._simulate("oauth", self.oauth)
+        if error is not None:
+            return error
+        self._token_serial += 1
+        self._token_used = 0
+        return web.json_response({"access_token": f"stub-token-{self._token_serial}", "expires_at": 0})
+
+    async def _embeddings(self, request: web.Request) -> web.Response:
+        if request.headers.get("Authorization") != f"Bearer stub-token-{self._token_serial}":
+            return web.json_response({"message": "token expired"}, status=401)
+        if self.token_requests:
+            self._token_used += 1
+            if self._token_used > self.token_requests:
+                self._token_serial += 1  # старый токен больше не принимается
+                return web.json_response({"message": "token expired"}, status=401)
+        error = await self._simulate("embeddings", self.embeddings)
+        if error is not None:
+            return error
+        payload = await request.json()
+        data = [
+            {"object": "embedding", "index": i, "embedding": hash_embedding(text)}
+            for i, text in enumerate(payload.get("input", []))
+        ]
+        return web.json_response({"object": "list", "data": data, "model": payload.get("model")})
+
+    async def _completions(self, request: web.Request) -> web.Response:
+        error = await self._simulate("completions", self.completions)
+        if error is not None:
+            return error
+        payload = await request.json()
+        question = payload["messages"][-1]["content"]
+        # Первая строка контекста — чтобы ответ зависел от найденных фрагментов
+        context = question.split("\n", 2)[1] if "\n" in question else question
+        answer = f"Рекомендуем продукцию ECOFES. По данным базы знаний: {context[:300]}"
+        return web.json_response({
+            "id": f"stub-{self.stats['completions'].requests}",
+            "model": payload.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+        })
+
+
+async def _serve(stubs: APIStubs) -> None:
+    await stubs.start()
+    print(f"✅ Заглушки API запущены на {stubs.base_url}")
+    for name, value in stubs.env().items():
+        print(f"{name}={value}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await stubs.stop()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Заглушки GigaChat и OpenRouter")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--oauth", type=StubProfile.parse, default=StubProfile(), help="профиль OAuth")
+    parser.add_argument("--embeddings", type=StubProfile.parse, default=StubProfile(), help="профиль эмбеддингов")
+    parser.add_argument("--completions", type=StubProfile.parse, default=StubProfile(), help="профиль OpenRouter")
+    parser.add_argument("--token-requests", type=int, default=0, help="через сколько запросов токен истекает")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    stubs = APIStubs(
+        host=args.host,
+        port=args.port,
+        oauth=args.oauth,
+        embeddings=args.embeddings,
+        completions=args.completions,
+        token_requests=args.token_requests,
+    )
+    try:
+        asyncio.run(_serve(stubs))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
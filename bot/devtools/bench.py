@@ -0,0 +1,500 @@
+# bot/devtools/bench.py
+"""
+Микробенчмарки горячих путей бота с проверкой на регрессии.
+
+Каждый бенчмарк замеряется через timeit (autorange + несколько повторов);
+для сравнения берётся лучший повтор — он меньше всего зависит от фоновой
+нагрузки на машине. Результаты сравниваются с сохранённой базой
+bench_baseline.json. Если бенчмарк медленнее базы больше допуска,
+команда завершается с кодом 1.
+
+    python -m bot.devtools.bench                       # прогон и сравнение с базой
+    python -m bot.devtools.bench --only classifier     # только часть
+    python -m bot.devtools.bench --save-baseline       # записать текущие результаты как базу
+    python -m bot.devtools.bench --json bench.json     # результаты для CI
+
+Время нормируется на калибровочный цикл чистого Python, измеренный в том
+же прогоне, — так база, снятая на другой машине, остаётся сравнимой.
+Запись базы хранит калибровку своего прогона (calibration_ns), поэтому
+новый бенчмарк добавляется в базу через --only и --save-baseline, не
+перезаписывая остальные. --raw сравнивает абсолютное время.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import timeit
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "bench_baseline.json")
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_REPEATS = 5
+
+SAMPLE_QUERIES = (
+    "Привет",
+    "Добрый день! Подскажите, пожалуйста",
+    "Спасибо, всё понятно",
+    "Сколько стоит масло 5W-40 и где купить?",
+    "Расскажите о компании",
+    "Какие масла есть в ассортименте?",
+    "Какая вязкость масла подходит для дизельного двигателя зимой?",
+    "Чем отличается синтетическое масло от полусинтетики?",
+    "Можно ли смешивать гидравлические масла разных марок?",
+    "Подберите масло для КАМАЗ 5490, дизель, дальние рейсы",
+    "Какой допуск API нужен для турбированного двигателя?",
+    "ммм",
+)
+
+SAMPLE_ANSWERS = (
+    "Для дизельного двигателя зимой подойдёт масло ECOFES 5W-40 с допуском API CI-4.",
+    "К сожалению, я не могу сказать точно, какое масло подойдёт.",
+    " ".join(["Синтетическое масло сохраняет вязкость при высоких температурах."] * 40),
+    "Гидравлические масла разных марок смешивать не рекомендуется.",
+)
+
+
+class SkipBenchmark(Exception):
+    """Бенчмарк нельзя выполнить в этом окружении (нет зависимости и т.п.)"""
+
+
+# Имя → функция подготовки, возвращающая замеряемую функцию без аргументов
+BENCHMARKS: Dict[str, Callable[[], Callable[[], Any]]] = {}
+
+
+def benchmark(name: str):
+    def decorator(setup: Callable[[], Callable[[], Any]]):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+# ---------------------------------------------------------------- бенчмарки
+
+@benchmark("calibration")
+def bench_calibration():
+    """Эталонный цикл чистого Python: знаменатель при нормировке"""
+    def run():
+        total = 0
+        for i in range(1000):
+            total += i * i
+        return total
+    return run
+
+
+@benchmark("classifier.classify_query")
+def bench_classify():
+    from bot.services.query_classifier import QueryClassifier
+
+    classifier = QueryClassifier()
+
+    def run():
+        for text in SAMPLE_QUERIES:
+            classifier.classify_query(text)
+    return run
+
+
+@benchmark("classifier.get_query_keywords")
+def bench_keywords():
+    from bot.services.query_classifier import QueryClassifier
+
+    classifier = QueryClassifier()
+
+    def run():
+        for text in SAMPLE_QUERIES:
+            classifier.get_query_keywords(text)
+    return run
+
+
+@benchmark("faq_index.match")
+def bench_faq_match():
+    from bot.services.faq_index import FAQIndex
+
+    index = FAQIndex()
+    index.load()
+    if not index.variants:
+        raise SkipBenchmark("в базе знаний нет FAQ")
+
+    def run():
+        for text in SAMPLE_QUERIES:
+            index.match(text)
+    return run
+
+
+@benchmark("catalog.shortlist")
+def bench_catalog_shortlist():
+    from bot.services.catalog import ProductCatalog
+
+    catalog = ProductCatalog()
+    catalog.load()
+    if not catalog.products:
+        raise SkipBenchmark("в базе знаний нет карточек продуктов")
+    requests = [
+        catalog.parse_request(text, vehicle_type)
+        for text, vehicle_type in (
+            ("Toyota Camry 2015, 2.5 бензин, 5W-30 API SN", "select_car"),
+            ("КАМАЗ 5490, дизель, MB 228.5", "select_truck"),
+            ("Yamaha R1, 4т", "select_moto"),
+            ("коробка передач 75W-90 GL-5", "select_car"),
+        )
+    ]
+
+    def run():
+        for request in requests:
+            catalog.shortlist(request)
+    return run
+
+
+@benchmark("rag.split_text")
+def bench_split_text():
+    try:
+        from bot.services.rag_engine import RAGEngine
+    except ImportError as e:
+        raise SkipBenchmark(f"rag_engine не импортируется: {e}")
+
+    # Без __init__: разбиение не трогает ни GigaChat, ни Chroma
+    engine = RAGEngine.__new__(RAGEngine)
+    text = _knowledge_base_text()
+    return lambda: engine._split_text(text)
+
+
+@benchmark("rag.lexical_search")
+def bench_lexical_search():
+    """Запасной поиск BM25, пока эмбеддинги недоступны"""
+    from bot.services.lexical_search import BM25Index
+
+    words = _knowledge_base_text().split()
+    index = BM25Index([" ".join(words[i:i + 200]) for i in range(0, len(words), 200)])
+    state = {"i": 0}
+
+    def run():
+        query = SAMPLE_QUERIES[state["i"] % len(SAMPLE_QUERIES)]
+        state["i"] += 1
+        return index.search(query, 3)
+    return run
+
+
+@benchmark("vector_search.numpy")
+def bench_numpy_search():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipBenchmark("numpy не установлен")
+
+    corpus, queries = _synthetic_vectors()
+    matrix = np.asarray(corpus, dtype=np.float32)
+    query_matrix = np.asarray(queries, dtype=np.float32)
+    state = {"i": 0}
+
+    def run():
+        query = query_matrix[state["i"] % len(query_matrix)]
+        state["i"] += 1
+        scores = matrix @ query
+        top = np.argpartition(-scores, 3)[:3]
+        return top[np.argsort(-scores[top])]
+    return run
+
+
+def _bench_store(dtype: str, rescore: int):
+    try:
+        from bot.services.embedding_store import EmbeddingStore
+    except ImportError:
+        raise SkipBenchmark("numpy не установлен")
+
+    corpus, queries = _synthetic_vectors()
+    store = EmbeddingStore.build([f"doc_{i}" for i in range(len(corpus))], corpus, dtype=dtype, keep_full=bool(rescore))
+    state = {"i": 0}
+
+    def run():
+        query = queries[state["i"] % len(queries)]
+        state["i"] += 1
+        return store.search(query, 3, rescore=rescore)
+    return run
+
+
+@benchmark("vector_search.float16")
+def bench_float16_search():
+    return _bench_store("float16", 0)
+
+
+@benchmark("vector_search.int8_rescore")
+def bench_int8_search():
+    return _bench_store("int8", 20)
+
+
+@benchmark("vector_search.chroma")
+def bench_chroma_search():
+    try:
+        import chromadb
+    except ImportError:
+        raise SkipBenchmark("chromadb не установлен")
+
+    corpus, queries = _synthetic_vectors()
+    client = chromadb.EphemeralClient()
+    collection = client.get_or_create_collection(f"bench_{random.randrange(1 << 30)}")
+    for start in range(0, len(corpus), 500):
+        chunk = corpus[start:start + 500]
+        collection.add(
+            ids=[f"doc_{start + i}" for i in range(len(chunk))],
+            embeddings=chunk,
+            documents=[f"фрагмент {start + i}" for i in range(len(chunk))],
+        )
+    state = {"i": 0}
+
+    def run():
+        query = queries[state["i"] % len(queries)]
+        state["i"] += 1
+        return collection.query(query_embeddings=[query], n_results=3)
+    return run
+
+
+@benchmark("llm.filter_and_improve_answer")
+def bench_filter_answer():
+    from bot.services.llm_service import filter_and_improve_answer
+
+    def run():
+        for answer in SAMPLE_ANSWERS:
+            filter_and_improve_answer(answer)
+    return run
+
+
+@benchmark("chat_responses.select")
+def bench_chat_responses():
+    from bot.services.chat_responses import ChatResponses
+
+    responses = ChatResponses()
+
+    def run():
+        responses.get_greeting_response()
+        responses.get_about_response("Расскажите о компании")
+        responses.get_simple_response()
+        responses.get_goodbye_response()
+        responses.get_unknown_response()
+        responses.get_commercial_response()
+        responses.get_selection_response()
+        responses.get_catalog_response()
+        responses.get_technical_help_response()
+    return run
+
+
+@benchmark("query_log.log")
+def bench_query_log_enqueue():
+    from bot.services.query_log import QueryLogQueue
+
+    queue = QueryLogQueue(batch_size=10 ** 9, max_pending=10 ** 9, spill_path=None)
+
+    def run():
+        queue.log(
+            user_id=42,
+            username="bench",
+            query_text="Какая вязкость масла подходит для дизельного двигателя?",
+            response_text="Ответ",
+            query_type="technical",
+            outcome="rag",
+        )
+        if queue.pending >= 100_000:
+            queue._pending.clear()
+    return run
+
+
+@benchmark("query_log.write_batch")
+def bench_query_log_write():
+    """Пачка из 100 запросов и одной отметки лида — одна транзакция SQLite"""
+    from bot.services.database import init_db
+    from bot.services.query_log import QueryLogQueue
+
+    init_db()
+    queue = QueryLogQueue(spill_path=None)
+    now = datetime.utcnow()
+    rows = [
+        {
+            "kind": "query",
+            "user_id": 1000 + i % 50,
+            "username": f"user{i}",
+            "query_text": SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)],
+            "response_text": SAMPLE_ANSWERS[i % len(SAMPLE_ANSWERS)][:200],
+            "timestamp": now - timedelta(seconds=i),
+            "query_type": "technical",
+            "outcome": "rag",
+        }
+        for i in range(100)
+    ]
+    batch = rows + [{"kind": "lead", "user_id": 1001, "timestamp": now}]
+    return lambda: queue._write_batch(batch)
+
+
+def _knowledge_base_text() -> str:
+    parts = []
+    for path in sorted(glob.glob("data/docs/**/*.txt", recursive=True)):
+        with open(path, "r", encoding="utf-8") as f:
+            parts.append(f.read())
+    if not parts:
+        raise SkipBenchmark("нет data/docs — запускайте из корня репозитория")
+    return "\n".join(parts)
+
+
+def _synthetic_vectors(size: int = 2000, dim: int = 1024, queries: int = 64):
+    """Нормированные случайные векторы размерности эмбеддингов GigaChat"""
+    rng = random.Random(7)
+
+    def vector() -> List[float]:
+        values = [rng.gauss(0, 1) for _ in range(dim)]
+        norm = sum(v * v for v in values) ** 0.5
+        return [v / norm for v in values]
+
+    return [vector() for _ in range(size)], [vector() for _ in range(queries)]
+
+
+# ---------------------------------------------------------------- замер и сравнение
+
+def measure(run: Callable[[], Any], repeats: int = DEFAULT_REPEATS) -> Dict[str, float]:
+    """Медиана и минимум времени одного вызова, нс"""
+    timer = timeit.Timer(run)
+    number, _ = timer.autorange()  # не меньше 0.2 с на повтор
+    per_call = [total / number * 1e9 for total in timer.repeat(repeat=repeats, number=number)]
+    median = statistics.median(per_call)
+    return {
+        "ns_per_op": round(median, 1),
+        "min_ns": round(min(per_call), 1),
+        "spread_pct": round((max(per_call) - min(per_call)) / median * 100, 1) if median else 0.0,
+        "number": number,
+    }
+
+
+def run_benchmarks(only: Optional[List[str]] = None, repeats: int = DEFAULT_REPEATS) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    skipped: Dict[str, str] = {}
+    for name, setup in BENCHMARKS.items():
+        # Калибровку меряем всегда: без неё нельзя нормировать
+        if only and name != "calibration" and not any(part in name for part in only):
+            continue
+        try:
+            run = setup()
+        except SkipBenchmark as e:
+            skipped[name] = str(e)
+            print(f"  {name:<34} пропущен: {e}")
+            continue
+        results[name] = measure(run, repeats)
+        print(f"  {name:<34} {_format_ns(results[name]['ns_per_op']):>10}  ±{results[name]['spread_pct']:.0f}%")
+    return {
+        "created": datetime.utcnow().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+        "skipped": skipped,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, normalize: bool = True) -> List[Dict[str, Any]]:
+    """Сравнение с базой; допуск бенчмарка можно переопределить в baseline["tolerances"]"""
+    rows = []
+    cur_results, base_results = current["results"], baseline.get("results", {})
+    cur_cal = cur_results.get("calibration", {}).get("min_ns")
+    base_cal = base_results.get("calibration", {}).get("min_ns")
+    normalize = normalize and bool(cur_cal)
+    tolerances = baseline.get("tolerances", {})
+
+    for name, result in cur_results.items():
+        if name == "calibration":
+            continue
+        base = base_results.get(name)
+        if base is None:
+            rows.append({"name": name, "status": "new", "ratio": None})
+            continue
+        cur_value, base_value = result["min_ns"], base["min_ns"]
+        # Каждая запись базы нормируется на калибровку своего прогона
+        entry_cal = base.get("calibration_ns", base_cal)
+        if normalize and entry_cal:
+            cur_value, base_value = cur_value / cur_cal, base_value / entry_cal
+        ratio = cur_value / base_value if base_value else 1.0
+        limit = tolerances.get(name, tolerance)
+        status = "regression" if ratio > 1 + limit else ("faster" if ratio < 1 - limit else "ok")
+        rows.append({"name": name, "status": status, "ratio": ratio, "tolerance": limit})
+    return rows
+
+
+def _format_ns(ns: float) -> str:
+    if ns >= 1e6:
+        return f"{ns / 1e6:.2f} мс"
+    if ns >= 1e3:
+        return f"{ns / 1e3:.2f} мкс"
+    return f"{ns:.0f} нс"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Микробенчмарки горячих путей")
+    parser.add_argument("--only", action="append", help="подстрока имени бенчмарка (можно несколько)")
+    parser.add_argument("--list", action="store_true", help="список бенчмарков")
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="файл базы")
+    parser.add_argument("--save-baseline", action="store_true", help="записать результаты как базу")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="допустимое замедление (0.25 = 25%%)")
+    parser.add_argument("--raw", action="store_true", help="сравнивать без нормировки на калибровку")
+    parser.add_argument("--json", help="сохранить результаты и сравнение в JSON")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        print("\n".join(BENCHMARKS))
+        return 0
+
+    # БД бенчмарка журнала — временная; задаётся до импорта bot.services.database
+    os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="ecofes-bench-"), "bench.db")
+
+    print("Бенчмарки:")
+    current = run_benchmarks(args.only, args.repeats)
+
+    rows: List[Dict[str, Any]] = []
+    if args.save_baseline:
+        previous = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                previous = json.load(f)
+        calibration = current["results"].get("calibration", {}).get("min_ns")
+        saved = {
+            name: {**result, "calibration_ns": calibration}
+            for name, result in current["results"].items()
+            if name != "calibration"
+        }
+        if args.only:
+            # Частичный прогон (--only) дописывает только свои бенчмарки со своей
+            # калибровкой; остальные записи и общая калибровка базы не меняются
+            merged = {**previous, "results": {**previous.get("results", {}), **saved}}
+        else:
+            merged = {**current, "results": {"calibration": current["results"]["calibration"], **saved}}
+            merged["tolerances"] = previous.get("tolerances", {})
+        merged.setdefault("tolerances", {})
+        merged.pop("skipped", None)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(merged, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"\nБаза сохранена: {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare(current, baseline, args.tolerance, normalize=not args.raw)
+        print(f"\nСравнение с базой от {baseline.get('created', '?')}{'' if args.raw else ' (нормировано)'}:")
+        marks = {"ok": "  ", "faster": "🚀", "regression": "❌", "new": "🆕"}
+        for row in rows:
+            delta = f"{(row['ratio'] - 1) * 100:+.1f}%" if row["ratio"] is not None else "нет в базе"
+            print(f"{marks[row['status']]} {row['name']:<34} {delta:>10}")
+    else:
+        print(f"\nБаза {args.baseline} не найдена — сравнение пропущено (--save-baseline создаст её)")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({**current, "comparison": rows}, f, ensure_ascii=False, indent=2)
+
+    regressions = [row for row in rows if row["status"] == "regression"]
+    if regressions:
+        print(f"\n❌ Регрессия производительности: {', '.join(row['name'] for row in regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,467 @@
+# bot/devtools/loadtest.py
+"""
+Нагрузочный прогон бота целиком на одной машине, без сети.
+
+Синтетические апдейты (шаблонные вопросы, меню, анкета заявки, подбор
+масла, технические вопросы через RAG) подаются прямо в Dispatcher из
+bot.main.build_dispatcher — с теми же роутером и middleware, что в бою.
+Вместо Telegram — FakeSession с настраиваемой задержкой, вместо GigaChat
+и OpenRouter — заглушки bot.devtools.api_stubs, вместо SMTP — smtp_stub.
+БД, журнал запросов и индекс Chroma создаются во временном каталоге.
+
+    python -m bot.devtools.loadtest --users 50 --duration 60 \\
+        --embeddings latency=0.15,errors=0.01 --completions latency=2.5
+
+Отчёт: p50/p95/p99 по маршрутам, устойчивая пропускная способность
+(апдейтов в секунду), отклонённые ограничителем частоты, обращения к
+заглушкам и сводка этапов из bot.services.metrics.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import tempfile
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import Message, MessageId, TelegramObject, Update
+
+from bot.devtools.api_stubs import APIStubs, StubProfile
+from bot.devtools.smtp_stub import SMTPStub
+
+logger = logging.getLogger(__name__)
+
+LOADTEST_TOKEN = "123456789:AAloadtestloadtestloadtestloadtest00"
+SUPPORT_CHAT_ID = -1001000000001
+FIRST_USER_ID = 10_000_000
+
+
+# ---------------------------------------------------------------- Telegram
+
+class FakeSession(BaseSession):
+    """
+    Сессия бота без сети: каждый метод Bot API «выполняется» за latency
+    секунд и возвращает правдоподобный ответ. Middleware сессии
+    (например, OutboundLimiter) работают как с настоящей.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.3, seed: Optional[int] = None):
+        super().__init__()
+        self.latency = latency
+        self.jitter = jitter
+        self.calls: Dict[str, int] = {}
+        self._rng = random.Random(seed)
+        self._message_ids = itertools.count(1_000_000)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[TelegramType], timeout: Optional[int] = None) -> TelegramType:
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency * (1 + self._rng.uniform(-self.jitter, self.jitter)))
+
+        returning = method.__returning__
+        if returning is Message:
+            chat_id = method.chat_id
+            chat_type = "private" if isinstance(chat_id, int) and chat_id > 0 else "supergroup"
+            return Message(
+                message_id=next(self._message_ids),
+                date=datetime.now(),
+                chat={"id": chat_id, "type": chat_type},
+                text=getattr(method, "text", None),
+                caption=getattr(method, "caption", None),
+            ).as_(bot)
+        if returning is MessageId:
+            return MessageId(message_id=next(self._message_ids))
+        # bool и Union[Message, bool] (edit_message_text и т.п.)
+        return True
+
+    async def close(self) -> None:
+        pass
+
+    async def stream_content(self, url: str, headers=None, timeout: int = 30, chunk_size: int = 65536,
+                             raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+    @property
+    def sent(self) -> int:
+        return sum(count for name, count in self.calls.items() if name.startswith(("Send", "Copy", "Forward")))
+
+
+# ---------------------------------------------------------------- сценарии
+
+# Шаг сценария: (маршрут для отчёта, "message" | "callback", текст или callback_data)
+Step = Tuple[str, str, str]
+
+CANNED_QUESTIONS = (
+    "Привет", "Добрый день", "Спасибо", "Сколько стоит масло", "Расскажите о компании",
+)
+TECHNICAL_QUESTIONS = (
+    "Какая вязкость масла подходит для дизельного двигателя зимой?",
+    "Чем отличается синтетическое масло от полусинтетики?",
+    "Можно ли смешивать гидравлические масла разных марок?",
+    "Какой допуск API нужен для турбированного двигателя?",
+    "Как часто менять трансмиссионное масло в коробке передач?",
+)
+VEHICLES = (
+    ("select_car", "Kia Rio 2017, 1.6 бензин, пробег 90 000 км, город"),
+    ("select_truck", "КАМАЗ 5490, дизель, дальние рейсы, зима"),
+    ("select_moto", "Honda CB400, 2008 год, четырёхтактный"),
+    ("select_industrial", "гидравлический пресс, 40 °C, непрерывная работа"),
+)
+
+
+def scenario_canned(rng: random.Random, serial: int) -> List[Step]:
+    return [("canned", "message", rng.choice(CANNED_QUESTIONS))]
+
+
+def scenario_menu(rng: random.Random, serial: int) -> List[Step]:
+    return [("start", "message", "/start"), ("menu", "callback", "show_faq"), ("menu", "callback", "main_menu")]
+
+
+def scenario_technical(rng: random.Random, serial: int) -> List[Step]:
+    return [("technical", "message", rng.choice(TECHNICAL_QUESTIONS))]
+
+
+def scenario_selection(rng: random.Random, serial: int) -> List[Step]:
+    vehicle, description = rng.choice(VEHICLES)
+    return [
+        ("menu", "callback", "start_selection"),
+        ("menu", "callback", vehicle),
+        ("selection", "message", description),
+    ]
+
+
+def scenario_lead(rng: random.Random, serial: int) -> List[Step]:
+    return [
+        ("menu", "callback", "start_lead"),
+        ("lead_form", "message", "Иван Нагрузочный"),
+        ("lead_form", "message", f"load{serial}@example.com"),  # email в leads уникален
+        ("lead_form", "message", "+79990000000"),
+        ("lead_submit", "message", rng.choice(("автосервис", "промышленность", "сельхоз"))),
+    ]
+
+
+SCENARIOS: Dict[str, Callable[[random.Random, int], List[Step]]] = {
+    "canned": scenario_canned,
+    "menu": scenario_menu,
+    "technical": scenario_technical,
+    "selection": scenario_selection,
+    "lead": scenario_lead,
+}
+DEFAULT_MIX = "canned=30,technical=30,menu=15,selection=15,lead=10"
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, weight = item.partition("=")
+        if name not in SCENARIOS:
+            raise ValueError(f"Неизвестный сценарий: {name} (есть: {', '.join(SCENARIOS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# ---------------------------------------------------------------- замеры
+
+# Отметка «апдейт дошёл до обработчика» для текущего шага виртуального пользователя
+_step_handled: ContextVar[Optional[List[bool]]] = ContextVar("step_handled", default=None)
+
+
+class HandledMarker(BaseMiddleware):
+    """Inner-middleware: вызывается, только если апдейт не отклонён ограничителем"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        marker = _step_handled.get()
+        if marker is not None:
+            marker[0] = True
+        return await handler(event, data)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Квантиль по отсортированному списку (ближайший ранг)"""
+    if not values:
+        return 0.0
+    # round гасит погрешность float: 0.07 * 100 = 7.000000000000001 — это ранг 7, а не 8
+    rank = math.ceil(round(q * len(values), 9))
+    return values[min(len(values) - 1, max(0, rank - 1))]
+
+
+@dataclass
+class RouteStats:
+    latencies: List[float] = field(default_factory=list)
+    throttled: int = 0
+    errors: int = 0
+
+    def summary(self) -> Dict[str, float]:
+        values = sorted(self.latencies)
+        return {
+            "count": len(values),
+            "throttled": self.throttled,
+            "errors": self.errors,
+            "p50": percentile(values, 0.5),
+            "p95": percentile(values, 0.95),
+            "p99": percentile(values, 0.99),
+            "max": values[-1] if values else 0.0,
+        }
+
+
+class LoadTest:
+    """Виртуальные пользователи по замкнутому циклу: шаг → ответ → пауза → следующий шаг"""
+
+    def __init__(self, dp, bot: Bot, users: int, duration: float, think_time: float,
+                 mix: Dict[str, float], seed: int = 0):
+        self.dp = dp
+        self.bot = bot
+        self.users = users
+        self.duration = duration
+        self.think_time = think_time
+        self.mix = mix
+        self.seed = seed
+        self.routes: Dict[str, RouteStats] = {}
+        self.scenarios_done = 0
+        self.updates = 0
+        self.handled = 0
+        self.elapsed = 0.0
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._serials = itertools.count(1)
+
+    def make_update(self, user_id: int, kind: str, payload: str) -> Update:
+        user = {"id": user_id, "is_bot": False, "first_name": "Нагрузка", "username": f"load{user_id}"}
+        chat = {"id": user_id, "type": "private"}
+        now = int(time.time())
+        if kind == "message":
+            body = {"message": {"message_id": next(self._message_ids), "date": now, "chat": chat, "from": user, "text": payload}}
+        else:
+            # Callback приходит с сообщения бота, у которого была inline-клавиатура
+            bot_message = {"message_id": next(self._message_ids), "date": now, "chat": chat, "text": "Чем могу помочь?"}
+            body = {"callback_query": {
+                "id": str(next(self._update_ids)), "from": user, "chat_instance": "loadtest",
+                "data": payload, "message": bot_message,
+            }}
+        return Update.model_validate({"update_id": next(self._update_ids), **body}, context={"bot": self.bot})
+
+    async def run_step(self, user_id: int, step: Step) -> None:
+        from bot.services.user_tasks import user_tasks
+
+        route, kind, payload = step
+        stats = self.routes.setdefault(route, RouteStats())
+        marker = [False]
+        token = _step_handled.set(marker)
+        started = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, self.make_update(user_id, kind, payload))
+            # Ответ RAG готовится фоновой задачей пользователя — ждём его
+            task = user_tasks.get(user_id)
+            if task is not None and marker[0]:
+                await asyncio.wait([task])
+        except Exception as e:
+            stats.errors += 1
+            logger.warning("Шаг %s пользователя %s упал: %r", route, user_id, e)
+            return
+        finally:
+            _step_handled.reset(token)
+            self.updates += 1
+        if marker[0]:
+            self.handled += 1
+            stats.latencies.append(time.perf_counter() - started)
+        else:
+            stats.throttled += 1
+
+    async def virtual_user(self, index: int, deadline: float) -> None:
+        rng = random.Random(self.seed * 100_003 + index)
+        user_id = FIRST_USER_ID + index
+        names, weights = list(self.mix), list(self.mix.values())
+        # Разносим старт пользователей, чтобы не было синхронного залпа
+        await asyncio.sleep(rng.uniform(0, self.think_time))
+        while time.monotonic() < deadline:
+            scenario = SCENARIOS[rng.choices(names, weights)[0]]
+            for step in scenario(rng, next(self._serials)):
+                await self.run_step(user_id, step)
+                if self.think_time:
+                    await asyncio.sleep(rng.expovariate(1 / self.think_time))
+            self.scenarios_done += 1
+
+    async def run(self) -> None:
+        started = time.monotonic()
+        deadline = started + self.duration
+        await asyncio.gather(*(self.virtual_user(i, deadline) for i in range(self.users)))
+        self.elapsed = time.monotonic() - started
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "users": self.users,
+            "duration": round(self.elapsed, 2),
+            "scenarios": self.scenarios_done,
+            "updates": self.updates,
+            "handled": self.handled,
+            "updates_per_second": round(self.handled / self.elapsed, 2) if self.elapsed else 0.0,
+            "routes": {name: stats.summary() for name, stats in sorted(self.routes.items())},
+        }
+
+
+def format_report(result: Dict[str, Any], session: FakeSession, stubs: APIStubs) -> str:
+    from bot.services.metrics import metrics
+
+    lines = [
+        f"Пользователей: {result['users']}, длительность: {result['duration']:.1f} с, "
+        f"сценариев: {result['scenarios']}",
+        f"Апдейтов: {result['updates']}, обработано: {result['handled']} "
+        f"({result['updates_per_second']:.1f}/с), исходящих сообщений: {session.sent} "
+        f"({session.sent / result['duration'] if result['duration'] else 0:.1f}/с)",
+        "",
+        f"{'маршрут':<12} {'n':>6} {'огр.':>5} {'ошиб.':>5} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  мс",
+    ]
+    for route, row in result["routes"].items():
+        lines.append(
+            f"{route:<12} {row['count']:>6} {row['throttled']:>5} {row['errors']:>5} "
+            f"{row['p50'] * 1000:>8.1f} {row['p95'] * 1000:>8.1f} {row['p99'] * 1000:>8.1f} {row['max'] * 1000:>8.1f}"
+        )
+
+    lines += ["", "Заглушки API (запросов / ошибок):"]
+    for name, stats in stubs.stats.items():
+        lines.append(f"  {name:<12} {stats.requests} / {stats.errors}")
+
+    answers = metrics.answer_counts()
+    if answers:
+        lines += ["", "Исходы ответов:"]
+        for (query_type, outcome), count in sorted(answers.items(), key=lambda item: -item[1]):
+            lines.append(f"  {query_type or '—'} / {outcome}: {count}")
+
+    lines += ["", "Этапы (bot.services.metrics), мс:"]
+    for row in metrics.stage_summary():
+        lines.append(
+            f"  {row['stage']:<16} n={row['count']:<6} p50={row['p50'] * 1000:.1f} "
+            f"p95={row['p95'] * 1000:.1f} p99={row['p99'] * 1000:.1f}"
+        )
+    return "\n".join(lines)
+
+
+# ---------------------------------------------------------------- запуск
+
+def prepare_environment(workdir: str, stubs: APIStubs, smtp: SMTPStub, args: argparse.Namespace) -> None:
+    """
+    Направляет бота на временный каталог и локальные заглушки.
+    Должна вызываться до импорта модулей бота: они читают окружение при импорте.
+    """
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": LOADTEST_TOKEN,
+        "SUPPORT_CHAT_ID": str(SUPPORT_CHAT_ID),
+        "DB_PATH": os.path.join(workdir, "leads.db"),
+        "QUERY_LOG_SPILL_PATH": os.path.join(workdir, "query_log_spill.jsonl"),
+        "ARCHIVE_PATH": os.path.join(workdir, "archive"),
+        "FSM_STORAGE": args.fsm,
+        "FSM_DB_PATH": os.path.join(workdir, "fsm.db"),
+        "RAG_DOCS_PATH": args.docs,
+        "CHROMA_DB_PATH": os.path.join(workdir, "chroma_db"),
+        "GIGACHAT_CLIENT_ID": "loadtest",
+        "GIGACHAT_SECRET": "loadtest",
+        "OPENROUTER_API_KEY": "loadtest",
+        "SMTP_HOST": smtp.host,
+        "SMTP_PORT": str(smtp.port),
+        "SMTP_USE_TLS": "false",
+        "SMTP_USER": "loadtest@example.com",
+        "SMTP_PASSWORD": "loadtest",
+        "EMAIL_RECIPIENTS": "sales@example.com",
+        "METRICS_PORT": "0",
+        "LOG_LEVEL": args.log_level,
+        "TRACE_SAMPLE_RATE": "0",
+        **stubs.env(),
+    })
+    if args.no_throttle:
+        for name in ("CHEAP", "RAG", "GLOBAL_CHEAP", "GLOBAL_RAG"):
+            os.environ[f"THROTTLE_{name}_RATE"] = "1000000"
+            os.environ[f"THROTTLE_{name}_BURST"] = "1000000"
+
+
+async def _run(args: argparse.Namespace) -> Dict[str, Any]:
+    stubs = await APIStubs(
+        oauth=args.oauth, embeddings=args.embeddings, completions=args.completions,
+        token_requests=args.token_requests, seed=args.seed,
+    ).start()
+    smtp = await SMTPStub(port=0).start()
+    workdir = tempfile.mkdtemp(prefix="ecofes-loadtest-")
+    prepare_environment(workdir, stubs, smtp, args)
+
+    # Импорт после настройки окружения; база знаний индексируется через заглушку до прогона
+    print(f"Подготовка: {workdir}, индексация {args.docs}...")
+    from bot.handlers.lead_handler import rag_engine
+    from bot.main import build_dispatcher
+    from bot.middlewares.outbound import outbound_limiter
+    from bot.services.database import init_db
+
+    init_db()
+    session = FakeSession(latency=args.telegram_latency, seed=args.seed)
+    if args.telegram_limits:
+        session.middleware(outbound_limiter)
+    bot = Bot(token=LOADTEST_TOKEN, session=session)
+    dp = build_dispatcher()
+    dp.message.middleware(HandledMarker())
+    dp.callback_query.middleware(HandledMarker())
+
+    test = LoadTest(dp, bot, args.users, args.duration, args.think_time, parse_mix(args.mix), args.seed)
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    try:
+        # Фоновый прогрев уже запущен on_startup — дожидаемся его, чтобы не мерить индексацию
+        await asyncio.to_thread(rag_engine.warm_up)
+        print(f"Прогон: {args.users} пользователей, {args.duration:.0f} с...")
+        await test.run()
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await stubs.stop()
+        await smtp.stop()
+
+    result = test.report()
+    result["telegram_calls"] = dict(session.calls)
+    result["stubs"] = {name: stats.__dict__ for name, stats in stubs.stats.items()}
+    result["emails"] = len(smtp.messages)
+    print()
+    print(format_report(result, session, stubs))
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота без сети")
+    parser.add_argument("--users", type=int, default=20, help="виртуальных пользователей")
+    parser.add_argument("--duration", type=float, default=30, help="длительность, с")
+    parser.add_argument("--think-time", type=float, default=1.0, help="средняя пауза между шагами, с")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"веса сценариев (по умолчанию {DEFAULT_MIX})")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="задержка Bot API, с")
+    parser.add_argument("--telegram-limits", action="store_true", help="пропускать отправки через OutboundLimiter")
+    parser.add_argument("--no-throttle", action="store_true", help="снять лимиты ThrottlingMiddleware")
+    parser.add_argument("--oauth", type=StubProfile.parse, default=StubProfile(latency=0.2), help="профиль OAuth")
+    parser.add_argument("--embeddings", type=StubProfile.parse, default=StubProfile(latency=0.15), help="профиль эмбеддингов")
+    parser.add_argument("--completions", type=StubProfile.parse, default=StubProfile(latency=2.0), help="профиль OpenRouter")
+    parser.add_argument("--token-requests", type=int, default=0, help="через сколько запросов токен GigaChat истекает")
+    parser.add_argument("--fsm", choices=("memory", "sqlite"), default="memory", help="хранилище FSM")
+    parser.add_argument("--docs", default="data/docs", help="база знаний для индексации")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="сохранить результат в JSON")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level)
+    result = asyncio.run(_run(args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,563 @@
+# bot/devtools/retrieval_eval.py
+"""
+Оценка качества и скорости поиска по базе знаний на размеченных вопросах.
+
+Размеченный набор строится из пар вопрос/ответ базы знаний:
+faq.txt («Вопрос: ...» / «Ответ: ...») и 2faq.txt (строка-вопрос с «?»
+и абзац ответа под ней). Ожидаемый результат — фрагменты, которые
+пересекаются с текстом ответа, поэтому разметка не зависит от разбиения.
+
+Корпус разбивается так же, как в RAGEngine (по словам, chunk_size слов,
+слишком длинные фрагменты пропускаются, в эмбеддинг идут первые tr_text
+символов), индексируется выбранными бэкендами эмбеддингов и векторного
+поиска, и каждый вопрос прогоняется через поиск. Отчёт: recall@k, MRR,
+задержка эмбеддинга и поиска на запрос; для нескольких индексов — память
+под векторы и разница recall@k относительно float32.
+
+    python -m bot.devtools.retrieval_eval                                 # hash + numpy, без сети
+    python -m bot.devtools.retrieval_eval --embeddings gigachat --index chroma
+    python -m bot.devtools.retrieval_eval --chunk-size 100,200,300 --overlap 0,50 --json eval.json
+    python -m bot.devtools.retrieval_eval --index numpy,float16,int8,int8+rescore   # квантование
+
+Несколько значений через запятую дают сетку конфигураций с общей таблицей.
+Эмбеддинги кэшируются (--cache), так что повторные прогоны по GigaChat
+не тратят запросы на уже виденные фрагменты.
+"""
+import argparse
+import base64
+import glob
+import hashlib
+import itertools
+import json
+import os
+import re
+import statistics
+import tempfile
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence
+
+# Значения по умолчанию — как в bot/services/rag_engine.py
+DEFAULT_CHUNK_SIZE = 200
+DEFAULT_N_RESULTS = 3
+DEFAULT_TR_TEXT = 1000
+# Кэш — артефакт прогона, в дереве исходников ему не место
+DEFAULT_CACHE_PATH = os.path.join(tempfile.gettempdir(), "ecofes-eval", "embeddings_cache.json")
+K_VALUES = (1, 3, 5, 10)
+# Фрагмент релевантен, если содержит столько слов ответа (или весь ответ, если он короче)
+MIN_OVERLAP_WORDS = 10
+
+_QUESTION_RE = re.compile(r"^Вопрос:\s*", re.MULTILINE)
+
+
+# ---------------------------------------------------------------- размеченный набор
+
+@dataclass
+class LabeledQuestion:
+    question: str
+    source: str
+    answer_start: int  # позиция ответа в словах файла
+    answer_end: int
+
+
+def _word_offset(content: str, char_offset: int) -> int:
+    return len(content[:char_offset].split())
+
+
+def parse_prefixed_faq(path: str, content: str) -> List[LabeledQuestion]:
+    """faq.txt: «Вопрос: ...» и «Ответ: ...» до следующего вопроса"""
+    items = []
+    starts = [m.start() for m in _QUESTION_RE.finditer(content)] + [len(content)]
+    for begin, end in zip(starts, starts[1:]):
+        block = content[begin:end]
+        marker = block.find("Ответ:")
+        if marker < 0:
+            continue
+        question = block[len("Вопрос:"):marker].strip()
+        answer_begin = begin + marker + len("Ответ:")
+        items.append(LabeledQuestion(
+            question=" ".join(question.split()),
+            source=path,
+            answer_start=_word_offset(content, answer_begin),
+            answer_end=_word_offset(content, end),
+        ))
+    return items
+
+
+def parse_paragraph_faq(path: str, content: str) -> List[LabeledQuestion]:
+    """2faq.txt: строка, оканчивающаяся на «?», и абзац ответа до пустой строки"""
+    items = []
+    offset = 0
+    paragraphs = []
+    for paragraph in re.split(r"\n\s*\n", content):
+        begin = content.index(paragraph, offset)
+        offset = begin + len(paragraph)
+        paragraphs.append((begin, paragraph))
+
+    for begin, paragraph in paragraphs:
+        first_line, _, rest = paragraph.strip().partition("\n")
+        if not first_line.rstrip().endswith("?") or not rest.strip():
+            continue
+        answer_begin = begin + paragraph.index(rest)
+        items.append(LabeledQuestion(
+            question=first_line.strip(),
+            source=path,
+            answer_start=_word_offset(content, answer_begin),
+            answer_end=_word_offset(content, begin + len(paragraph)),
+        ))
+    return items
+
+
+def build_labeled_set(docs_path: str) -> List[LabeledQuestion]:
+    items = []
+    for path in sorted(glob.glob(f"{docs_path}/**/*.txt", recursive=True)):
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read().strip()
+        if _QUESTION_RE.search(content):
+            items += parse_prefixed_faq(path, content)
+        elif os.path.basename(path) == "2faq.txt":
+            items += parse_paragraph_faq(path, content)
+    return items
+
+
+# ---------------------------------------------------------------- корпус
+
+@dataclass
+class Chunk:
+    id: str
+    source: str
+    start: int  # слова [start, end) файла
+    end: int
+    text: str
+
+
+def build_chunks(docs_path: str, chunk_size: int, overlap: int, tr_text: int) -> List[Chunk]:
+    """Разбиение как в RAGEngine._load_and_index_docs, с необязательным перекрытием"""
+    step = max(chunk_size - overlap, 1)
+    chunks = []
+    for path in sorted(glob.glob(f"{docs_path}/**/*.*", recursive=True)):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                content = f.read().strip()
+        except (OSError, UnicodeDecodeError):
+            continue
+        if len(content) < 10:
+            continue
+        words = content.split()
+        for i, start in enumerate(range(0, len(words), step)):
+            text = " ".join(words[start:start + chunk_size])
+            # Как в боте: слишком длинные фрагменты не индексируются
+            if len(text) > tr_text * 2:
+                continue
+            chunks.append(Chunk(f"{os.path.basename(path)}_{i}", path, start, min(start + chunk_size, len(words)), text))
+            if start + chunk_size >= len(words):
+                break
+    return chunks
+
+
+def relevant_ids(question: LabeledQuestion, chunks: Sequence[Chunk]) -> set:
+    need = min(MIN_OVERLAP_WORDS, question.answer_end - question.answer_start)
+    return {
+        chunk.id for chunk in chunks
+        if chunk.source == question.source
+        and min(chunk.end, question.answer_end) - max(chunk.start, question.answer_start) >= max(need, 1)
+    }
+
+
+# ---------------------------------------------------------------- эмбеддинги
+
+class EmbeddingBackend:
+    name = "base"
+    batch_size = 16
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+
+class HashEmbeddings(EmbeddingBackend):
+    """Мешок слов через crc32 — без сети и моделей, для сравнения конфигураций между собой"""
+    name = "hash"
+    batch_size = 256
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        from bot.devtools.api_stubs import hash_embedding
+        return [hash_embedding(text) for text in texts]
+
+
+class GigaChatEmbeddings(EmbeddingBackend):
+    """Те же запросы, что у RAGEngine; ключи и адреса — из окружения"""
+    name = "gigachat"
+
+    def __init__(self):
+        import httpx
+        from bot.config import load_config
+
+        load_config()
+        self.client_id = os.getenv("GIGACHAT_CLIENT_ID")
+        self.secret = os.getenv("GIGACHAT_SECRET")
+        if not self.client_id or not self.secret:
+            raise EnvironmentError("GIGACHAT_CLIENT_ID и GIGACHAT_SECRET должны быть заданы в .env")
+        self.oauth_url = os.getenv("GIGACHAT_OAUTH_URL", "https://ngw.devices.sberbank.ru:9443/api/v2/oauth")
+        self.embeddings_url = os.getenv("GIGACHAT_EMBEDDINGS_URL", "https://gigachat.devices.sberbank.ru/api/v1/embeddings")
+        self.http = httpx.Client(verify=False, timeout=float(os.getenv("GIGACHAT_TIMEOUT", "20")))
+        self.token = None
+
+    def _refresh_token(self) -> None:
+        credentials = base64.b64encode(f"{self.client_id}:{self.secret}".encode()).decode()
+        response = self.http.post(
+            self.oauth_url,
+            headers={"Authorization": f"Basic {credentials}", "RqUID": str(uuid.uuid4()), "Accept": "application/json"},
+            data={"scope": "GIGACHAT_API_PERS"},
+        )
+        response.raise_for_status()
+        self.token = response.json()["access_token"]
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        if self.token is None:
+            self._refresh_token()
+        payload = {"model": "Embeddings", "input": texts}
+        response = self.http.post(self.embeddings_url, headers={"Authorization": f"Bearer {self.token}"}, json=payload)
+        if response.status_code == 401:
+            self._refresh_token()
+            response = self.http.post(self.embeddings_url, headers={"Authorization": f"Bearer {self.token}"}, json=payload)
+        response.raise_for_status()
+        return [item["embedding"] for item in sorted(response.json()["data"], key=lambda item: item["index"])]
+
+
+class SentenceTransformerEmbeddings(EmbeddingBackend):
+    """Локальная модель sentence-transformers (из requirements-ml.txt)"""
+    name = "sentence-transformers"
+    batch_size = 64
+
+    def __init__(self, model: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise RuntimeError("Для --embeddings sentence-transformers нужен пакет sentence-transformers")
+        self.name = f"sentence-transformers:{model}"
+        self.model = SentenceTransformer(model)
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return self.model.encode(texts, normalize_embeddings=True).tolist()
+
+
+EMBEDDING_BACKENDS: Dict[str, Callable[[], EmbeddingBackend]] = {
+    "hash": HashEmbeddings,
+    "gigachat": GigaChatEmbeddings,
+    "sentence-transformers": SentenceTransformerEmbeddings,
+}
+
+
+class EmbeddingCache:
+    """Кэш эмбеддингов в JSON: ключ — бэкенд и sha1 текста"""
+
+    def __init__(self, backend: EmbeddingBackend, path: Optional[str]):
+        self.backend = backend
+        self.path = path
+        self.requests = 0
+        self._data: Dict[str, List[float]] = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._data = json.load(f)
+
+    def _key(self, text: str) -> str:
+        return f"{self.backend.name}:{hashlib.sha1(text.encode()).hexdigest()}"
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        missing = list(dict.fromkeys(text for text in texts if self._key(text) not in self._data))
+        for start in range(0, len(missing), self.backend.batch_size):
+            batch = missing[start:start + self.backend.batch_size]
+            self.requests += 1
+            for text, vector in zip(batch, self.backend.embed(batch)):
+                self._data[self._key(text)] = vector
+        return [self._data[self._key(text)] for text in texts]
+
+    def save(self) -> None:
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self._data, f)
+
+
+# ---------------------------------------------------------------- векторный поиск
+
+class VectorIndex:
+    name = "base"
+
+    def build(self, ids: List[str], vectors: List[List[float]]) -> None:
+        raise NotImplementedError
+
+    def search(self, vector: List[float], k: int) -> List[str]:
+        raise NotImplementedError
+
+    def memory_bytes(self) -> Optional[int]:
+        """Память под векторы в процессе; None — не измеряется (Chroma)"""
+        return None
+
+
+class NumpyIndex(VectorIndex):
+    """Полный перебор по косинусной близости"""
+    name = "numpy"
+
+    def build(self, ids: List[str], vectors: List[List[float]]) -> None:
+        import numpy as np
+
+        self.np = np
+        self.ids = ids
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.matrix = matrix / np.where(norms == 0, 1, norms)
+
+    def search(self, vector: List[float], k: int) -> List[str]:
+        np = self.np
+        query = np.asarray(vector, dtype=np.float32)
+        scores = self.matrix @ (query / (np.linalg.norm(query) or 1))
+        k = min(k, len(self.ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return [self.ids[i] for i in top[np.argsort(-scores[top])]]
+
+    def memory_bytes(self) -> Optional[int]:
+        return self.matrix.nbytes
+
+
+class QuantizedIndex(VectorIndex):
+    """Хранилище бота (bot/services/embedding_store.py): float16 или int8, с пересчётом по float32 или без"""
+
+    def __init__(self, dtype: str, rescore: int = 0):
+        self.dtype = dtype
+        self.rescore = rescore
+        self.name = f"{dtype}+r{rescore}" if rescore else dtype
+
+    def build(self, ids: List[str], vectors: List[List[float]]) -> None:
+        from bot.services.embedding_store import EmbeddingStore
+
+        self.store = EmbeddingStore.build(ids, vectors, dtype=self.dtype, keep_full=bool(self.rescore))
+
+    def search(self, vector: List[float], k: int) -> List[str]:
+        return [self.store.ids[i] for i, _ in self.store.search(vector, k, rescore=self.rescore)]
+
+    def memory_bytes(self) -> Optional[int]:
+        # Полноточные векторы в боте читаются с диска через memmap — в памяти только коды
+        size = self.store.codes.nbytes
+        return size + (self.store.scales.nbytes if self.store.scales is not None else 0)
+
+
+class ChromaIndex(VectorIndex):
+    """Chroma в памяти с настройками коллекции бота (расстояние l2 по умолчанию)"""
+    name = "chroma"
+
+    def build(self, ids: List[str], vectors: List[List[float]]) -> None:
+        try:
+            import chromadb
+        except ImportError:
+            raise RuntimeError("Для --index chroma нужен пакет chromadb")
+        client = chromadb.EphemeralClient()
+        name = f"eval_{uuid.uuid4().hex[:8]}"
+        self.collection = client.get_or_create_collection(name)
+        for start in range(0, len(ids), 1000):
+            self.collection.add(ids=ids[start:start + 1000], embeddings=vectors[start:start + 1000])
+
+    def search(self, vector: List[float], k: int) -> List[str]:
+        return self.collection.query(query_embeddings=[vector], n_results=k)["ids"][0]
+
+
+VECTOR_BACKENDS: Dict[str, Callable[[], VectorIndex]] = {
+    "numpy": NumpyIndex,
+    "chroma": ChromaIndex,
+    "float16": lambda: QuantizedIndex("float16"),
+    "int8": lambda: QuantizedIndex("int8"),
+    "int8+rescore": lambda: QuantizedIndex("int8", rescore=20),
+}
+
+
+# ---------------------------------------------------------------- оценка
+
+@dataclass
+class EvalConfig:
+    embeddings: str = "hash"
+    index: str = "numpy"
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+    overlap: int = 0
+    tr_text: int = DEFAULT_TR_TEXT
+    n_results: int = DEFAULT_N_RESULTS
+    keywords: bool = False  # дополнять запрос ключевыми словами, как answer_with_rag
+
+
+@dataclass
+class EvalResult:
+    config: EvalConfig
+    questions: int
+    chunks: int
+    index_seconds: float
+    recall: Dict[int, float]
+    mrr: float
+    hit_at_n: float  # доля вопросов, где релевантный фрагмент попал в n_results (что видит LLM)
+    embed_ms: Dict[str, float]
+    search_ms: Dict[str, float]
+    memory_bytes: Optional[int] = None  # векторы индекса в памяти процесса
+    misses: List[str] = field(default_factory=list)
+
+
+def _latency(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    if not values:
+        return {"mean": 0.0, "p50": 0.0, "p95": 0.0}
+    return {
+        "mean": round(statistics.mean(values) * 1000, 3),
+        "p50": round(values[len(values) // 2] * 1000, 3),
+        "p95": round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 3),
+    }
+
+
+def evaluate(config: EvalConfig, docs_path: str, questions: List[LabeledQuestion],
+             cache: EmbeddingCache) -> EvalResult:
+    chunks = build_chunks(docs_path, config.chunk_size, config.overlap, config.tr_text)
+    index = VECTOR_BACKENDS[config.index]()
+
+    started = time.perf_counter()
+    vectors = cache.embed([chunk.text[:config.tr_text] for chunk in chunks])
+    index.build([chunk.id for chunk in chunks], vectors)
+    index_seconds = time.perf_counter() - started
+
+    classifier = None
+    if config.keywords:
+        from bot.services.query_classifier import QueryClassifier
+        classifier = QueryClassifier()
+
+    depth = max(max(K_VALUES), config.n_results)
+    hits = {k: 0 for k in K_VALUES}
+    hit_at_n = 0
+    reciprocal_ranks = []
+    embed_times, search_times, misses = [], [], []
+    for question in questions:
+        expected = relevant_ids(question, chunks)
+        text = question.question
+        if classifier is not None:
+            keywords = classifier.get_query_keywords(text)
+            text = f"{text} {' '.join(keywords)}" if keywords else text
+
+        started = time.perf_counter()
+        vector = cache.backend.embed([text[:config.tr_text]])[0]
+        embed_times.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        found = index.search(vector, depth)
+        search_times.append(time.perf_counter() - started)
+
+        rank = next((i + 1 for i, chunk_id in enumerate(found) if chunk_id in expected), None)
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+        for k in K_VALUES:
+            hits[k] += rank is not None and rank <= k
+        hit_at_n += rank is not None and rank <= config.n_results
+        if rank is None or rank > config.n_results:
+            misses.append(question.question)
+
+    total = len(questions) or 1
+    return EvalResult(
+        config=config,
+        questions=len(questions),
+        chunks=len(chunks),
+        index_seconds=round(index_seconds, 3),
+        recall={k: round(hits[k] / total, 3) for k in K_VALUES},
+        mrr=round(sum(reciprocal_ranks) / total, 3),
+        hit_at_n=round(hit_at_n / total, 3),
+        embed_ms=_latency(embed_times),
+        search_ms=_latency(search_times),
+        memory_bytes=index.memory_bytes(),
+        misses=misses,
+    )
+
+
+def format_results(results: List[EvalResult]) -> str:
+    header = (
+        f"{'эмбеддинги':<12} {'индекс':<12} {'chunk':>5} {'overl':>5} {'n':>2} {'kw':>2} {'фрагм':>5} "
+        + " ".join(f"{'R@' + str(k):>5}" for k in K_VALUES)
+        + f" {'MRR':>5} {'hit@n':>5} {'emb p50':>8} {'srch p50':>8} {'srch p95':>8}"
+    )
+    lines = [header]
+    for r in results:
+        c = r.config
+        lines.append(
+            f"{c.embeddings[:12]:<12} {c.index:<12} {c.chunk_size:>5} {c.overlap:>5} {c.n_results:>2} "
+            f"{'+' if c.keywords else '-':>2} {r.chunks:>5} "
+            + " ".join(f"{r.recall[k]:>5.2f}" for k in K_VALUES)
+            + f" {r.mrr:>5.2f} {r.hit_at_n:>5.2f} {r.embed_ms['p50']:>6.2f}мс {r.search_ms['p50']:>6.3f}мс {r.search_ms['p95']:>6.3f}мс"
+        )
+    return "\n".join(lines)
+
+
+def format_comparison(results: List[EvalResult]) -> str:
+    """Память и разница recall@k относительно float32 (numpy) при тех же фрагментах"""
+    lines = [
+        f"{'индекс':<12} {'chunk':>5} {'память':>9} {'экономия':>8} "
+        + " ".join(f"{'ΔR@' + str(k):>6}" for k in K_VALUES) + f" {'ΔMRR':>6}"
+    ]
+    for r in results:
+        base = next((b for b in results if b.config.index == "numpy"
+                     and (b.config.chunk_size, b.config.overlap, b.config.tr_text)
+                     == (r.config.chunk_size, r.config.overlap, r.config.tr_text)), None)
+        if base is None or r.memory_bytes is None or not base.memory_bytes:
+            continue
+        lines.append(
+            f"{r.config.index:<12} {r.config.chunk_size:>5} {r.memory_bytes / 1024:>7.0f}КБ "
+            f"{1 - r.memory_bytes / base.memory_bytes:>8.0%} "
+            + " ".join(f"{r.recall[k] - base.recall[k]:>+6.3f}" for k in K_VALUES)
+            + f" {r.mrr - base.mrr:>+6.3f}"
+        )
+    return "\n".join(lines) if len(lines) > 1 else ""
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Оценка поиска по базе знаний на вопросах из FAQ")
+    parser.add_argument("--docs", default="data/docs")
+    parser.add_argument("--embeddings", default="hash", choices=list(EMBEDDING_BACKENDS))
+    parser.add_argument("--index", default="numpy", help=f"бэкенды через запятую: {', '.join(VECTOR_BACKENDS)}")
+    parser.add_argument("--chunk-size", type=_int_list, default=[DEFAULT_CHUNK_SIZE], help="слов во фрагменте (можно списком)")
+    parser.add_argument("--overlap", type=_int_list, default=[0], help="перекрытие фрагментов, слов")
+    parser.add_argument("--tr-text", type=_int_list, default=[DEFAULT_TR_TEXT], help="символов текста в эмбеддинг")
+    parser.add_argument("--n-results", type=int, default=DEFAULT_N_RESULTS, help="сколько фрагментов уходит в LLM")
+    parser.add_argument("--keywords", action="store_true", help="дополнять запрос ключевыми словами классификатора")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="кэш эмбеддингов ('' — без кэша)")
+    parser.add_argument("--show-misses", action="store_true", help="вывести вопросы без релевантного фрагмента в n_results")
+    parser.add_argument("--json", help="сохранить результаты в JSON")
+    args = parser.parse_args(argv)
+
+    questions = build_labeled_set(args.docs)
+    if not questions:
+        raise SystemExit(f"В {args.docs} не найдено пар вопрос/ответ")
+    print(f"Размеченных вопросов: {len(questions)}")
+
+    backend = EMBEDDING_BACKENDS[args.embeddings]()
+    cache = EmbeddingCache(backend, args.cache or None)
+    results = []
+    indexes = [name.strip() for name in args.index.split(",") if name.strip()]
+    try:
+        for index, chunk_size, overlap, tr_text in itertools.product(indexes, args.chunk_size, args.overlap, args.tr_text):
+            if overlap >= chunk_size:
+                continue
+            config = EvalConfig(args.embeddings, index, chunk_size, overlap, tr_text, args.n_results, args.keywords)
+            results.append(evaluate(config, args.docs, questions, cache))
+    finally:
+        cache.save()
+
+    print(format_results(results))
+    comparison = format_comparison(results)
+    if len(indexes) > 1 and comparison:
+        print("\nПамять и recall относительно float32:")
+        print(comparison)
+    if args.show_misses:
+        for result in results:
+            print(f"\nПромахи ({result.config.index}, chunk={result.config.chunk_size}, overlap={result.config.overlap}):")
+            for question in result.misses:
+                print(f"  • {question}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump([asdict(result) for result in results], f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# bot/devtools/smtp_stub.py
+"""
+Локальный SMTP-стенд для проверки рассылки писем без реального почтового сервера.
+
+Принимает любые AUTH/MAIL/RCPT, сохраняет письма в память и (опционально)
+в каталог .eml-файлов. Запуск:
+
+    python -m bot.devtools.smtp_stub --port 1025 --maildir data/smtp_stub
+
+Настройки бота для работы со стендом:
+    SMTP_HOST=127.0.0.1 SMTP_PORT=1025 SMTP_USE_TLS=false
+"""
+import argparse
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+from email import message_from_bytes
+from email.message import Message
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ReceivedMail:
+    sender: str
+    recipients: List[str]
+    data: bytes
+    session_id: int  # номер SMTP-сессии, в которой пришло письмо
+
+    @property
+    def message(self) -> Message:
+        return message_from_bytes(self.data)
+
+
+@dataclass
+class SMTPStub:
+    """Минимальный SMTP-сервер на asyncio (EHLO, AUTH, MAIL, RCPT, DATA, NOOP, RSET, QUIT)"""
+
+    host: str = "127.0.0.1"
+    port: int = 1025
+    maildir: Optional[str] = None
+    messages: List[ReceivedMail] = field(default_factory=list)
+    sessions: int = 0
+    _server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> "SMTPStub":
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self.maildir:
+            os.makedirs(self.maildir, exist_ok=True)
+        logger.info("SMTP-стенд слушает %s:%s", self.host, self.port)
+        return self
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.sessions += 1
+        session_id = self.sessions
+        sender, recipients = "", []
+
+        async def reply(line: str) -> None:
+            writer.write((line + "\r\n").encode())
+            await writer.drain()
+
+        await reply("220 ecofes-smtp-stub ready")
+        try:
+            while True:
+                raw = await reader.readline()
+                if not raw:
+                    break
+                line = raw.decode("utf-8", "replace").rstrip("\r\n")
+                command = line.split(" ", 1)[0].upper()
+
+                if command in ("EHLO", "HELO"):
+                    await reply("250-ecofes-smtp-stub")
+                    await reply("250-8BITMIME")
+                    await reply("250 AUTH PLAIN LOGIN")
+                elif command == "AUTH":
+                    parts = line.split()
+                    if len(parts) >= 2 and parts[1].upper() == "LOGIN":
+                        if len(parts) == 2:
+                            await reply("334 VXNlcm5hbWU6")
+                            await reader.readline()
+                        await reply("334 UGFzc3dvcmQ6")
+                        await reader.readline()
+                    await reply("235 2.7.0 Authentication successful")
+                elif command == "MAIL":
+                    sender, recipients = line.split(":", 1)[1].strip().strip("<>").split(">")[0], []
+                    await reply("250 OK")
+                elif command == "RCPT":
+                    recipients.append(line.split(":", 1)[1].strip().strip("<>").split(">")[0])
+                    await reply("250 OK")
+                elif command == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    chunks = []
+                    while True:
+                        data_line = await reader.readline()
+                        if data_line in (b".\r\n", b".\n", b""):
+                            break
+                        if data_line.startswith(b".."):
+                            data_line = data_line[1:]
+                        chunks.append(data_line)
+                    self._store(ReceivedMail(sender, recipients, b"".join(chunks), session_id))
+                    await reply("250 OK: queued")
+                elif command in ("NOOP", "RSET"):
+                    await reply("250 OK")
+                elif command == "QUIT":
+                    await reply("221 Bye")
+                    break
+                else:
+                    await reply("502 Command not implemented")
+        finally:
+            writer.close()
+
+    def _store(self, mail: ReceivedMail) -> None:
+        self.messages.append(mail)
+        subject = mail.message.get("Subject", "")
+        logger.info("📧 Письмо от %s → %s: %s", mail.sender, ", ".join(mail.recipients), subject)
+        if self.maildir:
+            filename = f"{datetime.utcnow():%Y%m%d_%H%M%S_%f}.eml"
+            with open(os.path.join(self.maildir, filename), "wb") as f:
+                f.write(mail.data)
+
+
+async def _serve(host: str, port: int, maildir: Optional[str]) -> None:
+    stub = await SMTPStub(host=host, port=port, maildir=maildir).start()
+    print(f"✅ SMTP-стенд запущен на {host}:{stub.port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await stub.stop()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Локальный SMTP-стенд")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1025)
+    parser.add_argument("--maildir", help="каталог для сохранения .eml")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_serve(args.host, args.port, args.maildir))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
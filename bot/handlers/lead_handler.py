@@ -1,16 +1,34 @@
+import asyncio
+import html
 import os
+import tempfile
 from aiogram import Router, F, Bot
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove, FSInputFile
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
-from bot.services.database import SessionLocal, Lead, UserQuery
+from aiogram.filters import Command, CommandObject
+from aiogram.utils.chat_action import ChatActionSender
+from bot.services.database import SessionLocal, Lead
+from bot.services.query_log import query_log
+from bot.services.analytics import get_stats, format_stats
+from bot.services.exporter import export, default_filename, parse_date, EXPORT_KINDS, EXPORT_FORMATS
 from bot.utils.helpers import is_valid_email
-from bot.services.email_sender import send_lead_email
+from bot.services.email_outbox import enqueue_lead_email, outbox_sender
+from bot.services.user_tasks import user_tasks
+from bot.services.support_routing import support_router, SupportThread
+from bot.services.broadcast import broadcast_runner, format_broadcast
+from bot.services.metrics import metrics, current_query_type, format_perf
+from bot.services.tracing import trace_context
 from bot.services.rag_engine import RAGEngine
+from bot.services.faq_index import faq_index
+from bot.services.catalog import product_catalog, format_catalog_table, format_shortlist
+from bot.services.selection_prefetch import SelectionPrefetcher
+from bot.services.kb_reload import KnowledgeBaseReloader, format_reload
 from bot.services.llm_service import query_openrouter
 from bot.services.query_classifier import QueryClassifier
 from bot.services.chat_responses import ChatResponses
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
 import logging
 import re
 
@@ -27,13 +45,18 @@ if SUPPORT_CHAT_ID:
 else:
     SUPPORT_CHAT_ID = None
 
-print(f"🔧 [DEBUG] SUPPORT_CHAT_ID = {SUPPORT_CHAT_ID}")
+logger.info("Чат поддержки: %s", SUPPORT_CHAT_ID)
 
 # Создание роутера
 router = Router()
 
+# Типы запросов, для которых сначала ищем ответ в FAQ
+FAQ_QUERY_TYPES = ("technical", "general", "unknown")
+
 # Инициализация компонентов
 rag_engine = RAGEngine()
+selection_prefetcher = SelectionPrefetcher(rag_engine)
+kb_reloader = KnowledgeBaseReloader(rag_engine)
 query_classifier = QueryClassifier()
 chat_responses = ChatResponses()
 
@@ -157,6 +180,8 @@ async def vehicle_type_callback(callback: CallbackQuery, state: FSMContext):
     vehicle_type = vehicle_types.get(callback.data, "техники")
     
     await state.update_data(vehicle_type=callback.data)
+    # Пока клиент пишет о технике, собираем кандидатов из базы знаний
+    selection_prefetcher.start(callback.from_user.id, callback.data)
     
     info_text = (
         f"Отлично! Подбираем масло для {vehicle_type}.\n\n"
@@ -173,6 +198,16 @@ async def vehicle_type_callback(callback: CallbackQuery, state: FSMContext):
     await state.set_state(SelectionForm.waiting_for_vehicle_info)
     await callback.answer()
 
+SELECTION_SYSTEM_PROMPT = (
+    "Вы — эксперт по подбору моторных масел ECOFES. "
+    "На основе предоставленной информации о технике клиента, "
+    "подберите наиболее подходящие масла из ассортимента ECOFES. "
+    "ВАЖНО: рекомендуйте только те продукты, которые есть в контексте. "
+    "Объясните, почему именно эти масла подходят. "
+    "Укажите конкретные марки масел, их характеристики и преимущества. "
+    "Если нужна дополнительная информация — попросите её у клиента."
+)
+
 @router.message(SelectionForm.waiting_for_vehicle_info)
 async def process_vehicle_info(message: Message, state: FSMContext):
     """Обработка информации о технике и подбор масла"""
@@ -184,75 +219,99 @@ async def process_vehicle_info(message: Message, state: FSMContext):
     
     # Формируем специальный запрос для подбора масла
     selection_query = f"Подбор масла для {vehicle_info}"
+    outcome = "error"
+    received_at = datetime.utcnow()
+    current_query_type.set("vehicle_selection")
     
     try:
-        # Ищем в базе знаний
-        contexts = rag_engine.search(selection_query)
-        
-        if contexts:
-            # Формируем системный промпт для подбора масла
-            system_prompt = (
-                "Вы — эксперт по подбору моторных масел ECOFES. "
-                "На основе предоставленной информации о технике клиента, "
-                "подберите наиболее подходящие масла из ассортимента ECOFES. "
-                "ВАЖНО: рекомендуйте только те продукты, которые есть в контексте. "
-                "Объясните, почему именно эти масла подходят. "
-                "Укажите конкретные марки масел, их характеристики и преимущества. "
-                "Если нужна дополнительная информация — попросите её у клиента."
-            )
-            
-            context = "\n\n".join(contexts[:3])  # Используем больше контекста
+        # Кандидаты из каталога продукции — детерминированно, без поиска по базе знаний
+        request = product_catalog.parse_request(vehicle_info, vehicle_type)
+        candidates = product_catalog.shortlist(request)
+
+        if candidates:
             full_query = (
-                f"Контекст (продукты ECOFES):\n{context}\n\n"
+                f"Подходящие продукты ECOFES (каталог):\n{format_catalog_table(candidates)}\n\n"
                 f"Информация о технике клиента: {vehicle_info}\n"
                 f"Тип техники: {vehicle_type}\n\n"
-                f"Задача: подобрать оптимальное масло"
+                f"Задача: выбрать из таблицы оптимальное масло"
             )
-            
-            # Получаем рекомендацию от LLM
-            recommendation = await query_openrouter(system_prompt, full_query)
-            
+            recommendation = await query_openrouter(SELECTION_SYSTEM_PROMPT, full_query)
+
             if recommendation:
+                outcome = "catalog"
                 await message.answer(
                     f"✅ <b>Рекомендация по подбору масла:</b>\n\n{recommendation}",
                     parse_mode="HTML",
                     reply_markup=get_inline_menu()
                 )
             else:
+                # LLM недоступна — отдаём шорт-лист каталога как есть
+                outcome = "fallback"
+                recommendation = f"Подходящие масла ECOFES:\n{format_shortlist(candidates)}"
                 await message.answer(
-                    chat_responses.get_technical_help_response(),
+                    f"✅ <b>Подходящие масла ECOFES:</b>\n\n{format_shortlist(candidates)}\n\n"
+                    "Для точного подбора уточните допуск производителя или свяжитесь с нашим специалистом.",
+                    parse_mode="HTML",
                     reply_markup=get_inline_menu()
                 )
         else:
-            # Если в базе ничего не найдено
-            await message.answer(
-                "К сожалению, в базе знаний не нашлось точной информации для вашей техники. "
-                "Для персонального подбора масла рекомендую связаться с нашим специалистом.",
-                reply_markup=get_inline_menu()
-            )
-            
+            # Каталог не покрывает запрос — берём предвыбранные чанки базы знаний,
+            # а если их нет или они не подходят к тексту, ищем обычным способом
+            contexts = await selection_prefetcher.contexts(message.from_user.id, vehicle_type, vehicle_info, 3)
+            if contexts is None:
+                contexts = await rag_engine.asearch(selection_query)
+
+            if contexts:
+                context = "\n\n".join(contexts[:3])  # Используем больше контекста
+                full_query = (
+                    f"Контекст (продукты ECOFES):\n{context}\n\n"
+                    f"Информация о технике клиента: {vehicle_info}\n"
+                    f"Тип техники: {vehicle_type}\n\n"
+                    f"Задача: подобрать оптимальное масло"
+                )
+
+                # Получаем рекомендацию от LLM
+                recommendation = await query_openrouter(SELECTION_SYSTEM_PROMPT, full_query)
+
+                if recommendation:
+                    outcome = "rag"
+                    await message.answer(
+                        f"✅ <b>Рекомендация по подбору масла:</b>\n\n{recommendation}",
+                        parse_mode="HTML",
+                        reply_markup=get_inline_menu()
+                    )
+                else:
+                    outcome = "fallback"
+                    await message.answer(
+                        chat_responses.get_technical_help_response(),
+                        reply_markup=get_inline_menu()
+                    )
+            else:
+                # Если в базе ничего не найдено
+                outcome = "fallback"
+                await message.answer(
+                    "К сожалению, в базе знаний не нашлось точной информации для вашей техники. "
+                    "Для персонального подбора масла рекомендую связаться с нашим специалистом.",
+                    reply_markup=get_inline_menu()
+                )
+
     except Exception as e:
-        logger.error(f"Ошибка при подборе масла: {e}")
+        logger.error("Ошибка при подборе масла: %s", e)
         await message.answer(
             "Произошла ошибка при подборе масла. Пожалуйста, обратитесь к менеджеру для консультации.",
             reply_markup=get_inline_menu()
         )
     
-    # Логируем запрос в БД
-    db = SessionLocal()
-    try:
-        user_query = UserQuery(
-            user_id=message.from_user.id,
-            username=message.from_user.username,
-            query_text=f"Подбор масла: {vehicle_info}",
-            response_text=recommendation if 'recommendation' in locals() else "Ошибка подбора"
-        )
-        db.add(user_query)
-        db.commit()
-    except Exception as e:
-        logger.error(f"Ошибка логирования запроса подбора: {e}")
-    finally:
-        db.close()
+    # Логируем запрос (запись в БД выполняется фоново, пачками)
+    query_log.log(
+        user_id=message.from_user.id,
+        username=message.from_user.username,
+        query_text=f"Подбор масла: {vehicle_info}",
+        response_text=recommendation if 'recommendation' in locals() else "Ошибка подбора",
+        query_type="vehicle_selection",
+        outcome=outcome,
+    )
+    metrics.record_answer("vehicle_selection", outcome, (datetime.utcnow() - received_at).total_seconds())
     
     await state.clear()
 
@@ -304,38 +363,45 @@ async def process_industry(message: Message, state: FSMContext):
     telegram_username = message.from_user.username
     telegram_username = f"@{telegram_username}" if telegram_username else "не указан"
 
-    # Сохраняем в БД
+    # Сохраняем в БД: лид и письмо о нём в одной транзакции
     db = SessionLocal()
     try:
-        lead = Lead(
-            name=name,
-            email=email,
-            phone=phone,
-            industry=industry,
-            telegram_username=telegram_username
-        )
-        db.add(lead)
-        db.commit()
-        db.refresh(lead)
+        with metrics.timed("db_lead"):
+            lead = Lead(
+                name=name,
+                email=email,
+                phone=phone,
+                industry=industry,
+                telegram_username=telegram_username,
+                user_id=message.from_user.id
+            )
+            db.add(lead)
+            db.flush()
+
+            lead_info = {
+                "name": name,
+                "email": email,
+                "phone": phone,
+                "industry": industry,
+                "telegram_username": telegram_username,
+                "created_at": lead.created_at.strftime("%Y-%m-%d %H:%M:%S")
+            }
+            enqueue_lead_email(db, lead_info)
+            db.commit()
+
+        # Письмо отправит фоновый обработчик outbox — пользователь его не ждёт
+        outbox_sender.notify()
+
+        # Атрибуция: помечаем запросы пользователя, которые привели к заявке
+        query_log.mark_lead(message.from_user.id, lead.created_at)
 
         await message.answer(
             f"Спасибо, {name}! Ваши данные сохранены. Наш специалист свяжется с вами в ближайшее время.",
             reply_markup=ReplyKeyboardRemove()
         )
 
-        # Отправляем email
-        lead_info = {
-            "name": name,
-            "email": email,
-            "phone": phone,
-            "industry": industry,
-            "telegram_username": telegram_username,
-            "created_at": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-        }
-        await send_lead_email(lead_info)
-
     except Exception as e:
-        logger.error(f"Ошибка сохранения лида: {e}")
+        logger.error("Ошибка сохранения лида: %s", e)
         await message.answer("Произошла ошибка при сохранении. Попробуйте позже.")
     finally:
         db.close()
@@ -388,6 +454,163 @@ async def show_faq_callback(callback: CallbackQuery):
     await callback.message.edit_text(faq_text, reply_markup=get_faq_keyboard(), parse_mode="HTML")
     await callback.answer()
 
+# ========================= КОМАНДЫ ЧАТА ПОДДЕРЖКИ =========================
+
+def is_support_chat(message: Message) -> bool:
+    """Служебные команды доступны только в группе поддержки"""
+    return SUPPORT_CHAT_ID is not None and message.chat.id == SUPPORT_CHAT_ID
+
+@router.message(Command("stats"))
+async def cmd_stats(message: Message, command: CommandObject):
+    """Статистика запросов и конверсии в лиды (только из агрегатов)"""
+    if not is_support_chat(message):
+        return
+
+    days = 7
+    if command.args and command.args.strip().isdigit():
+        days = max(1, min(int(command.args.strip()), 365))
+
+    try:
+        stats = await asyncio.to_thread(get_stats, days)
+        await message.answer(format_stats(stats), parse_mode="HTML")
+    except Exception as e:
+        logger.error("Ошибка получения статистики: %s", e)
+        await message.answer("❌ Не удалось получить статистику.")
+
+@router.message(Command("perf"))
+async def cmd_perf(message: Message):
+    """Задержки по этапам обработки с момента запуска бота"""
+    if not is_support_chat(message):
+        return
+    await message.answer(format_perf(metrics), parse_mode="HTML")
+
+@router.message(Command("export"))
+async def cmd_export(message: Message, command: CommandObject):
+    """
+    Выгрузка в файл: /export leads|queries [csv|jsonl] [с YYYY-MM-DD] [по YYYY-MM-DD] [тип] [archive]
+    Дата «по» включается в выгрузку целиком.
+    """
+    if not is_support_chat(message):
+        return
+
+    args = (command.args or "").split()
+    if not args or args[0] not in EXPORT_KINDS:
+        await message.answer(
+            "Использование: /export leads|queries [csv|jsonl] [с YYYY-MM-DD] [по YYYY-MM-DD] [тип] [archive]\n"
+            "Обе даты включительно."
+        )
+        return
+
+    kind, fmt, type_filter, include_archive = args[0], "csv", None, False
+    # «с»/«по» перед датой задают границу явно; даты без них — по порядку: начало, конец
+    bounds = {"с": None, "по": None}
+    dates, bound = [], None
+    for arg in args[1:]:
+        if arg.lower() in bounds:
+            bound = arg.lower()
+            continue
+        if re.fullmatch(r"\d{4}-\d{2}-\d{2}", arg):
+            if bound is not None:
+                bounds[bound] = arg
+            else:
+                dates.append(arg)
+        elif arg in EXPORT_FORMATS:
+            fmt = arg
+        elif arg == "archive":
+            include_archive = True
+        else:
+            type_filter = arg
+        bound = None
+
+    for date in dates:
+        missing = next((name for name in ("с", "по") if bounds[name] is None), None)
+        if missing is not None:
+            bounds[missing] = date
+
+    try:
+        date_from = parse_date(bounds["с"])
+        date_to = parse_date(bounds["по"])
+    except ValueError:
+        await message.answer("❌ Неверная дата, используйте формат YYYY-MM-DD.")
+        return
+    if date_to:
+        # «по 2026-01-31» — включая 31-е; выгрузка берёт время строго меньше границы
+        date_to += timedelta(days=1)
+
+    await message.answer("⏳ Готовлю выгрузку...")
+    filename = default_filename(kind, fmt)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, filename)
+        try:
+            # Выгрузка читает БД потоково в отдельном потоке и не блокирует бота
+            rows = await asyncio.to_thread(
+                export, kind, fmt, path, date_from, date_to, type_filter, include_archive=include_archive
+            )
+            await message.answer_document(FSInputFile(path, filename=filename), caption=f"📦 {kind}: {rows} строк")
+        except Exception as e:
+            logger.error("Ошибка выгрузки %s: %s", kind, e)
+            await message.answer("❌ Не удалось подготовить выгрузку.")
+
+@router.message(Command("broadcast"))
+async def cmd_broadcast(message: Message, command: CommandObject):
+    """Рассылка всем, кто писал боту: /broadcast <текст>"""
+    if not is_support_chat(message):
+        return
+
+    text = (command.args or "").strip()
+    if not text:
+        await message.answer("Использование: /broadcast <текст сообщения>")
+        return
+
+    broadcast_id = await broadcast_runner.create(text, created_by_chat_id=message.chat.id)
+    status = await broadcast_runner.get_status(broadcast_id)
+    await message.answer(
+        f"📣 Рассылка #{broadcast_id} запущена, получателей: ~{status['total']}.\n"
+        f"Прогресс: /broadcast_status {broadcast_id}, отмена: /broadcast_cancel {broadcast_id}"
+    )
+
+@router.message(Command("broadcast_status"))
+async def cmd_broadcast_status(message: Message, command: CommandObject):
+    """Прогресс рассылки: /broadcast_status [id]"""
+    if not is_support_chat(message):
+        return
+
+    arg = (command.args or "").strip()
+    status = await broadcast_runner.get_status(int(arg) if arg.isdigit() else None)
+    await message.answer(format_broadcast(status) if status else "Рассылок пока не было.")
+
+@router.message(Command("broadcast_cancel"))
+async def cmd_broadcast_cancel(message: Message, command: CommandObject):
+    """Отмена рассылки: /broadcast_cancel <id>"""
+    if not is_support_chat(message):
+        return
+
+    arg = (command.args or "").strip()
+    if not arg.isdigit():
+        await message.answer("Использование: /broadcast_cancel <id>")
+        return
+    if await broadcast_runner.cancel(int(arg)):
+        await message.answer(f"⏹ Рассылка #{arg} отменена.")
+    else:
+        await message.answer(f"Рассылка #{arg} не найдена или уже завершена.")
+
+@router.message(Command("reload_kb"))
+async def cmd_reload_kb(message: Message):
+    """Переиндексация изменённых файлов базы знаний без перезапуска"""
+    if not is_support_chat(message):
+        return
+    if kb_reloader.running:
+        await message.answer("⏳ База знаний уже обновляется, результат придёт сюда.")
+        return
+
+    await message.answer("⏳ Проверяю файлы базы знаний...")
+    try:
+        result = await kb_reloader.reload(force=True)
+        await message.answer(format_reload(result))
+    except Exception as e:
+        logger.error("Ошибка обновления базы знаний: %s", e)
+        await message.answer("❌ Не удалось обновить базу знаний, работает прежняя версия.")
+
 # ========================= ЧАТ С ПОДДЕРЖКОЙ =========================
 
 @router.callback_query(F.data == "start_support_chat")
@@ -439,43 +662,233 @@ async def end_support_chat(message: Message, state: FSMContext):
     await message.answer("✅ Чат с менеджером завершён. Спасибо за обращение!")
     await message.answer("Чем ещё можем помочь?", reply_markup=get_inline_menu())
 
-@router.message(F.reply_to_message)
+def support_header(user) -> str:
+    """Шапка сообщения клиента в группе поддержки (строка ID: — для старых сообщений без маршрута)"""
+    return (
+        f"🗣️ Сообщение от клиента\n"
+        f"Пользователь: {user.full_name}\n"
+        f"Username: @{user.username if user.username else 'не указан'}\n"
+        f"ID: {user.id}\n"
+        f"---\n"
+    )
+
+async def forward_to_support(message: Message):
+    """
+    Пересылает сообщение клиента (текст или медиа) в группу поддержки и
+    запоминает, к какому клиенту относятся отправленные туда сообщения.
+    """
+    bot: Bot = message.bot
+    user = message.from_user
+    header = support_header(user)
+
+    if message.text:
+        sent = await bot.send_message(chat_id=SUPPORT_CHAT_ID, text=header + message.text)
+        routed_ids = [sent.message_id]
+    elif any([message.photo, message.video, message.document, message.audio, message.voice, message.animation]):
+        copied = await bot.copy_message(
+            chat_id=SUPPORT_CHAT_ID,
+            from_chat_id=message.chat.id,
+            message_id=message.message_id,
+            caption=(header + (message.caption or ""))[:1024],
+        )
+        routed_ids = [copied.message_id]
+    else:
+        # Стикеры, контакты, геопозиция и т.п. не принимают подпись
+        copied = await bot.copy_message(
+            chat_id=SUPPORT_CHAT_ID, from_chat_id=message.chat.id, message_id=message.message_id
+        )
+        sent = await bot.send_message(
+            chat_id=SUPPORT_CHAT_ID, text=header.rstrip("-\n"), reply_to_message_id=copied.message_id
+        )
+        routed_ids = [copied.message_id, sent.message_id]
+
+    for message_id in routed_ids:
+        await support_router.remember(SUPPORT_CHAT_ID, message_id, user.id, message.message_id)
+
+@router.message(F.reply_to_message, F.chat.id == SUPPORT_CHAT_ID)
 async def handle_manager_reply(message: Message):
     """Обработка ответов менеджера из группы поддержки"""
-    # Проверяем, что сообщение из группы поддержки
-    if SUPPORT_CHAT_ID is None or message.chat.id != SUPPORT_CHAT_ID:
+    if SUPPORT_CHAT_ID is None:
         return
 
     replied = message.reply_to_message
-    if not replied or not replied.text:
-        return
-
-    # Извлекаем ID клиента из сообщения
-    user_id_match = re.search(r"ID: (\d+)", replied.text)
-    if not user_id_match:
-        await message.reply("❌ Не удалось найти ID клиента.")
-        return
+    thread = await support_router.lookup(message.chat.id, replied.message_id)
+    if thread is None:
+        # Сообщения, пересланные до появления таблицы маршрутов
+        user_id_match = re.search(r"ID: (\d+)", replied.text or replied.caption or "")
+        if not user_id_match:
+            await message.reply("❌ Не удалось найти клиента. Ответьте на пересланное сообщение клиента.")
+            return
+        thread = SupportThread(int(user_id_match.group(1)))
 
-    user_id = int(user_id_match.group(1))
+    user_id = thread.user_id
     bot = message.bot
 
     try:
         # Отправляем ответ клиенту с кнопкой завершения диалога
-        await bot.send_message(
-            chat_id=user_id,
-            text=f"📎 Ответ от менеджера:\n\n<i>{message.text}</i>",
-            parse_mode="HTML",
-            reply_markup=get_end_chat_keyboard()
-        )
-        await message.reply("✅ Ответ отправлен клиенту.")
+        if message.text:
+            await bot.send_message(
+                chat_id=user_id,
+                text=f"📎 Ответ от менеджера:\n\n<i>{html.escape(message.text)}</i>",
+                parse_mode="HTML",
+                reply_markup=get_end_chat_keyboard(),
+                reply_to_message_id=thread.user_message_id,
+                allow_sending_without_reply=True,
+            )
+        else:
+            await bot.copy_message(
+                chat_id=user_id,
+                from_chat_id=message.chat.id,
+                message_id=message.message_id,
+                reply_markup=get_end_chat_keyboard(),
+                reply_to_message_id=thread.user_message_id,
+                allow_sending_without_reply=True,
+            )
+        confirmation = await message.reply("✅ Ответ отправлен клиенту.")
+        # Продолжить диалог можно ответом и на ответ менеджера, и на подтверждение
+        await support_router.remember(SUPPORT_CHAT_ID, message.message_id, user_id, thread.user_message_id)
+        await support_router.remember(SUPPORT_CHAT_ID, confirmation.message_id, user_id, thread.user_message_id)
     except Exception as e:
         await message.reply(f"❌ Ошибка при отправке ответа клиенту: {e}")
-        logger.error(f"Ошибка отправки клиенту {user_id}: {e}")
+        logger.error("Ошибка отправки клиенту %s: %s", user_id, e)
+
+# ========================= МАРШРУТ ДЛЯ ОГРАНИЧЕНИЯ ЧАСТОТЫ =========================
+
+async def throttle_route(event, data: dict) -> str:
+    """
+    Маршрут апдейта для ThrottlingMiddleware: rag — текст, который уйдёт
+    в поиск по базе знаний и LLM, cheap — всё остальное. Результат
+    классификации кладётся в data["query_classification"], и
+    handle_all_text_messages не классифицирует текст второй раз.
+    """
+    if not isinstance(event, Message) or not event.text:
+        return "cheap"
+    raw_state = data.get("raw_state")
+    if raw_state is not None:
+        # Из анкет в RAG уходит только описание техники при подборе масла
+        return "rag" if raw_state == SelectionForm.waiting_for_vehicle_info.state else "cheap"
+    text = event.text.strip()
+    if text.startswith("/"):
+        return "cheap"
+    # Сообщения в чате с менеджером только пересылаются
+    state: FSMContext = data.get("state")
+    if state is not None and (await state.get_data()).get("in_support_chat"):
+        return "cheap"
+    with metrics.timed("classify"):
+        query_type, confidence = query_classifier.classify_query(text)
+    data["query_classification"] = (query_type, confidence)
+    if query_type in ["technical", "general"] and confidence >= query_classifier.get_confidence_threshold(query_type):
+        return "rag"
+    return "cheap"
+
+# ========================= ФОНОВЫЕ ОТВЕТЫ ЧЕРЕЗ RAG =========================
+
+RAG_SYSTEM_PROMPT = (
+    "Вы — профессиональный консультант по продажам компании ECOFES — российского производителя "
+    "высококачественных смазочных материалов, специализирующегося на разработке и производстве "
+    "моторных масел, трансмиссионных жидкостей, гидравлических масел и других смазочных материалов "
+    "для автомобильной и промышленной техники.\n\n"
+    "ВАЖНО: отвечайте ТОЛЬКО на основе предоставленного контекста. "
+    "Если в контексте нет точного ответа на вопрос — честно скажите: "
+    "'В доступной мне информации нет точного ответа на ваш вопрос. "
+    "Рекомендую обратиться к специалисту для детальной консультации.'\n\n"
+    "НЕ ПРИДУМЫВАЙТЕ информацию. Отвечайте развернуто, но по существу, на русском языке. "
+    "Если можете ответить — давайте полезный и точный совет. "
+    "Указывайте конкретные названия продуктов ECOFES, их характеристики и области применения."
+)
+
+def build_search_query(text: str) -> str:
+    """Запрос к базе знаний: текст клиента и найденные в нём ключевые слова"""
+    keywords = query_classifier.get_query_keywords(text)
+    return f"{text} {' '.join(keywords)}" if keywords else text
+
+def warm_up_faq_embeddings() -> None:
+    """Эмбеддинги вариантов FAQ — так же, как готовится запрос поиска (при прогреве базы знаний)"""
+    faq_index.load_embeddings(lambda question: rag_engine.embed(build_search_query(question)))
+
+async def match_faq_by_embedding(text: str, search_query: str):
+    """
+    «Серая зона» FAQ: вопрос лексически похож на частый, но не настолько,
+    чтобы ответить сразу. Решает эмбеддинг запроса; при промахе он же
+    возвращается для поиска, чтобы не запрашивать его повторно.
+    """
+    embedding = None
+    faq_hit = None
+    if faq_index.needs_embedding(text):
+        try:
+            embedding = await rag_engine.aembed(search_query)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # GigaChat недоступен: без эмбеддинга «серая зона» не решается, asearch найдёт по словам
+            logger.info("Эмбеддинг для FAQ не получен: %s", e)
+        else:
+            faq_hit = faq_index.match_embedding(text, embedding)
+    if faq_hit is None:
+        faq_index.record_miss()
+    return faq_hit, embedding
+
+async def answer_with_rag(message: Message, text: str, query_type: str, received_at: datetime):
+    """Ответ на технический вопрос через базу знаний и LLM (фоновая задача пользователя)"""
+    # Своя трассировка с тем же correlation_id, что у апдейта: сам апдейт к этому моменту уже обработан
+    with trace_context("rag_answer", user_id=message.from_user.id, query_type=query_type):
+        answer = None
+        outcome = "rag"
+        try:
+            async with ChatActionSender.typing(bot=message.bot, chat_id=message.chat.id):
+                search_query = build_search_query(text)
+                faq_hit, embedding = await match_faq_by_embedding(text, search_query)
+
+                if faq_hit is not None:
+                    outcome = "faq"
+                    answer = faq_hit.entry.answer
+                else:
+                    contexts = await rag_engine.asearch(search_query, embedding=embedding)
+                    if not contexts:
+                        outcome = "fallback"
+                        answer = chat_responses.get_technical_help_response()
+                    else:
+                        # Формируем контекст и запрос к LLM
+                        context = "\n\n".join(contexts[:3])  # Используем больше контекста
+                        full_query = f"Контекст (база знаний ECOFES):\n{context}\n\nВопрос клиента: {text}"
+
+                        # Получаем ответ от LLM
+                        answer = await query_openrouter(RAG_SYSTEM_PROMPT, full_query)
+
+                        if not answer or "нет точного ответа" in answer.lower():
+                            outcome = "fallback"
+                            answer = chat_responses.get_technical_help_response()
+        except asyncio.CancelledError:
+            # Пользователь задал новый вопрос — этот ответ уже не нужен
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            logger.error("Ошибка при работе с RAG/LLM: %s", e)
+            outcome = "error"
+            answer = (
+                "Произошла ошибка при поиске информации. "
+                "Пожалуйста, попробуйте переформулировать вопрос или обратитесь к менеджеру."
+            )
+        finally:
+            query_log.log(
+                user_id=message.from_user.id,
+                username=message.from_user.username,
+                query_text=text,
+                response_text=answer,
+                timestamp=received_at,
+                query_type=query_type,
+                outcome=outcome,
+            )
+            metrics.record_answer(query_type, outcome, (datetime.utcnow() - received_at).total_seconds())
+
+        parse_mode = "HTML" if "<b>" in answer or "<i>" in answer else None
+        await message.answer(answer, reply_markup=get_inline_menu(), parse_mode=parse_mode)
 
 # ========================= ОСНОВНОЙ ОБРАБОТЧИК ТЕКСТА =========================
 
 @router.message(F.text)
-async def handle_all_text_messages(message: Message, state: FSMContext):
+async def handle_all_text_messages(message: Message, state: FSMContext,
+                                   query_classification: Optional[Tuple[str, float]] = None):
     """Единый обработчик всех текстовых сообщений с улучшенной логикой"""
     # Если пользователь в процессе анкеты — не обрабатываем здесь
     current_state = await state.get_state()
@@ -489,9 +902,15 @@ async def handle_all_text_messages(message: Message, state: FSMContext):
     # Исключаем системные команды и кнопки
     if text in ["/start", "/end", "Оставить заявку", "Узнать больше", "Вернуться в меню"]:
         return
-    
-    print(f"🔧 [DEBUG] Обработка сообщения от {message.from_user.id}: '{text}'")
-    print(f"🔧 [DEBUG] Режим поддержки: {user_data.get('in_support_chat', False)}")
+
+    # Ответ на новое сообщение уйдёт раньше незавершённого ответа RAG на старое —
+    # старый больше не нужен, каким бы путём ни отвечали на новое
+    user_tasks.supersede(message.from_user.id)
+
+    logger.debug(
+        "Сообщение от %s: %r (режим поддержки: %s)",
+        message.from_user.id, text, user_data.get("in_support_chat", False),
+    )
     
     # РЕЖИМ ПОДДЕРЖКИ - проверяем ПЕРВЫМ
     if user_data.get("in_support_chat"):
@@ -499,61 +918,38 @@ async def handle_all_text_messages(message: Message, state: FSMContext):
             await message.answer("❌ Служба поддержки временно недоступна.")
             return
 
-        bot: Bot = message.bot
-        user = message.from_user
-
-        # Формируем сообщение для менеджера
-        manager_text = (
-            f"🗣️ Сообщение от клиента\n"
-            f"Пользователь: {user.full_name}\n"
-            f"Username: @{user.username if user.username else 'не указан'}\n"
-            f"ID: {user.id}\n"
-            f"---\n"
-            f"{text}"
-        )
-
         try:
             # Отправляем в группу поддержки
-            await bot.send_message(
-                chat_id=SUPPORT_CHAT_ID,
-                text=manager_text
-            )
+            await forward_to_support(message)
             # Подтверждение клиенту с кнопкой завершения
             await message.answer(
                 "📨 Сообщение отправлено менеджеру. Ожидайте ответа.",
                 reply_markup=get_end_chat_keyboard()
             )
-            print(f"✅ [DEBUG] Сообщение от {user.id} отправлено в поддержку")
+            logger.debug("Сообщение от %s отправлено в поддержку", message.from_user.id)
         except Exception as e:
             await message.answer("❌ Не удалось отправить сообщение. Попробуйте позже.")
-            logger.error(f"Ошибка отправки в поддержку: {e}")
+            logger.error("Ошибка отправки в поддержку: %s", e)
         
         return  # ВАЖНО: выходим из функции после обработки
 
     # ОБЫЧНЫЙ РЕЖИМ - классификация запроса
-    print(f"🔧 [DEBUG] Классифицируем запрос: '{text}'")
     
-    # Классифицируем тип запроса
-    query_type, confidence = query_classifier.classify_query(text)
-    print(f"🔧 [DEBUG] Тип запроса: {query_type}, уверенность: {confidence}")
+    received_at = datetime.utcnow()
 
-    # Логируем вопрос в БД
-    db = SessionLocal()
-    user_query = None
-    try:
-        user_query = UserQuery(
-            user_id=message.from_user.id,
-            username=message.from_user.username,
-            query_text=text
-        )
-        db.add(user_query)
-        db.commit()
-        db.refresh(user_query)
-    except Exception as e:
-        logger.error(f"Ошибка логирования вопроса: {e}")
+    # Классифицируем тип запроса (если это ещё не сделал throttle_route)
+    if query_classification is not None:
+        query_type, confidence = query_classification
+    else:
+        with metrics.timed("classify"):
+            query_type, confidence = query_classifier.classify_query(text)
+    # Метка для замеров этапов этого ответа, в том числе в фоновой задаче RAG
+    current_query_type.set(query_type)
+    logger.debug("Тип запроса: %s, уверенность: %.2f", query_type, confidence)
 
     # Определяем стратегию ответа на основе классификации
     answer = None
+    outcome = "canned"
     
     if query_type == "greeting":
         answer = chat_responses.get_greeting_response()
@@ -578,61 +974,40 @@ async def handle_all_text_messages(message: Message, state: FSMContext):
     elif query_type == "catalog":
         answer = chat_responses.get_catalog_response()
     
+    elif query_type in FAQ_QUERY_TYPES and (faq_hit := faq_index.match(text)) is not None:
+        # Частый вопрос: ответ из FAQ без поиска и без LLM
+        outcome = "faq"
+        answer = faq_hit.entry.answer
+
     elif query_type in ["technical", "general"] and confidence >= query_classifier.get_confidence_threshold(query_type):
-        # Используем RAG + LLM для технических вопросов с достаточной уверенностью
+        # RAG + LLM выполняются в фоне: апдейт обработан сразу, а новый вопрос
+        # пользователя отменит этот, если ответ на него ещё не готов
         await message.answer("🔎 Ищу информацию в базе знаний...")
-        
-        try:
-            # Улучшенный поиск с ключевыми словами
-            keywords = query_classifier.get_query_keywords(text)
-            search_query = f"{text} {' '.join(keywords)}" if keywords else text
-            
-            contexts = rag_engine.search(search_query)
-            if not contexts:
-                answer = chat_responses.get_technical_help_response()
-            else:
-                # Формируем контекст и запрос к LLM
-                context = "\n\n".join(contexts[:3])  # Используем больше контекста
-                system_prompt = (
-                    "Вы — профессиональный консультант по продажам компании ECOFES — российского производителя "
-                    "высококачественных смазочных материалов, специализирующегося на разработке и производстве "
-                    "моторных масел, трансмиссионных жидкостей, гидравлических масел и других смазочных материалов "
-                    "для автомобильной и промышленной техники.\n\n"
-                    "ВАЖНО: отвечайте ТОЛЬКО на основе предоставленного контекста. "
-                    "Если в контексте нет точного ответа на вопрос — честно скажите: "
-                    "'В доступной мне информации нет точного ответа на ваш вопрос. "
-                    "Рекомендую обратиться к специалисту для детальной консультации.'\n\n"
-                    "НЕ ПРИДУМЫВАЙТЕ информацию. Отвечайте развернуто, но по существу, на русском языке. "
-                    "Если можете ответить — давайте полезный и точный совет. "
-                    "Указывайте конкретные названия продуктов ECOFES, их характеристики и области применения."
-                )
-                
-                full_query = f"Контекст (база знаний ECOFES):\n{context}\n\nВопрос клиента: {text}"
-
-                # Получаем ответ от LLM
-                answer = await query_openrouter(system_prompt, full_query)
-                
-                if not answer or "нет точного ответа" in answer.lower():
-                    answer = chat_responses.get_technical_help_response()
-
-        except Exception as e:
-            logger.error(f"Ошибка при работе с RAG/LLM: {e}")
-            answer = (
-                "Произошла ошибка при поиске информации. "
-                "Пожалуйста, попробуйте переформулировать вопрос или обратитесь к менеджеру."
-            )
+        user_tasks.start(
+            message.from_user.id,
+            answer_with_rag(message, text, query_type, received_at),
+            name=f"rag-{message.from_user.id}",
+        )
+        return
     
     else:
         # Для неопределённых запросов или низкой уверенности
+        if query_type in FAQ_QUERY_TYPES:
+            faq_index.record_miss()
+        outcome = "unknown"
         answer = chat_responses.get_unknown_response()
 
-    # Сохраняем ответ в БД
-    if user_query and answer:
-        try:
-            user_query.response_text = answer
-            db.commit()
-        except Exception as e:
-            logger.error(f"Ошибка обновления ответа: {e}")
+    # Логируем вопрос и ответ (запись в БД выполняется фоново, пачками)
+    query_log.log(
+        user_id=message.from_user.id,
+        username=message.from_user.username,
+        query_text=text,
+        response_text=answer,
+        timestamp=received_at,
+        query_type=query_type,
+        outcome=outcome,
+    )
+    metrics.record_answer(query_type, outcome, (datetime.utcnow() - received_at).total_seconds())
 
     # Отправляем ответ пользователю
     if answer:
@@ -655,15 +1030,26 @@ async def handle_all_text_messages(message: Message, state: FSMContext):
             reply_markup=get_inline_menu()
         )
 
-    # Закрываем соединение с БД
-    db.close()
-
 
 # ========================= ОБРАБОТКА ДРУГИХ ТИПОВ СООБЩЕНИЙ =========================
 
 @router.message()
-async def handle_other_messages(message: Message):
+async def handle_other_messages(message: Message, state: FSMContext):
     """Обработчик для всех остальных типов сообщений (фото, документы и т.д.)"""
+    # В чате с менеджером медиа пересылаем как есть
+    user_data = await state.get_data()
+    if user_data.get("in_support_chat") and SUPPORT_CHAT_ID and message.chat.id != SUPPORT_CHAT_ID:
+        try:
+            await forward_to_support(message)
+            await message.answer(
+                "📨 Сообщение отправлено менеджеру. Ожидайте ответа.",
+                reply_markup=get_end_chat_keyboard()
+            )
+        except Exception as e:
+            await message.answer("❌ Не удалось отправить сообщение. Попробуйте позже.")
+            logger.error("Ошибка отправки в поддержку: %s", e)
+        return
+
     await message.answer(
         "Я работаю только с текстовыми сообщениями. "
         "Пожалуйста, опишите ваш вопрос текстом или воспользуйтесь меню.",
@@ -1,25 +1,158 @@
 import asyncio
-import os
-from aiogram import Bot, Dispatcher
-from dotenv import load_dotenv
-from bot.handlers.lead_handler import router
 import logging
-from bot.handlers.lead_handler import router
+import os
+import time
+from typing import Optional
+
+from bot.utils.startup import startup_report
+
+with startup_report.phase("config"):
+    from bot.config import load_config
+
+    load_config()
+    from bot.services.tracing import setup_logging
 
-print("✅ Бот запущен: main.py стартовал", flush=True)
-logging.basicConfig(level=logging.INFO)
+    # Логирование настраиваем до импорта модулей, которые пишут в лог при загрузке
+    setup_logging()
 
-load_dotenv()
+with startup_report.phase("aiogram"):
+    from aiogram import Bot, Dispatcher
+
+logger = logging.getLogger(__name__)
 
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# polling — long polling (по умолчанию), webhook — aiohttp-сервер (см. bot/webhook.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# Прогрев базы знаний (токен GigaChat, Chroma, индексация) в фоне сразу после запуска;
+# при false — при первом поиске
+RAG_WARM_UP_ON_START = os.getenv("RAG_WARM_UP_ON_START", "true").lower() in ("1", "true", "yes")
+
+# Фоновый прогрев RAG: бот уже принимает апдейты, пока индексируется база знаний
+_warm_up_task: Optional[asyncio.Task] = None
+
+async def _warm_up_rag() -> None:
+    from bot.handlers.lead_handler import rag_engine, warm_up_faq_embeddings
+
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(rag_engine.warm_up)
+    except Exception as e:
+        # Не фатально: поиск повторит прогрев при первом запросе
+        logger.error("Прогрев базы знаний не удался: %s", e)
+        return
+    logger.info("База знаний готова за %.0f мс", (time.perf_counter() - started) * 1000)
+    try:
+        await asyncio.to_thread(warm_up_faq_embeddings)
+    except Exception as e:
+        # Без эмбеддингов FAQ отвечает только на точные лексические совпадения
+        logger.error("Эмбеддинги FAQ не загружены: %s", e)
+
+async def on_startup(bot: Bot):
+    global _warm_up_task
+    from bot.services.query_log import query_log
+    from bot.services.analytics import rollup_worker
+    from bot.services.archiver import query_archiver
+    from bot.services.email_outbox import outbox_sender
+    from bot.services.broadcast import broadcast_runner
+    from bot.services.metrics import metrics_server
+    from bot.handlers.lead_handler import kb_reloader
+
+    with startup_report.phase("background workers"):
+        query_log.start()
+        rollup_worker.start()
+        query_archiver.start()
+        outbox_sender.start()
+        # Продолжаем рассылки, прерванные остановкой
+        broadcast_runner.start(bot)
+        # Изменения в data/docs подхватываются без перезапуска
+        kb_reloader.start()
+        if BOT_MODE != "webhook":
+            # В режиме webhook /metrics отдаёт сервер вебхука
+            await metrics_server.start()
+    if RAG_WARM_UP_ON_START and _warm_up_task is None:
+        _warm_up_task = asyncio.create_task(_warm_up_rag(), name="rag-warm-up")
+    startup_report.log()
+
+async def on_shutdown():
+    global _warm_up_task
+    from bot.handlers.lead_handler import rag_engine, selection_prefetcher, kb_reloader
+    from bot.services.database import engine
+    from bot.services.llm_service import close_http_client
+    from bot.services.query_log import query_log
+    from bot.services.analytics import rollup_worker
+    from bot.services.archiver import query_archiver
+    from bot.services.email_outbox import outbox_sender
+    from bot.services.user_tasks import user_tasks
+    from bot.services.broadcast import broadcast_runner
+    from bot.services.metrics import metrics_server
+
+    # Поток индексации не прервать: дожидаемся, чтобы не закрыть клиентов под ним
+    if _warm_up_task is not None:
+        await _warm_up_task
+        _warm_up_task = None
+    await kb_reloader.stop()
+    # Сначала дожидаемся фоновых ответов: им ещё нужны HTTP-клиенты и журнал
+    await user_tasks.shutdown()
+    await selection_prefetcher.shutdown()
+    await broadcast_runner.stop()
+    await metrics_server.stop()
+    await outbox_sender.stop()
+    await query_archiver.stop()
+    await rollup_worker.stop()
+    # Дописываем накопленный журнал запросов перед выходом
+    await query_log.stop()
+    await close_http_client()
+    await rag_engine.aclose()
+    engine.dispose()
+
+def build_dispatcher() -> Dispatcher:
+    """Диспетчер со всеми роутерами, middleware и хуками запуска/остановки"""
+    with startup_report.phase("handlers"):
+        from bot.handlers.lead_handler import router, throttle_route, SUPPORT_CHAT_ID, SelectionForm, selection_prefetcher
+        from bot.middlewares.correlation import CorrelationMiddleware
+        from bot.middlewares.prefetch import PrefetchCancelMiddleware
+        from bot.middlewares.throttling import ThrottlingMiddleware
+        from bot.services.fsm_storage import create_fsm_storage
+
+    with startup_report.phase("dispatcher"):
+        # Хранилище FSM закрывается самим диспетчером при остановке
+        dp = Dispatcher(storage=create_fsm_storage())
+        dp.include_router(router)
+        # correlation_id и трассировка на каждый апдейт — раньше остальных middleware
+        dp.update.outer_middleware(CorrelationMiddleware())
+        # Ограничение частоты до фильтров и обработчиков; чат поддержки не ограничиваем
+        throttling = ThrottlingMiddleware(route=throttle_route, exempt_chat_ids=[SUPPORT_CHAT_ID])
+        dp.message.outer_middleware(throttling)
+        dp.callback_query.outer_middleware(throttling)
+        # Вышел из анкеты подбора — предвыборка для него больше не нужна
+        prefetch_cancel = PrefetchCancelMiddleware(selection_prefetcher, keep_state=SelectionForm.waiting_for_vehicle_info)
+        dp.message.outer_middleware(prefetch_cancel)
+        dp.callback_query.outer_middleware(prefetch_cancel)
+        dp.startup.register(on_startup)
+        dp.shutdown.register(on_shutdown)
+    return dp
 
 async def main():
+    with startup_report.phase("database"):
+        from bot.services.database import init_db
+
+        # Схема БД управляется миграциями Alembic
+        init_db()
+
+    from bot.middlewares.outbound import outbound_limiter
+
     bot = Bot(token=TOKEN)
-    dp = Dispatcher()
-    dp.include_router(router)
+    # Все исходящие сообщения — через общие лимиты Telegram
+    bot.session.middleware(outbound_limiter)
+    dp = build_dispatcher()
 
-    print("Бот запущен...")
-    await dp.start_polling(bot)
+    if BOT_MODE == "webhook":
+        from bot.webhook import run_webhook
+        logger.info("Бот запущен (webhook)")
+        await run_webhook(bot, dp)
+    else:
+        logger.info("Бот запущен (polling)")
+        await dp.start_polling(bot)
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,35 @@
+# bot/middlewares/correlation.py
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from bot.services.tracing import new_correlation_id, trace_context
+
+
+class CorrelationMiddleware(BaseMiddleware):
+    """
+    Outer-middleware апдейтов: открывает трассировку с новым correlation_id.
+
+    Всё, что выполняется при обработке апдейта, — логи, замеры этапов,
+    запросы к GigaChat и OpenRouter, записи в БД и письма из outbox —
+    получает этот correlation_id через contextvars.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        attrs = {}
+        if isinstance(event, Update):
+            attrs["update_id"] = event.update_id
+            attrs["event_type"] = event.event_type
+        user = data.get("event_from_user")
+        if user is not None:
+            attrs["user_id"] = user.id
+
+        # Каждый апдейт — новый идентификатор, даже если контекст что-то унаследовал
+        with trace_context("update", correlation=new_correlation_id(), **attrs):
+            return await handler(event, data)
@@ -0,0 +1,141 @@
+# bot/middlewares/outbound.py
+import asyncio
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, SendChatAction, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from bot.services.metrics import metrics
+from bot.services.tracing import record_span
+from bot.utils.rate_limit import BucketRegistry, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений/с на бота, ~1/с в личный чат, ~20/мин в группу
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "25"))
+OUTBOUND_GLOBAL_BURST = float(os.getenv("OUTBOUND_GLOBAL_BURST", "25"))
+OUTBOUND_PRIVATE_RATE = float(os.getenv("OUTBOUND_PRIVATE_RATE", "1"))
+OUTBOUND_PRIVATE_BURST = float(os.getenv("OUTBOUND_PRIVATE_BURST", "3"))
+OUTBOUND_GROUP_RATE = float(os.getenv("OUTBOUND_GROUP_RATE", str(20 / 60)))
+OUTBOUND_GROUP_BURST = float(os.getenv("OUTBOUND_GROUP_BURST", "5"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+
+# Полосы приоритета: ответы пользователям идут раньше рассылок
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+outbound_priority: ContextVar[int] = ContextVar("outbound_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def bulk_priority():
+    """Отправки внутри блока уступают очередь интерактивным ответам"""
+    token = outbound_priority.set(PRIORITY_BULK)
+    try:
+        yield
+    finally:
+        outbound_priority.reset(token)
+
+
+class OutboundLimiter(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: все исходящие сообщения проходят через общие
+    корзины токенов — на чат и на бота целиком.
+
+    Пока ждут отправки интерактивные ответы, рассылка (bulk_priority) не
+    получает токены. TelegramRetryAfter приостанавливает все отправки на
+    указанное время, после чего запрос повторяется.
+    """
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(OUTBOUND_GLOBAL_RATE, OUTBOUND_GLOBAL_BURST)
+        self.private_chats = BucketRegistry(OUTBOUND_PRIVATE_RATE, OUTBOUND_PRIVATE_BURST)
+        self.group_chats = BucketRegistry(OUTBOUND_GROUP_RATE, OUTBOUND_GROUP_BURST)
+        self._waiting: Dict[int, int] = {PRIORITY_INTERACTIVE: 0, PRIORITY_BULK: 0}
+        self._paused_until = 0.0
+        # Счётчики для диагностики
+        self.sent = 0
+        self.retries = 0
+        self.waited_seconds = 0.0
+
+    @staticmethod
+    def _is_limited(method: TelegramMethod) -> bool:
+        if isinstance(method, SendChatAction):
+            return False
+        return type(method).__name__.startswith(("Send", "Copy", "Forward")) and hasattr(method, "chat_id")
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        # Отрицательные id — группы и каналы, строковые (@channel) — тоже
+        if isinstance(chat_id, int) and chat_id > 0:
+            return self.private_chats.get(chat_id)
+        return self.group_chats.get(chat_id)
+
+    async def acquire(self, chat_id, priority: int) -> None:
+        """Ждёт токены чата и бота; более приоритетные ожидающие проходят первыми"""
+        started = time.perf_counter()
+        queued = False  # ждём общий токен или конец паузы — младшие полосы уступают
+        try:
+            while True:
+                now = time.monotonic()
+                chat_bucket = self._chat_bucket(chat_id)
+                if now < self._paused_until:
+                    delay = self._paused_until - now
+                    if not queued:
+                        self._waiting[priority] = self._waiting.get(priority, 0) + 1
+                        queued = True
+                elif chat_bucket.wait_time(now=now) > 0:
+                    # Ожидание лимита своего чата не задерживает остальных
+                    delay = chat_bucket.wait_time(now=now)
+                elif any(count for p, count in self._waiting.items() if p < priority):
+                    delay = 1 / max(self.global_bucket.rate, 1.0)
+                else:
+                    delay = self.global_bucket.wait_time(now=now)
+                    if delay == 0:
+                        chat_bucket.consume(now=now)
+                        self.global_bucket.consume(now=now)
+                        return
+                    if not queued:
+                        self._waiting[priority] = self._waiting.get(priority, 0) + 1
+                        queued = True
+                await asyncio.sleep(delay)
+        finally:
+            if queued:
+                self._waiting[priority] -= 1
+            waited = time.perf_counter() - started
+            self.waited_seconds += waited
+            metrics.observe_stage("telegram_wait", waited)
+            record_span("telegram_wait", started, waited)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if not self._is_limited(method):
+            return await make_request(bot, method)
+
+        priority = outbound_priority.get()
+        for attempt in range(OUTBOUND_MAX_RETRIES + 1):
+            await self.acquire(method.chat_id, priority)
+            try:
+                with metrics.timed("telegram_send"):
+                    response = await make_request(bot, method)
+                self.sent += 1
+                return response
+            except TelegramRetryAfter as e:
+                if attempt >= OUTBOUND_MAX_RETRIES:
+                    raise
+                self.retries += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                logger.warning("Flood control: пауза %s с (%s в %s)", e.retry_after, type(method).__name__, method.chat_id)
+
+
+outbound_limiter = OutboundLimiter()
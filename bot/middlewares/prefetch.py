@@ -0,0 +1,38 @@
+# bot/middlewares/prefetch.py
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.state import State
+from aiogram.types import TelegramObject
+
+from bot.services.selection_prefetch import SelectionPrefetcher
+
+
+class PrefetchCancelMiddleware(BaseMiddleware):
+    """
+    Outer-middleware сообщений и колбэков: отменяет предвыборку подбора,
+    если после обработчика пользователь уже не в состоянии keep_state
+    (анкету сбросили через меню, /start или другую кнопку).
+
+    Хранилище FSM читается только для пользователей с незавершённой
+    предвыборкой.
+    """
+
+    def __init__(self, prefetcher: SelectionPrefetcher, keep_state: State):
+        self.prefetcher = prefetcher
+        self.keep_state = keep_state.state
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            user = data.get("event_from_user")
+            state = data.get("state")
+            if user is not None and state is not None and self.prefetcher.pending(user.id):
+                if await state.get_state() != self.keep_state:
+                    self.prefetcher.cancel(user.id)
@@ -0,0 +1,125 @@
+# bot/middlewares/throttling.py
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from bot.utils.rate_limit import BucketRegistry, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Лимиты маршрутов: (токенов в секунду, запас) на пользователя и на весь бот.
+# cheap — шаблонные ответы, меню, анкеты; rag — вопросы с эмбеддингами и LLM
+THROTTLE_LIMITS = {
+    "cheap": (
+        float(os.getenv("THROTTLE_CHEAP_RATE", "1.0")),
+        float(os.getenv("THROTTLE_CHEAP_BURST", "8")),
+    ),
+    "rag": (
+        float(os.getenv("THROTTLE_RAG_RATE", "0.1")),
+        float(os.getenv("THROTTLE_RAG_BURST", "3")),
+    ),
+}
+THROTTLE_GLOBAL_LIMITS = {
+    "cheap": (
+        float(os.getenv("THROTTLE_GLOBAL_CHEAP_RATE", "50")),
+        float(os.getenv("THROTTLE_GLOBAL_CHEAP_BURST", "100")),
+    ),
+    "rag": (
+        float(os.getenv("THROTTLE_GLOBAL_RAG_RATE", "3")),
+        float(os.getenv("THROTTLE_GLOBAL_RAG_BURST", "15")),
+    ),
+}
+# Не чаще одного предупреждения пользователю за этот интервал
+THROTTLE_NOTICE_INTERVAL = float(os.getenv("THROTTLE_NOTICE_INTERVAL", "15"))
+THROTTLE_IDLE_SECONDS = float(os.getenv("THROTTLE_IDLE_SECONDS", "600"))
+
+THROTTLE_NOTICES = {
+    "user": "⏳ Вы отправляете сообщения слишком часто. Подождите немного — я отвечу на следующий вопрос.",
+    "global": "⏳ Сейчас много обращений. Повторите вопрос через минуту или воспользуйтесь меню.",
+}
+
+RouteResolver = Callable[[TelegramObject, Dict[str, Any]], Awaitable[str]]
+
+
+async def _default_route(event: TelegramObject, data: Dict[str, Any]) -> str:
+    return "cheap"
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Outer-middleware с корзинами токенов на пользователя и на бот целиком.
+
+    Маршрут апдейта определяет корутина route(event, data): дешёвые ответы и
+    дорогие RAG-вопросы лимитируются раздельно. Отклонённый апдейт до
+    обработчиков не доходит; пользователю отвечаем вежливо и не чаще
+    THROTTLE_NOTICE_INTERVAL. Чаты из exempt_chat_ids не ограничиваются.
+    """
+
+    def __init__(
+        self,
+        route: Optional[RouteResolver] = None,
+        limits: Dict[str, Tuple[float, float]] = THROTTLE_LIMITS,
+        global_limits: Dict[str, Tuple[float, float]] = THROTTLE_GLOBAL_LIMITS,
+        exempt_chat_ids: Iterable[int] = (),
+        notice_interval: float = THROTTLE_NOTICE_INTERVAL,
+    ):
+        self.route = route or _default_route
+        self.users = {
+            name: BucketRegistry(rate, burst, idle_seconds=THROTTLE_IDLE_SECONDS)
+            for name, (rate, burst) in limits.items()
+        }
+        self.global_buckets = {name: TokenBucket(rate, burst) for name, (rate, burst) in global_limits.items()}
+        self.exempt_chat_ids = {chat_id for chat_id in exempt_chat_ids if chat_id}
+        self.notice_interval = notice_interval
+        self.throttled = {name: 0 for name in limits}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        chat = data.get("event_chat")
+        if user is None or (chat is not None and chat.id in self.exempt_chat_ids):
+            return await handler(event, data)
+
+        route = await self.route(event, data)
+        registry = self.users.get(route)
+        if registry is None:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        bucket = registry.get(user.id, now)
+        if not bucket.consume(now=now):
+            return await self._reject(event, bucket, route, "user", now)
+
+        global_bucket = self.global_buckets.get(route)
+        if global_bucket is not None and not global_bucket.consume(now=now):
+            # Ограничение общее — личный токен пользователю возвращаем
+            bucket.refund()
+            return await self._reject(event, bucket, route, "global", now)
+
+        return await handler(event, data)
+
+    async def _reject(self, event: TelegramObject, bucket: TokenBucket, route: str, reason: str, now: float) -> None:
+        self.throttled[route] += 1
+        if now - bucket.noticed_at < self.notice_interval:
+            if isinstance(event, CallbackQuery):
+                await event.answer()
+            return None
+
+        bucket.noticed_at = now
+        logger.info("Ограничение %s/%s для пользователя %s", route, reason, event.from_user.id)
+        try:
+            if isinstance(event, CallbackQuery):
+                await event.answer(THROTTLE_NOTICES[reason], show_alert=False)
+            elif isinstance(event, Message):
+                await event.answer(THROTTLE_NOTICES[reason])
+        except Exception as e:
+            logger.warning("Не удалось отправить уведомление об ограничении: %s", e)
+        return None
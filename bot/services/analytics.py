@@ -0,0 +1,261 @@
+# bot/services/analytics.py
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from bot.services.database import SessionLocal, Lead, UserQuery, QueryRollup, RollupWatermark
+# Окно атрибуции одно на журнал запросов и аналитику
+from bot.services.query_log import LEAD_ATTRIBUTION_HOURS
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_INTERVAL = float(os.getenv("ROLLUP_INTERVAL", "60"))
+ROLLUP_BATCH_SIZE = int(os.getenv("ROLLUP_BATCH_SIZE", "5000"))
+# Лиды учитываются с задержкой: отметки is_lead приходят через отложенный журнал запросов
+ROLLUP_LEAD_LAG_SECONDS = float(os.getenv("ROLLUP_LEAD_LAG_SECONDS", "120"))
+
+GRANULARITIES = {
+    "hour": "%Y-%m-%d %H:00:00",
+    "day": "%Y-%m-%d 00:00:00",
+}
+
+QUERIES_WATERMARK = "user_queries"
+LEADS_WATERMARK = "leads"
+
+
+def _bucket(ts: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class RollupWorker:
+    """
+    Инкрементальные агрегаты по user_queries и leads.
+
+    Каждый проход читает только строки с id выше сохранённого watermark,
+    агрегирует их по часу/дню × query_type × outcome и прибавляет к
+    query_rollups. Агрегаты и новый watermark пишутся в одной транзакции,
+    поэтому повторный проход после сбоя не задваивает счётчики.
+    """
+
+    def __init__(self, interval: float = ROLLUP_INTERVAL, batch_size: int = ROLLUP_BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="analytics-rollups")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception as e:
+                logger.error("Ошибка обновления агрегатов: %s", e)
+            await asyncio.sleep(self.interval)
+
+    def run_once(self) -> Tuple[int, int]:
+        """Один проход: (обработано запросов, обработано лидов)"""
+        queries = 0
+        while True:
+            processed = self._rollup_queries()
+            queries += processed
+            if processed < self.batch_size:
+                break
+        leads = self._rollup_leads()
+        return queries, leads
+
+    # ---------------------------------------------------------------- запросы
+
+    def _rollup_queries(self) -> int:
+        db = SessionLocal()
+        try:
+            low = _get_watermark(db, QUERIES_WATERMARK)
+            batch_ids = (
+                select(UserQuery.id).where(UserQuery.id > low).order_by(UserQuery.id).limit(self.batch_size)
+            ).subquery()
+            high, processed = db.execute(select(func.max(batch_ids.c.id), func.count())).one()
+            if not processed:
+                return 0
+
+            increments: Dict[Tuple[str, datetime, str, str], List[int]] = defaultdict(lambda: [0, 0])
+            for granularity, fmt in GRANULARITIES.items():
+                bucket = func.strftime(fmt, UserQuery.timestamp)
+                rows = db.execute(
+                    select(bucket, UserQuery.query_type, UserQuery.outcome, func.count())
+                    .where(UserQuery.id > low, UserQuery.id <= high)
+                    .group_by(bucket, UserQuery.query_type, UserQuery.outcome)
+                ).all()
+                for bucket_start, query_type, outcome, count in rows:
+                    if bucket_start is None:
+                        continue
+                    key = (granularity, datetime.fromisoformat(bucket_start), query_type or "unknown", outcome or "unknown")
+                    increments[key][0] += count
+
+            _apply_increments(db, increments)
+            _set_watermark(db, QUERIES_WATERMARK, high)
+            db.commit()
+            return processed
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    # ---------------------------------------------------------------- конверсии
+
+    def _rollup_leads(self) -> int:
+        """Для новых лидов прибавляет converted к бакетам атрибутированных запросов"""
+        db = SessionLocal()
+        try:
+            low = _get_watermark(db, LEADS_WATERMARK)
+            settled_before = datetime.utcnow() - timedelta(seconds=ROLLUP_LEAD_LAG_SECONDS)
+            leads = db.execute(
+                select(Lead.id, Lead.user_id, Lead.created_at)
+                .where(Lead.id > low, Lead.created_at <= settled_before)
+                .order_by(Lead.id)
+                .limit(self.batch_size)
+            ).all()
+            if not leads:
+                return 0
+
+            window = timedelta(hours=LEAD_ATTRIBUTION_HOURS)
+            increments: Dict[Tuple[str, datetime, str, str], List[int]] = defaultdict(lambda: [0, 0])
+            for lead_id, user_id, created_at in leads:
+                if user_id is None:
+                    continue  # лиды до появления атрибуции
+                # Запросы до предыдущего лида пользователя засчитаны ему: каждый запрос конвертирован не больше раза
+                previous_lead_at = db.execute(
+                    select(func.max(Lead.created_at)).where(Lead.user_id == user_id, Lead.id < lead_id)
+                ).scalar()
+                window_filter = [UserQuery.timestamp >= created_at - window]
+                if previous_lead_at is not None:
+                    window_filter.append(UserQuery.timestamp > previous_lead_at)
+                attributed = db.execute(
+                    select(UserQuery.timestamp, UserQuery.query_type, UserQuery.outcome)
+                    .where(
+                        UserQuery.user_id == user_id,
+                        UserQuery.is_lead.is_(True),
+                        UserQuery.timestamp <= created_at,
+                        *window_filter,
+                    )
+                ).all()
+                for ts, query_type, outcome in attributed:
+                    for granularity in GRANULARITIES:
+                        key = (granularity, _bucket(ts, granularity), query_type or "unknown", outcome or "unknown")
+                        increments[key][1] += 1
+
+            _apply_increments(db, increments)
+            _set_watermark(db, LEADS_WATERMARK, leads[-1][0])
+            db.commit()
+            return len(leads)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+def _get_watermark(db, name: str) -> int:
+    value = db.execute(select(RollupWatermark.last_id).where(RollupWatermark.name == name)).scalar()
+    return value or 0
+
+
+def _set_watermark(db, name: str, last_id: int) -> None:
+    stmt = sqlite_insert(RollupWatermark).values(name=name, last_id=last_id, updated_at=datetime.utcnow())
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[RollupWatermark.name],
+        set_={"last_id": stmt.excluded.last_id, "updated_at": stmt.excluded.updated_at},
+    ))
+
+
+def _apply_increments(db, increments: Dict[Tuple[str, datetime, str, str], List[int]]) -> None:
+    """UPSERT с прибавлением к существующим счётчикам бакета"""
+    for (granularity, bucket_start, query_type, outcome), (queries, converted) in increments.items():
+        stmt = sqlite_insert(QueryRollup).values(
+            granularity=granularity,
+            bucket_start=bucket_start,
+            query_type=query_type,
+            outcome=outcome,
+            queries=queries,
+            converted=converted,
+        )
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[QueryRollup.granularity, QueryRollup.bucket_start, QueryRollup.query_type, QueryRollup.outcome],
+            set_={
+                "queries": QueryRollup.queries + stmt.excluded.queries,
+                "converted": QueryRollup.converted + stmt.excluded.converted,
+            },
+        ))
+
+
+def get_stats(days: int = 7) -> Dict:
+    """Сводка за последние N дней — читает только дневные агрегаты"""
+    since = _bucket(datetime.utcnow(), "day") - timedelta(days=days - 1)
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            select(QueryRollup.bucket_start, QueryRollup.query_type, QueryRollup.outcome,
+                   QueryRollup.queries, QueryRollup.converted)
+            .where(QueryRollup.granularity == "day", QueryRollup.bucket_start >= since)
+        ).all()
+    finally:
+        db.close()
+
+    by_day: Dict[datetime, int] = defaultdict(int)
+    by_type: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+    by_outcome: Dict[str, int] = defaultdict(int)
+    for bucket_start, query_type, outcome, queries, converted in rows:
+        by_day[bucket_start] += queries
+        by_type[query_type][0] += queries
+        by_type[query_type][1] += converted
+        by_outcome[outcome] += queries
+
+    return {
+        "days": days,
+        "total": sum(by_day.values()),
+        "by_day": dict(sorted(by_day.items())),
+        "by_type": dict(sorted(by_type.items(), key=lambda item: -item[1][0])),
+        "by_outcome": dict(sorted(by_outcome.items(), key=lambda item: -item[1])),
+    }
+
+
+def format_stats(stats: Dict) -> str:
+    lines = [f"📊 <b>Статистика за {stats['days']} дн.</b>", f"Всего запросов: {stats['total']}", ""]
+
+    lines.append("<b>По дням:</b>")
+    for day, queries in stats["by_day"].items():
+        lines.append(f"• {day:%d.%m}: {queries}")
+
+    lines.append("")
+    lines.append("<b>По типам (запросы / привели к лиду):</b>")
+    for query_type, (queries, converted) in stats["by_type"].items():
+        rate = converted / queries * 100 if queries else 0
+        lines.append(f"• {query_type}: {queries} / {converted} ({rate:.1f}%)")
+
+    lines.append("")
+    lines.append("<b>По исходу:</b>")
+    for outcome, queries in stats["by_outcome"].items():
+        lines.append(f"• {outcome}: {queries}")
+
+    return "\n".join(lines)
+
+
+rollup_worker = RollupWorker()
@@ -0,0 +1,254 @@
+# bot/services/archiver.py
+"""
+Архивирование старых записей user_queries в сжатые помесячные JSONL-файлы.
+
+Структура архива:
+    data/archive/user_queries/index.json
+    data/archive/user_queries/2026-01/part-000000000001.jsonl.gz
+
+Запуск из командной строки:
+    python -m bot.services.archiver run
+    python -m bot.services.archiver query --from 2026-01-01 --to 2026-02-01 --type technical
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import delete, select
+
+from bot.services.database import SessionLocal, UserQuery, RollupWatermark
+
+logger = logging.getLogger(__name__)
+
+QUERY_RETENTION_DAYS = int(os.getenv("QUERY_RETENTION_DAYS", "90"))
+ARCHIVE_PATH = os.getenv("ARCHIVE_PATH", "data/archive/user_queries")
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "2000"))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+# Пауза между пачками, чтобы не держать блокировку записи подряд
+ARCHIVE_BATCH_PAUSE = float(os.getenv("ARCHIVE_BATCH_PAUSE", "0.5"))
+
+ARCHIVE_COLUMNS = [column.name for column in UserQuery.__table__.columns]
+INDEX_FILENAME = "index.json"
+
+
+def _serialize(row: Dict) -> Dict:
+    return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in row.items()}
+
+
+class QueryArchiver:
+    """
+    Переносит записи старше QUERY_RETENTION_DAYS из горячей таблицы в архив.
+
+    Каждая пачка: чтение строк → запись файла части (через временный файл
+    и os.replace) → обновление индекса → удаление строк короткой транзакцией.
+    Имя части задаётся первым id пачки в месяце: строки удаляются только
+    после записи части, поэтому повтор после сбоя начинается с того же id и
+    перезаписывает тот же файл, даже если пачка стала длиннее. Части индекса,
+    чей диапазон id пересекается с новой, заменяются ею — дубликатов в
+    архиве не бывает. Архивируются только строки, уже учтённые в агрегатах
+    аналитики (не выше watermark user_queries).
+    """
+
+    def __init__(
+        self,
+        archive_path: str = ARCHIVE_PATH,
+        retention_days: int = QUERY_RETENTION_DAYS,
+        batch_size: int = ARCHIVE_BATCH_SIZE,
+        interval: float = ARCHIVE_INTERVAL,
+    ):
+        self.archive_path = archive_path
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------------------------------------------------------------- фоновый режим
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="query-archiver")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                while await asyncio.to_thread(self.archive_batch) >= self.batch_size:
+                    await asyncio.sleep(ARCHIVE_BATCH_PAUSE)
+            except Exception as e:
+                logger.error("Ошибка архивирования журнала запросов: %s", e)
+            await asyncio.sleep(self.interval)
+
+    # ---------------------------------------------------------------- архивирование
+
+    def run_once(self) -> int:
+        """Архивирует все подходящие строки, возвращает их количество"""
+        total = 0
+        while True:
+            archived = self.archive_batch()
+            total += archived
+            if archived < self.batch_size:
+                return total
+
+    def archive_batch(self) -> int:
+        cutoff = datetime.utcnow() - timedelta(days=self.retention_days)
+        db = SessionLocal()
+        try:
+            rolled_up_to = db.execute(
+                select(RollupWatermark.last_id).where(RollupWatermark.name == "user_queries")
+            ).scalar() or 0
+            rows = db.execute(
+                select(*[getattr(UserQuery, name) for name in ARCHIVE_COLUMNS])
+                .where(UserQuery.timestamp < cutoff, UserQuery.id <= rolled_up_to)
+                .order_by(UserQuery.id)
+                .limit(self.batch_size)
+            ).mappings().all()
+            db.rollback()  # закрываем читающую транзакцию до записи файлов
+            if not rows:
+                return 0
+
+            by_month: Dict[str, List[Dict]] = defaultdict(list)
+            for row in rows:
+                by_month[row["timestamp"].strftime("%Y-%m")].append(dict(row))
+
+            index = self.load_index()
+            replaced: List[str] = []
+            for month, month_rows in by_month.items():
+                entry = self._write_part(month, month_rows)
+                files = index["partitions"].setdefault(month, {"files": []})["files"]
+                overlapping = [f for f in files if f["min_id"] <= entry["max_id"] and f["max_id"] >= entry["min_id"]]
+                replaced += [f["file"] for f in overlapping if f["file"] != entry["file"]]
+                files[:] = [f for f in files if f not in overlapping] + [entry]
+            self._save_index(index)
+            # Вытесненные части удаляем только после записи индекса, который на них уже не ссылается
+            for name in replaced:
+                try:
+                    os.remove(os.path.join(self.archive_path, name))
+                except FileNotFoundError:
+                    pass
+
+            ids = [row["id"] for row in rows]
+            db.execute(delete(UserQuery).where(UserQuery.id.in_(ids)))
+            db.commit()
+            logger.info("Архивировано %d записей user_queries (до id %s)", len(ids), ids[-1])
+            return len(ids)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _write_part(self, month: str, rows: List[Dict]) -> Dict:
+        partition_dir = os.path.join(self.archive_path, month)
+        os.makedirs(partition_dir, exist_ok=True)
+
+        min_id, max_id = rows[0]["id"], rows[-1]["id"]
+        filename = f"part-{min_id:012d}.jsonl.gz"
+        path = os.path.join(partition_dir, filename)
+        tmp_path = f"{path}.tmp"
+
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(_serialize(row), ensure_ascii=False) + "\n")
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+        timestamps = [row["timestamp"] for row in rows]
+        return {
+            "file": f"{month}/{filename}",
+            "rows": len(rows),
+            "min_id": min_id,
+            "max_id": max_id,
+            "min_ts": min(timestamps).isoformat(),
+            "max_ts": max(timestamps).isoformat(),
+        }
+
+    # ---------------------------------------------------------------- индекс
+
+    def load_index(self) -> Dict:
+        path = os.path.join(self.archive_path, INDEX_FILENAME)
+        if not os.path.exists(path):
+            return {"columns": ARCHIVE_COLUMNS, "partitions": {}}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_index(self, index: Dict) -> None:
+        os.makedirs(self.archive_path, exist_ok=True)
+        path = os.path.join(self.archive_path, INDEX_FILENAME)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    # ---------------------------------------------------------------- чтение
+
+    def iter_archived(
+        self,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        query_type: Optional[str] = None,
+    ) -> Iterator[Dict]:
+        """
+        Построчно читает архив за период. Части, не пересекающиеся с периодом
+        по min_ts/max_ts из индекса, не открываются.
+        """
+        index = self.load_index()
+        for month in sorted(index["partitions"]):
+            for part in sorted(index["partitions"][month]["files"], key=lambda p: p["min_id"]):
+                if date_from and datetime.fromisoformat(part["max_ts"]) < date_from:
+                    continue
+                if date_to and datetime.fromisoformat(part["min_ts"]) >= date_to:
+                    continue
+                with gzip.open(os.path.join(self.archive_path, part["file"]), "rt", encoding="utf-8") as f:
+                    for line in f:
+                        row = json.loads(line)
+                        ts = datetime.fromisoformat(row["timestamp"])
+                        if date_from and ts < date_from:
+                            continue
+                        if date_to and ts >= date_to:
+                            continue
+                        if query_type and row.get("query_type") != query_type:
+                            continue
+                        row["timestamp"] = ts
+                        yield row
+
+
+query_archiver = QueryArchiver()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Архив журнала запросов ECOFES")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("run", help="архивировать записи старше QUERY_RETENTION_DAYS")
+    query_parser = subparsers.add_parser("query", help="вывести архивные записи в JSONL")
+    query_parser.add_argument("--from", dest="date_from", help="YYYY-MM-DD")
+    query_parser.add_argument("--to", dest="date_to", help="YYYY-MM-DD")
+    query_parser.add_argument("--type", dest="query_type")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        print(f"✅ Архивировано записей: {query_archiver.run_once()}")
+    else:
+        parse = lambda value: datetime.strptime(value, "%Y-%m-%d") if value else None
+        for row in query_archiver.iter_archived(parse(args.date_from), parse(args.date_to), args.query_type):
+            print(json.dumps(_serialize(row), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
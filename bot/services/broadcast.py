@@ -0,0 +1,233 @@
+# bot/services/broadcast.py
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from sqlalchemy import func, select, update
+
+from bot.middlewares.outbound import bulk_priority
+from bot.services.database import SessionLocal, Broadcast, UserQuery
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "500"))
+# Курсор сохраняется каждые N отправок: после сбоя повторно получат не больше N человек
+BROADCAST_CHECKPOINT_EVERY = int(os.getenv("BROADCAST_CHECKPOINT_EVERY", "10"))
+
+
+class BroadcastRunner:
+    """
+    Рассылка текста всем, кто писал боту (user_queries).
+
+    Получатели читаются пачками по возрастанию user_id через индекс
+    ix_user_queries_user_id_timestamp, курсор и счётчики хранятся в
+    broadcasts — после рестарта незавершённые рассылки продолжаются.
+    Отправка идёт с приоритетом bulk: лимиты Telegram соблюдает
+    OutboundLimiter, ответы пользователям его обгоняют.
+    """
+
+    def __init__(self, batch_size: int = BROADCAST_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._bot: Optional[Bot] = None
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def start(self, bot: Bot) -> None:
+        """Запоминает бота и продолжает прерванные рассылки"""
+        self._bot = bot
+        for broadcast_id in self._running_ids():
+            logger.info("Продолжаем рассылку #%s", broadcast_id)
+            self._launch(broadcast_id)
+
+    async def stop(self) -> None:
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def create(self, text: str, created_by_chat_id: Optional[int] = None) -> int:
+        broadcast_id = await asyncio.to_thread(self._insert, text, created_by_chat_id)
+        self._launch(broadcast_id)
+        return broadcast_id
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        cancelled = await asyncio.to_thread(self._set_cancelled, broadcast_id)
+        task = self._tasks.get(broadcast_id)
+        if task is not None:
+            task.cancel()
+        return cancelled
+
+    async def get_status(self, broadcast_id: Optional[int] = None) -> Optional[Dict]:
+        """Состояние рассылки (по умолчанию — последней)"""
+        return await asyncio.to_thread(self._select_status, broadcast_id)
+
+    def _launch(self, broadcast_id: int) -> None:
+        if self._bot is None:
+            raise RuntimeError("BroadcastRunner не запущен")
+        task = self._tasks.get(broadcast_id)
+        if task is None or task.done():
+            task = asyncio.create_task(self._run(broadcast_id), name=f"broadcast-{broadcast_id}")
+            self._tasks[broadcast_id] = task
+            task.add_done_callback(lambda t, key=broadcast_id: self._tasks.pop(key, None))
+
+    async def _run(self, broadcast_id: int) -> None:
+        status = await self.get_status(broadcast_id)
+        if status is None or status["status"] != "running":
+            return
+        text, cursor = status["text"], status["last_user_id"]
+        sent = failed = since_checkpoint = 0
+
+        with bulk_priority():
+            try:
+                while True:
+                    recipients = await asyncio.to_thread(self._fetch_recipients, cursor, self.batch_size)
+                    if not recipients:
+                        break
+                    for user_id in recipients:
+                        try:
+                            await self._bot.send_message(chat_id=user_id, text=text)
+                            sent += 1
+                        except (TelegramForbiddenError, TelegramBadRequest) as e:
+                            # Заблокировал бота или удалил аккаунт
+                            logger.info("Рассылка #%s: %s недоступен (%s)", broadcast_id, user_id, e)
+                            failed += 1
+                        except Exception as e:
+                            logger.warning("Рассылка #%s: ошибка отправки %s: %s", broadcast_id, user_id, e)
+                            failed += 1
+                        cursor = user_id
+                        since_checkpoint += 1
+                        if since_checkpoint >= BROADCAST_CHECKPOINT_EVERY:
+                            if not await asyncio.to_thread(self._checkpoint, broadcast_id, cursor, sent, failed):
+                                logger.info("Рассылка #%s отменена", broadcast_id)
+                                return
+                            sent = failed = since_checkpoint = 0
+            finally:
+                # Дописываем прогресс и при отмене (остановка бота или /broadcast_cancel)
+                if since_checkpoint:
+                    await asyncio.to_thread(self._checkpoint, broadcast_id, cursor, sent, failed)
+
+        await asyncio.to_thread(self._finish, broadcast_id)
+        status = await self.get_status(broadcast_id)
+        logger.info("✅ Рассылка #%s завершена: %d отправлено, %d ошибок", broadcast_id, status["sent"], status["failed"])
+        if status["created_by_chat_id"]:
+            try:
+                await self._bot.send_message(status["created_by_chat_id"], format_broadcast(status))
+            except Exception as e:
+                logger.warning("Не удалось отправить итог рассылки #%s: %s", broadcast_id, e)
+
+    # ---------------------------------------------------------------- БД
+
+    def _insert(self, text: str, created_by_chat_id: Optional[int]) -> int:
+        db = SessionLocal()
+        try:
+            total = db.execute(select(func.count(func.distinct(UserQuery.user_id))).where(UserQuery.user_id > 0)).scalar()
+            broadcast = Broadcast(
+                text=text,
+                status="running",
+                created_by_chat_id=created_by_chat_id,
+                last_user_id=0,
+                total=total or 0,
+                sent=0,
+                failed=0,
+            )
+            db.add(broadcast)
+            db.commit()
+            return broadcast.id
+        finally:
+            db.close()
+
+    def _running_ids(self) -> List[int]:
+        db = SessionLocal()
+        try:
+            return list(db.execute(select(Broadcast.id).where(Broadcast.status == "running")).scalars())
+        finally:
+            db.close()
+
+    def _fetch_recipients(self, after_user_id: int, limit: int) -> List[int]:
+        db = SessionLocal()
+        try:
+            return list(db.execute(
+                select(UserQuery.user_id)
+                .where(UserQuery.user_id > max(after_user_id, 0))
+                .group_by(UserQuery.user_id)
+                .order_by(UserQuery.user_id)
+                .limit(limit)
+            ).scalars())
+        finally:
+            db.close()
+
+    def _checkpoint(self, broadcast_id: int, cursor: int, sent: int, failed: int) -> bool:
+        """Сохраняет курсор и прибавляет счётчики; False — рассылку отменили"""
+        db = SessionLocal()
+        try:
+            result = db.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.status == "running")
+                .values(
+                    last_user_id=cursor,
+                    sent=Broadcast.sent + sent,
+                    failed=Broadcast.failed + failed,
+                    updated_at=datetime.utcnow(),
+                )
+            )
+            db.commit()
+            return result.rowcount > 0
+        finally:
+            db.close()
+
+    def _finish(self, broadcast_id: int) -> None:
+        self._set_status(broadcast_id, "done")
+
+    def _set_cancelled(self, broadcast_id: int) -> bool:
+        return self._set_status(broadcast_id, "cancelled")
+
+    def _set_status(self, broadcast_id: int, status: str) -> bool:
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            result = db.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.status == "running")
+                .values(status=status, updated_at=now, finished_at=now)
+            )
+            db.commit()
+            return result.rowcount > 0
+        finally:
+            db.close()
+
+    def _select_status(self, broadcast_id: Optional[int]) -> Optional[Dict]:
+        db = SessionLocal()
+        try:
+            query = select(Broadcast)
+            query = query.where(Broadcast.id == broadcast_id) if broadcast_id else query.order_by(Broadcast.id.desc())
+            broadcast = db.execute(query.limit(1)).scalar()
+            if broadcast is None:
+                return None
+            return {
+                column: getattr(broadcast, column)
+                for column in (
+                    "id", "text", "status", "created_by_chat_id", "last_user_id",
+                    "total", "sent", "failed", "created_at", "finished_at",
+                )
+            }
+        finally:
+            db.close()
+
+
+def format_broadcast(status: Dict) -> str:
+    """Краткий отчёт о рассылке для чата поддержки"""
+    titles = {"running": "идёт", "done": "завершена", "cancelled": "отменена"}
+    processed = status["sent"] + status["failed"]
+    percent = f" ({processed * 100 // status['total']}%)" if status["total"] else ""
+    return (
+        f"📣 Рассылка #{status['id']}: {titles.get(status['status'], status['status'])}\n"
+        f"Обработано: {processed} из ~{status['total']}{percent}\n"
+        f"Доставлено: {status['sent']}, не доставлено: {status['failed']}"
+    )
+
+
+broadcast_runner = BroadcastRunner()
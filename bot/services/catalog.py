@@ -0,0 +1,469 @@
+# bot/services/catalog.py
+"""
+Структурированный каталог продукции из карточек базы знаний.
+
+Карточка продукта в data/docs — заголовок (класс продукта и название с
+вязкостями), строка описания, «Состав: ...» и, если есть, «допуски и
+соответствия: ...». Из неё извлекаются категория, классы техники, SAE,
+ISO VG, спецификации API/ACEA/JASO, тип коробки передач, допуски
+производителей и тип основы.
+Каталог держит индексы по этим признакам и выдаёт детерминированный
+шорт-лист для подбора масла — LLM получает компактную таблицу вместо
+сырых фрагментов.
+"""
+import glob
+import html
+import logging
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from bot.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CATALOG_DOCS_PATH = os.getenv("RAG_DOCS_PATH", "data/docs")
+CATALOG_SHORTLIST_SIZE = int(os.getenv("CATALOG_SHORTLIST_SIZE", "5"))
+
+# Кириллические буквы, которые в карточках встречаются вместо латинских (SР, СJ-4, 4Т)
+_LATIN = str.maketrans("АВСЕНКМОРТХавсеокмортх", "ABCEHKMOPTXabceokmoptx")
+
+_COMPOSITION_RE = re.compile(r"^\s*[СC]остав:\s*", re.IGNORECASE)
+_APPROVALS_MARKER = "допуски и соответствия:"
+_SAE_RE = re.compile(r"\b(\d{1,2})\s*W\s*-?\s*(\d{2,3})\b", re.IGNORECASE)
+_ISO_VG_RE = re.compile(r"ISO\s*VG\s*(\d{1,4}(?:\s*/\s*\d{1,4})*)", re.IGNORECASE)
+_VG_LIST_RE = re.compile(r"(?<![\w-])(\d{2,4}(?:/\d{2,4})+)(?![\w-])")
+_TOKEN_SPLIT_RE = re.compile(r"[\s/,;:()]+")
+_API_ENGINE_RE = re.compile(r"^(S[A-P]|C[A-K](?:-4)?)\+?$")
+_API_GEAR_RE = re.compile(r"GL\s*-\s*(\d)", re.IGNORECASE)
+_API_TWO_STROKE_RE = re.compile(r"\bAPI\s+(T[A-D])\b")
+_ACEA_RE = re.compile(r"^(?:[ABC]\d|E\d{1,2})(?:-\d{2})?$")
+_JASO_RE = re.compile(r"^(MA2?|MB|F[A-D]|DL-1|DH-[12])$")
+_APPROVAL_NUMBER_RE = re.compile(r"(?<![\d.])(\d{3}(?:\.\d{1,2})?)(?![\d])")
+_ENGINE_RE = re.compile(r"\b([24])T\b")
+# Где в заголовке кончается название продукта
+_NAME_STOP_RE = re.compile(r"\b(?:ISO\s*VG|SAE)\b", re.IGNORECASE)
+
+# Порядок классов API: более новый класс покрывает предыдущие той же серии
+_API_GASOLINE_ORDER = "ABCDEFGHJLMNP"
+_API_DIESEL_ORDER = "ABCDEFGHIJK"
+
+# Класс техники → ключевые слова заголовка или описания
+VEHICLE_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "car": ("легков",),
+    "truck": ("грузов", "коммерческ", "спецтехник"),
+    "moto": ("мотоцикл", "мототехник", "мотороллер"),
+    "snow": ("снегоход",),
+    "water": ("водного транспорта", "лодочн", "гидроцикл"),
+    "industrial": (
+        "инструмент", "промышлен", "горнодобыва", "строительн", "компрессор",
+        "гидравлич", "редуктор", "газопоршнев", "холодильн",
+    ),
+}
+
+# Категория по заголовку; порядок важен («холодильных компрессоров» раньше «компрессор»)
+CATEGORY_KEYWORDS: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+    ("refrigeration", ("холодильн",)),
+    ("gas_engine", ("газопоршнев",)),
+    ("transmission", ("коробок передач", "трансмиссион")),
+    ("hydraulic", ("гидравлическ",)),
+    ("compressor", ("компрессор",)),
+    ("gear", ("редуктор",)),
+    ("motor", ("моторное", "двигател")),
+)
+
+# Выбор в меню подбора → класс техники каталога
+SELECTION_VEHICLES = {
+    "select_car": "car",
+    "select_truck": "truck",
+    "select_moto": "moto",
+    "select_snow": "snow",
+    "select_water": "water",
+    "select_industrial": "industrial",
+}
+
+# Тип коробки передач: слова запроса → метки в названии продукта
+GEARBOX_TYPES: Dict[str, Tuple[Tuple[str, ...], Tuple[str, ...]]] = {
+    "dct": (("dsg", "dct", "робот", "двойным сцеплением"), ("dct", "dsg")),
+    "cvt": (("cvt", "вариатор"), ("cvt",)),
+    "atf": (("акпп", "автомат", "atf"), ("atf",)),
+    "haldex": (("haldex", "халдекс"), ("haldex",)),
+}
+
+# Слова запроса, по которым клиент ищет не моторное масло
+_REQUEST_CATEGORIES = (
+    ("transmission", ("кпп", "коробк", "трансмисс", "мост", "дифференциал", "раздатк")),
+    ("hydraulic", ("гидравли", "гидросистем")),
+    ("compressor", ("компрессор",)),
+    ("gear", ("редуктор",)),
+)
+
+BASE_LABELS = {"synthetic": "синтетика", "semi-synthetic": "полусинтетика", "mineral": "минеральное"}
+CATEGORY_LABELS = {
+    "motor": "моторное", "transmission": "трансмиссионное", "hydraulic": "гидравлическое",
+    "compressor": "компрессорное", "gear": "редукторное", "refrigeration": "холодильное",
+    "gas_engine": "для ГПУ",
+}
+
+
+@dataclass
+class Product:
+    id: int
+    name: str
+    title: str
+    category: str
+    vehicles: FrozenSet[str]
+    engine: Optional[str]  # 2T / 4T для мототехники
+    sae: Tuple[str, ...]
+    iso_vg: Tuple[int, ...]
+    specs: FrozenSet[str]  # «API SP», «ACEA C3», «JASO MA2», «API GL-5»
+    gearbox: FrozenSet[str]  # dct / cvt / atf / haldex по заголовку
+    approvals: str
+    base: str
+    source: str
+
+
+@dataclass
+class SelectionRequest:
+    """Признаки, извлечённые из ответа клиента в анкете подбора"""
+
+    vehicle: Optional[str] = None
+    category: str = "motor"
+    engine: Optional[str] = None
+    sae: Set[str] = field(default_factory=set)
+    specs: Set[str] = field(default_factory=set)
+    approvals: Set[str] = field(default_factory=set)
+    gearbox: Set[str] = field(default_factory=set)
+    base: Optional[str] = None
+
+
+def _latinize(text: str) -> str:
+    return text.translate(_LATIN)
+
+
+def parse_sae(text: str) -> List[str]:
+    grades = []
+    for low, high in _SAE_RE.findall(_latinize(text)):
+        grade = f"{int(low)}W-{high}"
+        if grade not in grades:
+            grades.append(grade)
+    return grades
+
+
+def parse_specs(text: str) -> Set[str]:
+    """Спецификации API/ACEA/JASO из заголовка, допусков или запроса клиента"""
+    text = _latinize(text)
+    specs = {f"API GL-{level}" for level in _API_GEAR_RE.findall(text)}
+    specs |= {f"API {cls}" for cls in _API_TWO_STROKE_RE.findall(text)}
+    has_jaso = "JASO" in text.upper()
+    for token in _TOKEN_SPLIT_RE.split(text):
+        upper = token.upper().strip(".")
+        if _API_ENGINE_RE.match(upper):
+            specs.add(f"API {upper}")
+        elif _ACEA_RE.match(upper):
+            specs.add(f"ACEA {upper}")
+        elif has_jaso and _JASO_RE.match(upper):
+            specs.add(f"JASO {upper}")
+    return specs
+
+
+def parse_iso_vg(text: str) -> List[int]:
+    grades: List[int] = []
+    for group in _ISO_VG_RE.findall(text) + _VG_LIST_RE.findall(text):
+        for value in group.split("/"):
+            if value.strip() and int(value) not in grades:
+                grades.append(int(value))
+    return sorted(grades)
+
+
+def _keyword_classes(text: str, table) -> Set[str]:
+    lower = text.lower()
+    return {name for name, words in table.items() if any(word in lower for word in words)}
+
+
+def _category(title: str) -> str:
+    lower = title.lower()
+    for name, words in CATEGORY_KEYWORDS:
+        if any(word in lower for word in words):
+            return name
+    return "motor"
+
+
+def _base(description: str, composition: str) -> str:
+    description, composition = description.lower(), composition.lower()
+    if "полусинтет" in description or "нефтян" in composition:
+        return "semi-synthetic"
+    if "синтет" in description or "синтет" in composition:
+        return "synthetic"
+    return "mineral"
+
+
+def _product_name(title: str) -> str:
+    """Название — с первого слова заголовка, начинающегося с заглавной буквы или цифры, до вязкостей"""
+    lines = title.split("\n")
+    # Двухстрочный заголовок (компрессорные, редукторные): первая строка — класс, вторая — название
+    line = lines[-1] if len(lines) > 1 else lines[0]
+    words = line.split()
+    start = next((i for i, word in enumerate(words) if i and (word[0].isupper() or word[0].isdigit())), 0)
+    name = " ".join(words[start:]) if len(lines) == 1 else line
+    cut = min(
+        (m.start() for m in (_SAE_RE.search(name), _NAME_STOP_RE.search(name)) if m),
+        default=len(name),
+    )
+    return name[:cut].strip(" ,") or name
+
+
+def parse_product_cards(content: str, source: str) -> List[dict]:
+    """Карточки продуктов файла: заголовок, описание, состав, допуски"""
+    lines = [line.strip() for line in content.splitlines()]
+    cards = []
+    header_start = 0
+    for i, line in enumerate(lines):
+        if not _COMPOSITION_RE.match(line) or i == 0:
+            continue
+        composition = _COMPOSITION_RE.sub("", line)
+        approvals = ""
+        end = i + 1
+        # Допуски — следующей строкой; иногда склеены с переносом состава («...эфирыдопуски и ...»)
+        position = lines[end].lower().find(_APPROVALS_MARKER) if end < len(lines) else -1
+        if position >= 0:
+            composition = f"{composition} {lines[end][:position]}".strip()
+            approvals = lines[end][position + len(_APPROVALS_MARKER):]
+            end += 1
+        elif _APPROVALS_MARKER in composition.lower():
+            position = composition.lower().index(_APPROVALS_MARKER)
+            composition, approvals = composition[:position], composition[position + len(_APPROVALS_MARKER):]
+
+        title_lines = [value for value in lines[header_start:i - 1] if value]
+        if title_lines:
+            cards.append({
+                "title": "\n".join(title_lines[-2:]),
+                "description": lines[i - 1],
+                "composition": composition.strip(),
+                "approvals": approvals.strip(),
+                "source": source,
+            })
+        header_start = end
+    return cards
+
+
+def _api_satisfies(offered: Iterable[str], requested: str) -> bool:
+    """API SP покрывает SN и ниже, CK-4 — CJ-4 и ниже (в пределах одной серии)"""
+    if requested in offered:
+        return True
+    code = requested.removeprefix("API ").rstrip("+").removesuffix("-4")
+    if len(code) != 2 or code[0] not in "SC":
+        return False
+    order = _API_GASOLINE_ORDER if code[0] == "S" else _API_DIESEL_ORDER
+    if code[1] not in order:
+        return False
+    for spec in offered:
+        have = spec.removeprefix("API ").rstrip("+").removesuffix("-4")
+        if len(have) == 2 and have[0] == code[0] and have[1] in order and order.index(have[1]) >= order.index(code[1]):
+            return True
+    return False
+
+
+def _approval_matches(number: str, approvals: str) -> bool:
+    """Номер допуска из запроса в тексте допусков: «504.00» совпадает с «VW 504/507», «229.5» — не с «229.51»"""
+    number = re.sub(r"\.0+$", "", number)
+    return re.search(rf"(?<![\d.]){re.escape(number)}(?!\d)", approvals) is not None
+
+
+class ProductCatalog:
+    """
+    Каталог продуктов с индексами по признакам: категория, класс техники,
+    такт двигателя, SAE, ISO VG, спецификации, основа. Загружается при
+    первом обращении.
+    """
+
+    def __init__(self, docs_path: str = CATALOG_DOCS_PATH):
+        self.docs_path = docs_path
+        self.products: List[Product] = []
+        self._index: Dict[str, Dict[str, Set[int]]] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        with self._lock:
+            if self._loaded:
+                return
+            for path in sorted(glob.glob(f"{self.docs_path}/**/*.txt", recursive=True)):
+                with open(path, "r", encoding="utf-8") as f:
+                    content = f.read()
+                for card in parse_product_cards(content, path):
+                    self._add(card)
+            self._loaded = True
+            logger.info("Каталог: %d продуктов", len(self.products))
+
+    def rebuilt(self) -> "ProductCatalog":
+        fresh = ProductCatalog(self.docs_path)
+        fresh.load()
+        return fresh
+
+    def replace_with(self, other: "ProductCatalog") -> None:
+        """Подменяет продукты и индексы собранными в other; вызывать из event loop"""
+        self.products, self._index = other.products, other._index
+        self._loaded = True
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def _add(self, card: dict) -> None:
+        title = card["title"]
+        flat_title = title.replace("\n", " ")
+        category = _category(flat_title)
+        vehicles = _keyword_classes(flat_title, VEHICLE_KEYWORDS) or _keyword_classes(card["description"], VEHICLE_KEYWORDS)
+        if category not in ("motor", "transmission"):
+            vehicles.add("industrial")
+        elif category == "transmission" and not vehicles:
+            # «для автоматических коробок передач автомобилей» без уточнения — легковые и грузовые
+            vehicles.update(("car", "truck"))
+        engine = _ENGINE_RE.search(_latinize(flat_title))
+        name = _product_name(title)
+        product = Product(
+            id=len(self.products),
+            name=name,
+            title=flat_title,
+            category=category,
+            vehicles=frozenset(vehicles),
+            engine=f"{engine.group(1)}T" if engine else None,
+            sae=tuple(parse_sae(flat_title)),
+            iso_vg=tuple(parse_iso_vg(flat_title)),
+            # Спецификации заголовка — только после названия: «sp» в «CVTF ns-1-3/sp iii» не API SP
+            specs=frozenset(parse_specs(flat_title.partition(name)[2]) | parse_specs(card["approvals"])),
+            gearbox=frozenset(
+                kind for kind, (_, markers) in GEARBOX_TYPES.items()
+                if category == "transmission" and any(marker in flat_title.lower() for marker in markers)
+            ),
+            approvals=card["approvals"],
+            base=_base(card["description"], card["composition"]),
+            source=card["source"],
+        )
+        self.products.append(product)
+
+        keys = [("category", product.category), ("base", product.base)]
+        keys += [("vehicle", vehicle) for vehicle in product.vehicles]
+        keys += [("sae", grade) for grade in product.sae]
+        keys += [("iso_vg", str(grade)) for grade in product.iso_vg]
+        keys += [("spec", spec) for spec in product.specs]
+        keys += [("gearbox", kind) for kind in product.gearbox]
+        if product.engine:
+            keys.append(("engine", product.engine))
+        for attribute, value in keys:
+            self._index.setdefault(attribute, {}).setdefault(value, set()).add(product.id)
+
+    def lookup(self, attribute: str, value: str) -> Set[int]:
+        """Номера продуктов с данным значением признака"""
+        self.load()
+        return self._index.get(attribute, {}).get(value, set())
+
+    # ---------------------------------------------------------------- подбор
+
+    @staticmethod
+    def parse_request(text: str, vehicle_type: str = "") -> SelectionRequest:
+        """Признаки из свободного текста клиента и выбранного в меню типа техники"""
+        lower = text.lower()
+        # «2Т»/«4Т» часто набирают кириллицей — такт ищем и в латинизированном тексте
+        latin = _latinize(text).lower()
+        request = SelectionRequest(vehicle=SELECTION_VEHICLES.get(vehicle_type))
+        for category, words in _REQUEST_CATEGORIES:
+            if any(word in lower for word in words):
+                request.category = category
+                break
+        request.gearbox = {kind for kind, (words, _) in GEARBOX_TYPES.items() if any(word in lower for word in words)}
+        if request.gearbox and request.category == "motor":
+            request.category = "transmission"
+        if "двухтакт" in lower or re.search(r"\b2\s*t\b", latin):
+            request.engine = "2T"
+        elif "четырехтакт" in lower or "четырёхтакт" in lower or re.search(r"\b4\s*t\b", latin):
+            request.engine = "4T"
+        request.sae = set(parse_sae(text))
+        request.specs = parse_specs(text)
+        request.approvals = set(_APPROVAL_NUMBER_RE.findall(text))
+        if "полусинт" in lower:
+            request.base = "semi-synthetic"
+        elif "синтет" in lower:
+            request.base = "synthetic"
+        elif "минерал" in lower:
+            request.base = "mineral"
+        return request
+
+    def shortlist(self, request: SelectionRequest, limit: int = CATALOG_SHORTLIST_SIZE) -> List[Product]:
+        """
+        Кандидаты для подбора: жёсткий отбор по категории и классу техники,
+        мягкий по такту (если продукты с таким тактом есть), затем
+        ранжирование по совпадению SAE, типа коробки, спецификаций, допусков
+        и основы.
+
+        Пустой список — каталог запрос не покрывает: нет продуктов нужной
+        категории для этой техники или ни один признак запроса не совпал.
+        Тогда подбор идёт через поиск по базе знаний.
+        """
+        self.load()
+        with metrics.timed("catalog_shortlist"):
+            candidates = set(range(len(self.products)))
+            for attribute, value in (("category", request.category), ("vehicle", request.vehicle)):
+                if value:
+                    candidates &= self.lookup(attribute, value)
+            if request.engine:
+                matched = candidates & self.lookup("engine", request.engine)
+                if matched:
+                    candidates = matched
+
+            def score(product: Product) -> float:
+                points = 0.0
+                if request.sae & set(product.sae):
+                    points += 3
+                if request.gearbox & product.gearbox:
+                    points += 3
+                points += 2 * sum(
+                    1 for spec in request.specs
+                    if (_api_satisfies(product.specs, spec) if spec.startswith("API ") else spec in product.specs)
+                )
+                points += 2 * sum(1 for number in request.approvals if _approval_matches(number, product.approvals))
+                if request.base and request.base == product.base:
+                    points += 1
+                return points
+
+            scores = {i: score(self.products[i]) for i in candidates}
+            if not scores or max(scores.values()) == 0:
+                return []
+            ranked = sorted((self.products[i] for i in candidates), key=lambda p: (-scores[p.id], p.id))
+            # Если клиент назвал вязкость, продукты без неё в шорт-лист не берём (когда есть с ней)
+            if request.sae and any(request.sae & set(p.sae) for p in ranked):
+                ranked = [p for p in ranked if request.sae & set(p.sae)]
+            return ranked[:limit]
+
+
+def format_catalog_table(products: List[Product], max_approvals: int = 160) -> str:
+    """Компактная таблица продуктов для промпта LLM"""
+    lines = ["Продукт | Назначение | SAE / ISO VG | Спецификации | Основа | Допуски"]
+    for product in products:
+        grades = ", ".join(product.sae) or ", ".join(f"VG {grade}" for grade in product.iso_vg) or "—"
+        approvals = product.approvals if len(product.approvals) <= max_approvals else product.approvals[:max_approvals] + "…"
+        purpose = CATEGORY_LABELS.get(product.category, product.category)
+        if product.engine:
+            purpose += f" {product.engine}"
+        lines.append(
+            f"{product.name} | {purpose}, {', '.join(sorted(product.vehicles)) or '—'} | {grades} | "
+            f"{', '.join(sorted(product.specs)) or '—'} | {BASE_LABELS[product.base]} | {approvals or '—'}"
+        )
+    return "\n".join(lines)
+
+
+def format_shortlist(products: List[Product]) -> str:
+    """Шорт-лист для клиента (HTML), когда LLM недоступна"""
+    lines = []
+    for product in products:
+        grades = ", ".join(product.sae) or ", ".join(f"ISO VG {grade}" for grade in product.iso_vg)
+        specs = ", ".join(sorted(product.specs))
+        details = "; ".join(value for value in (grades, specs, BASE_LABELS[product.base]) if value)
+        lines.append(f"• <b>{html.escape(product.name)}</b> — {html.escape(details)}")
+    return "\n".join(lines)
+
+
+product_catalog = ProductCatalog()
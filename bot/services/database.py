@@ -1,15 +1,60 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, BigInteger, Boolean
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event, Column, Integer, String, Text, DateTime, BigInteger, Boolean, Index, UniqueConstraint
+from sqlalchemy.orm import declarative_base, sessionmaker
 from datetime import datetime
+import logging
 import os
-from dotenv import load_dotenv
+import time
+from bot.config import load_config
 
-load_dotenv()
+load_config()
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv("DB_PATH", "data/leads.db")
+DATABASE_URL = f"sqlite:///{DB_PATH}"
+
+# Профиль производительности SQLite
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "16384"))  # 16 МБ страничного кэша
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024)))
+# Запросы дольше порога пишутся в лог (с correlation_id апдейта, если он есть)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+engine = create_engine(
+    DATABASE_URL,
+    echo=False,
+    connect_args={"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000, "check_same_thread": False},
+)
+
+
+@event.listens_for(engine, "connect")
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL — читатели не блокируют писателя, synchronous=NORMAL — fsync только
+    на контрольных точках WAL, busy_timeout — ожидание блокировки вместо
+    мгновенного "database is locked".
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info.get("query_started", time.perf_counter())) * 1000
+    if elapsed_ms >= SLOW_QUERY_MS:
+        logger.warning("Медленный SQL (%.0f мс): %s", elapsed_ms, " ".join(statement.split())[:500])
 
-DATABASE_URL = f"sqlite:///{os.getenv('DB_PATH')}"
 
-engine = create_engine(DATABASE_URL, echo=False)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -23,8 +68,13 @@ class Lead(Base):
     phone = Column(String)
     industry = Column(String)  # например: "автосервис", "промышленность", "сельхоз"
     telegram_username = Column(String)  # @username из Telegram
+    user_id = Column(BigInteger)  # Telegram user id — для атрибуции запросов к лиду
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_leads_created_at", "created_at"),
+    )
+
 class UserQuery(Base):
     __tablename__ = "user_queries"
 
@@ -35,8 +85,104 @@ class UserQuery(Base):
     response_text = Column(String)
     timestamp = Column(DateTime, default=datetime.utcnow)
     is_lead = Column(Boolean, default=False)  # был ли после этого лид?
+    query_type = Column(String)  # тип по QueryClassifier: technical, greeting, ...
+    outcome = Column(String)  # чем ответили: canned, faq, catalog, rag, fallback, error
+
+    __table_args__ = (
+        # История пользователя: WHERE user_id = ? ORDER BY timestamp
+        Index("ix_user_queries_user_id_timestamp", "user_id", "timestamp"),
+        # Выборки по диапазону времени (аналитика, выгрузки)
+        Index("ix_user_queries_timestamp", "timestamp"),
+    )
+
+
+class QueryRollup(Base):
+    """Предагрегированная статистика: бакет времени × тип запроса × исход"""
+    __tablename__ = "query_rollups"
+
+    id = Column(Integer, primary_key=True)
+    granularity = Column(String, nullable=False)  # "hour" или "day"
+    bucket_start = Column(DateTime, nullable=False)
+    query_type = Column(String, nullable=False)
+    outcome = Column(String, nullable=False)
+    queries = Column(Integer, nullable=False, default=0)
+    converted = Column(Integer, nullable=False, default=0)  # запросы, после которых появился лид
+
+    __table_args__ = (
+        UniqueConstraint("granularity", "bucket_start", "query_type", "outcome", name="uq_query_rollups_bucket"),
+    )
+
+class RollupWatermark(Base):
+    """Последний обработанный id источника для инкрементальных агрегаций"""
+    __tablename__ = "rollup_watermarks"
+
+    name = Column(String, primary_key=True)
+    last_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class EmailOutbox(Base):
+    """Исходящие письма: пишутся в одной транзакции с лидом, отправляются фоново"""
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)  # тип письма, например "lead"
+    payload = Column(Text, nullable=False)  # JSON с данными для письма
+    status = Column(String, nullable=False, default="pending")  # pending, sent, dead
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    last_error = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_email_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+class SupportMessage(Base):
+    """Сообщение в группе поддержки → клиент, к которому оно относится"""
+    __tablename__ = "support_messages"
+
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(BigInteger, nullable=False)  # группа поддержки
+    message_id = Column(BigInteger, nullable=False)  # сообщение в группе
+    user_id = Column(BigInteger, nullable=False)  # клиент
+    user_message_id = Column(BigInteger)  # исходное сообщение клиента, если есть
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Маршрутизация ответа менеджера: WHERE chat_id = ? AND message_id = ?
+        UniqueConstraint("chat_id", "message_id", name="uq_support_messages_chat_message"),
+        Index("ix_support_messages_user_id", "user_id"),
+    )
+
+class Broadcast(Base):
+    """Рассылка по пользователям бота; курсор last_user_id позволяет продолжить после сбоя"""
+    __tablename__ = "broadcasts"
+
+    id = Column(Integer, primary_key=True)
+    text = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default="running")  # running, done, cancelled
+    created_by_chat_id = Column(BigInteger)  # куда сообщить о завершении
+    last_user_id = Column(BigInteger, nullable=False, default=0)  # получатели идут по возрастанию user_id
+    total = Column(Integer, nullable=False, default=0)
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
+
+
+MIGRATIONS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "migrations")
+
+
+def init_db():
+    """Создаёт папку БД и применяет миграции Alembic до последней версии"""
+    from alembic import command
+    from alembic.config import Config
 
+    os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
 
-# Создаём папку и БД при старте
-os.makedirs(os.path.dirname(os.getenv("DB_PATH")), exist_ok=True)
-Base.metadata.create_all(bind=engine)
+    config = Config()
+    config.set_main_option("script_location", MIGRATIONS_PATH)
+    config.set_main_option("sqlalchemy.url", DATABASE_URL)
+    command.upgrade(config, "head")
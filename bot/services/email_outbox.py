@@ -0,0 +1,237 @@
+# bot/services/email_outbox.py
+import asyncio
+import json
+import logging
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import select, update
+
+from bot.services.database import SessionLocal, EmailOutbox
+from bot.services.email_sender import EMAIL_RECIPIENTS, build_lead_message, build_digest_message, smtp_session
+from bot.services.tracing import correlation_id, trace_context
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "10"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "20"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "30"))  # секунды
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "3600"))
+
+# immediate — письмо на каждый лид; digest — сводка раз в окно или по набору лидов
+EMAIL_MODE = os.getenv("EMAIL_MODE", "immediate").lower()
+EMAIL_DIGEST_WINDOW_SECONDS = float(os.getenv("EMAIL_DIGEST_WINDOW_SECONDS", "900"))
+EMAIL_DIGEST_MAX_LEADS = int(os.getenv("EMAIL_DIGEST_MAX_LEADS", "20"))
+# Лиды из этих сфер (по подстроке) уходят сразу даже в режиме digest
+EMAIL_PRIORITY_INDUSTRIES = [
+    item.strip().lower() for item in os.getenv("EMAIL_PRIORITY_INDUSTRIES", "").split(",") if item.strip()
+]
+
+DIGEST_KIND = "lead_digest"
+
+# Как собрать письмо для каждого типа записи в outbox
+MESSAGE_BUILDERS = {
+    "lead": build_lead_message,
+}
+
+
+def enqueue_email(db, kind: str, payload: Dict) -> EmailOutbox:
+    """
+    Добавляет письмо в outbox в рамках переданной сессии.
+    Коммит делает вызывающий код — вместе с основной записью (например, лидом).
+    """
+    # correlation_id апдейта — чтобы связать отправку письма с обработкой заявки
+    payload = {**payload, "_correlation_id": correlation_id.get()}
+    entry = EmailOutbox(
+        kind=kind,
+        payload=json.dumps(payload, ensure_ascii=False, default=str),
+        status="pending",
+        attempts=0,
+        next_attempt_at=datetime.utcnow(),
+    )
+    db.add(entry)
+    return entry
+
+
+def enqueue_lead_email(db, lead_info: Dict) -> EmailOutbox:
+    """Письмо о лиде: сразу или в ближайшую сводку — в зависимости от режима и сферы"""
+    industry = (lead_info.get("industry") or "").lower()
+    is_priority = any(item in industry for item in EMAIL_PRIORITY_INDUSTRIES)
+    kind = DIGEST_KIND if EMAIL_MODE == "digest" and not is_priority else "lead"
+    return enqueue_email(db, kind, lead_info)
+
+
+def backoff_delay(attempts: int) -> float:
+    """Экспоненциальная задержка с небольшим разбросом, чтобы повторы не совпадали"""
+    delay = min(OUTBOX_BACKOFF_BASE * (2 ** (attempts - 1)), OUTBOX_BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+class OutboxSender:
+    """
+    Фоновая отправка писем из email_outbox.
+
+    Забирает записи со статусом pending, у которых наступило next_attempt_at,
+    и отправляет их через общее SMTP-соединение. Ошибка → повтор с
+    экспоненциальной задержкой; после OUTBOX_MAX_ATTEMPTS попыток запись
+    получает статус dead и остаётся в таблице для ручного разбора. Запись
+    с нечитаемым payload получает dead сразу, без повторов.
+
+    Записи типа lead_digest копятся до EMAIL_DIGEST_MAX_LEADS или пока
+    старейшая не прождёт EMAIL_DIGEST_WINDOW_SECONDS, затем уходят одним
+    письмом с HTML-таблицей и CSV.
+    """
+
+    def __init__(self, poll_interval: float = OUTBOX_POLL_INTERVAL, batch_size: int = OUTBOX_BATCH_SIZE):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def notify(self) -> None:
+        """Разбудить отправителя сразу после коммита нового письма"""
+        self._wakeup.set()
+
+    def start(self) -> None:
+        if not EMAIL_RECIPIENTS:
+            logger.warning("EMAIL_RECIPIENTS не задан — письма из outbox копятся без отправки")
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="email-outbox")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            # Не держим накопленную сводку до следующего запуска
+            try:
+                await self.process_digest(force=True)
+            except Exception as e:
+                logger.error("Не удалось отправить сводку при остановке: %s", e)
+        await smtp_session.close()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                while await self.process_due() >= self.batch_size:
+                    pass
+                await self.process_digest()
+            except Exception as e:
+                logger.error("Ошибка обработки email outbox: %s", e)
+
+    async def process_due(self) -> int:
+        """Отправляет одну пачку готовых к отправке писем, возвращает их количество"""
+        entries = await asyncio.to_thread(self._fetch_due, MESSAGE_BUILDERS.keys(), self.batch_size)
+        if not entries:
+            return 0
+
+        for entry_id, kind, payload, attempts, _ in entries:
+            try:
+                data = json.loads(payload)
+            except ValueError as e:
+                # Повреждённая запись не разберётся и при повторе — сразу в dead, остальные письма пачки идут дальше
+                await asyncio.to_thread(self._mark_dead, entry_id, attempts + 1, f"некорректный payload: {e}")
+                continue
+            with trace_context("email", correlation=data.pop("_correlation_id", None), outbox_id=entry_id, kind=kind):
+                try:
+                    builder = MESSAGE_BUILDERS[kind]
+                    await smtp_session.send(builder(data))
+                except Exception as e:
+                    await asyncio.to_thread(self._mark_failed, entry_id, attempts + 1, str(e))
+                else:
+                    await asyncio.to_thread(self._mark_sent, entry_id)
+                    logger.info("Письмо #%s (%s) отправлено", entry_id, kind)
+        return len(entries)
+
+    async def process_digest(self, force: bool = False) -> int:
+        """
+        Отправляет сводку, если набралось EMAIL_DIGEST_MAX_LEADS лидов или
+        истекло окно для самого старого. force — отправить всё накопленное.
+        """
+        entries = await asyncio.to_thread(self._fetch_due, [DIGEST_KIND], EMAIL_DIGEST_MAX_LEADS)
+        if not entries:
+            return 0
+
+        oldest = min(created_at for *_, created_at in entries)
+        window_elapsed = datetime.utcnow() - oldest >= timedelta(seconds=EMAIL_DIGEST_WINDOW_SECONDS)
+        if not (force or window_elapsed or len(entries) >= EMAIL_DIGEST_MAX_LEADS):
+            return 0
+
+        ids = [entry_id for entry_id, *_ in entries]
+        try:
+            leads = [json.loads(payload) for _, _, payload, _, _ in entries]
+            for lead in leads:
+                lead.pop("_correlation_id", None)
+            await smtp_session.send(build_digest_message(leads))
+        except Exception as e:
+            attempts = max(attempts for *_, attempts, _ in entries) + 1
+            for entry_id in ids:
+                await asyncio.to_thread(self._mark_failed, entry_id, attempts, str(e))
+            return 0
+
+        for entry_id in ids:
+            await asyncio.to_thread(self._mark_sent, entry_id)
+        logger.info("✅ Сводка по %d лидам отправлена", len(ids))
+        return len(ids)
+
+    # ---------------------------------------------------------------- БД
+
+    def _fetch_due(self, kinds, limit: int) -> List:
+        db = SessionLocal()
+        try:
+            return db.execute(
+                select(EmailOutbox.id, EmailOutbox.kind, EmailOutbox.payload, EmailOutbox.attempts, EmailOutbox.created_at)
+                .where(
+                    EmailOutbox.status == "pending",
+                    EmailOutbox.kind.in_(list(kinds)),
+                    EmailOutbox.next_attempt_at <= datetime.utcnow(),
+                )
+                .order_by(EmailOutbox.id)
+                .limit(limit)
+            ).all()
+        finally:
+            db.close()
+
+    def _mark_sent(self, entry_id: int) -> None:
+        self._update(entry_id, status="sent", sent_at=datetime.utcnow(), last_error=None)
+
+    def _mark_failed(self, entry_id: int, attempts: int, error: str) -> None:
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            self._mark_dead(entry_id, attempts, error)
+            return
+
+        delay = backoff_delay(attempts)
+        logger.warning("Письмо #%s: попытка %s не удалась (%s), повтор через %.0f с", entry_id, attempts, error, delay)
+        self._update(
+            entry_id,
+            attempts=attempts,
+            last_error=error[:1000],
+            next_attempt_at=datetime.utcnow() + timedelta(seconds=delay),
+        )
+
+    def _mark_dead(self, entry_id: int, attempts: int, error: str) -> None:
+        logger.error("❌ Письмо #%s не отправлено после %s попыток: %s", entry_id, attempts, error)
+        self._update(entry_id, status="dead", attempts=attempts, last_error=error[:1000])
+
+    def _update(self, entry_id: int, **values) -> None:
+        db = SessionLocal()
+        try:
+            db.execute(update(EmailOutbox).where(EmailOutbox.id == entry_id).values(**values))
+            db.commit()
+        finally:
+            db.close()
+
+
+outbox_sender = OutboxSender()
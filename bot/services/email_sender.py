@@ -1,22 +1,44 @@
+import asyncio
+import csv
+import html
+import io
 import os
 import ssl
+import time
+from datetime import datetime
+from typing import List
 import aiosmtplib
+from email.mime.application import MIMEApplication
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from dotenv import load_dotenv
+from bot.config import load_config
+from bot.services.metrics import metrics
 
-load_dotenv()
+load_config()
 
 SMTP_HOST = os.getenv("SMTP_HOST")
-SMTP_PORT = int(os.getenv("SMTP_PORT"))
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
 SMTP_USER = os.getenv("SMTP_USER")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
 EMAIL_RECIPIENTS = [email.strip() for email in os.getenv("EMAIL_RECIPIENTS", "").split(",") if email.strip()]
+# Соединение, простаивавшее дольше, проверяется NOOP перед повторным использованием
+SMTP_IDLE_CHECK_SECONDS = float(os.getenv("SMTP_IDLE_CHECK_SECONDS", "30"))
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+# false — без TLS, например для локального SMTP-стенда (python -m bot.devtools.smtp_stub)
+SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "true").lower() in ("1", "true", "yes")
 
-async def send_lead_email(lead_data: dict):
-    if not EMAIL_RECIPIENTS:
-        return False
+LEAD_FIELDS = [
+    ("name", "Имя"),
+    ("telegram_username", "Telegram"),
+    ("email", "Email"),
+    ("phone", "Телефон"),
+    ("industry", "Сфера"),
+    ("created_at", "Дата"),
+]
 
+
+def build_lead_message(lead_data: dict) -> MIMEMultipart:
+    """Письмо о новом лиде"""
     msg = MIMEMultipart("alternative")
     msg["Subject"] = f"Новый лид: {lead_data['name']}"
     msg["From"] = SMTP_USER
@@ -39,20 +61,106 @@ Email: {lead_data['email']}
 
     part = MIMEText(text, "plain", "utf-8")
     msg.attach(part)
+    return msg
+
+
+def build_digest_message(leads: List[dict]) -> MIMEMultipart:
+    """Сводное письмо по нескольким лидам: текст + HTML-таблица + CSV-вложение"""
+    msg = MIMEMultipart("mixed")
+    msg["Subject"] = f"Новые лиды: {len(leads)}"
+    msg["From"] = SMTP_USER
+    msg["To"] = ", ".join(EMAIL_RECIPIENTS)
+
+    text_lines = [f"Новых лидов: {len(leads)}", ""]
+    for i, lead in enumerate(leads, 1):
+        text_lines.append(f"{i}. " + ", ".join(f"{title}: {lead.get(key, '')}" for key, title in LEAD_FIELDS))
+    text_lines += ["", "Источник: Telegram-бот ECOFES PRO CLIENT"]
+
+    header = "".join(f"<th>{html.escape(title)}</th>" for _, title in LEAD_FIELDS)
+    rows = "".join(
+        "<tr>" + "".join(f"<td>{html.escape(str(lead.get(key, '')))}</td>" for key, _ in LEAD_FIELDS) + "</tr>"
+        for lead in leads
+    )
+    html_body = (
+        f"<p>Новых лидов: <b>{len(leads)}</b></p>"
+        f"<table border=\"1\" cellpadding=\"4\" cellspacing=\"0\"><tr>{header}</tr>{rows}</table>"
+        "<p>Источник: Telegram-бот ECOFES PRO CLIENT</p>"
+    )
+
+    body = MIMEMultipart("alternative")
+    body.attach(MIMEText("\n".join(text_lines), "plain", "utf-8"))
+    body.attach(MIMEText(html_body, "html", "utf-8"))
+    msg.attach(body)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([key for key, _ in LEAD_FIELDS])
+    writer.writerows([[lead.get(key, "") for key, _ in LEAD_FIELDS] for lead in leads])
+    attachment = MIMEApplication(buffer.getvalue().encode("utf-8-sig"), _subtype="csv")
+    attachment.add_header("Content-Disposition", "attachment", filename=f"leads_{datetime.utcnow():%Y%m%d_%H%M}.csv")
+    msg.attach(attachment)
+    return msg
+
 
-    try:
-        context = ssl.create_default_context()
-        await aiosmtplib.send(
-            msg,
+class SMTPSession:
+    """
+    Долгоживущее SMTP-соединение, переиспользуемое между письмами.
+
+    TLS-рукопожатие и авторизация выполняются один раз; перед отправкой
+    после простоя соединение проверяется NOOP и при необходимости
+    переподключается. Отправки сериализуются блокировкой.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._lock = asyncio.Lock()
+        self._last_used = 0.0
+
+    async def _connect(self) -> None:
+        await self.close()
+        client = aiosmtplib.SMTP(
             hostname=SMTP_HOST,
             port=SMTP_PORT,
             username=SMTP_USER,
             password=SMTP_PASSWORD,
-            use_tls=True,  # Для порта 465 — TLS при подключении
-            tls_context=context,
+            use_tls=SMTP_USE_TLS,  # Для порта 465 — TLS при подключении
+            tls_context=ssl.create_default_context() if SMTP_USE_TLS else None,
+            timeout=SMTP_TIMEOUT,
         )
-        print(f"✅  Email отправлен на {', '.join(EMAIL_RECIPIENTS)}")
-        return True
-    except Exception as e:
-        print(f"❌  Ошибка отправки email: {e}")
-        return False
+        await client.connect()
+        self._client = client
+
+    async def _ensure_connected(self) -> None:
+        if self._client is None or not self._client.is_connected:
+            await self._connect()
+            return
+        if time.monotonic() - self._last_used > SMTP_IDLE_CHECK_SECONDS:
+            try:
+                await self._client.noop()
+            except aiosmtplib.SMTPException:
+                await self._connect()
+
+    async def send(self, msg) -> None:
+        """Отправляет письмо; при ошибке соединение сбрасывается, исключение пробрасывается"""
+        async with self._lock:
+            try:
+                with metrics.timed("smtp_send"):
+                    await self._ensure_connected()
+                    await self._client.send_message(msg)
+                self._last_used = time.monotonic()
+            except Exception:
+                await self.close()
+                raise
+
+    async def close(self) -> None:
+        if self._client is not None:
+            try:
+                if self._client.is_connected:
+                    await self._client.quit()
+            except Exception:
+                self._client.close()
+            self._client = None
+
+
+smtp_session = SMTPSession()
+
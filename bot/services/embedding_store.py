@@ -0,0 +1,201 @@
+# bot/services/embedding_store.py
+"""
+Компактное хранилище эмбеддингов базы знаний для поиска в памяти.
+
+Векторы нормируются и хранятся как float16 или int8 с масштабом на
+каждый вектор (x ≈ code * scale), то есть в 2 и 4 раза компактнее
+float32 и несравнимо компактнее списков Python. Близость считается
+матричным умножением NumPy блоками по EMBEDDING_STORE_BLOCK строк:
+блок переводится во float32 и умножается через BLAS (SIMD), временная
+память ограничена размером блока.
+
+Полноточные векторы float32 лежат рядом на диске и открываются через
+memmap: лучшие EMBEDDING_STORE_RESCORE кандидатов пересчитываются по
+ним, так что порядок выдачи почти не отличается от float32, а в
+памяти процесса постоянно живут только квантованные коды.
+
+Файлы хранилища (prefix — EMBEDDING_STORE_PATH):
+    prefix.npz       коды и масштабы
+    prefix.json      идентификаторы, тексты фрагментов, тип хранения,
+                     отпечаток содержимого (fingerprint)
+    prefix.full.npy  нормированные float32 для пересчёта
+"""
+import hashlib
+import json
+import logging
+import os
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_STORE_PATH = os.getenv("EMBEDDING_STORE_PATH", "data/embedding_store/ecofes_docs")
+# Сколько лучших кандидатов пересчитывать по float32 (0 — без пересчёта)
+EMBEDDING_STORE_RESCORE = int(os.getenv("EMBEDDING_STORE_RESCORE", "20"))
+EMBEDDING_STORE_BLOCK = int(os.getenv("EMBEDDING_STORE_BLOCK", "4096"))
+
+STORE_DTYPES = ("float32", "float16", "int8")
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def quantize(matrix: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Коды и масштабы по строкам (масштабы только для int8)"""
+    if dtype == "float32":
+        return np.ascontiguousarray(matrix, dtype=np.float32), None
+    if dtype == "float16":
+        return matrix.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(matrix).max(axis=1, initial=0.0) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.round(matrix / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"Неизвестный тип хранения эмбеддингов: {dtype}")
+
+
+def fingerprint(ids: Sequence[str], documents: Sequence[str]) -> str:
+    """Отпечаток содержимого: пары (идентификатор, текст) в порядке идентификаторов"""
+    digest = hashlib.sha256()
+    for doc_id, document in sorted(zip(ids, documents)):
+        digest.update(doc_id.encode("utf-8") + b"\0" + (document or "").encode("utf-8") + b"\0")
+    return digest.hexdigest()
+
+
+class EmbeddingStore:
+    """Косинусный поиск по квантованным эмбеддингам с пересчётом лучших по float32"""
+
+    def __init__(self, ids: Sequence[str], documents: Sequence[str], codes: np.ndarray,
+                 scales: Optional[np.ndarray], dtype: str, full: Optional[np.ndarray] = None):
+        self.ids = list(ids)
+        self.documents = list(documents)
+        self.codes = codes
+        self.scales = scales
+        self.dtype = dtype
+        self.full = full  # нормированные float32 (в памяти или memmap), None — без пересчёта
+        self.fingerprint: Optional[str] = None  # отпечаток содержимого, с которым хранилище записано на диск
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, ids: Sequence[str], vectors, documents: Optional[Sequence[str]] = None,
+              dtype: str = "int8", keep_full: bool = True) -> "EmbeddingStore":
+        matrix = normalize_rows(vectors) if len(ids) else np.zeros((0, 0), dtype=np.float32)
+        codes, scales = quantize(matrix, dtype)
+        return cls(ids, documents if documents is not None else [""] * len(ids), codes, scales, dtype,
+                   full=matrix if keep_full and dtype != "float32" else None)
+
+    @classmethod
+    def from_collection(cls, collection, dtype: str = "int8", batch: int = 500) -> "EmbeddingStore":
+        """Собирает хранилище из коллекции Chroma постранично, без полной копии списков Python"""
+        total = collection.count()
+        ids: List[str] = []
+        documents: List[str] = []
+        matrix: Optional[np.ndarray] = None
+        for offset in range(0, total, batch):
+            page = collection.get(include=["documents", "embeddings"], limit=batch, offset=offset)
+            vectors = np.asarray(page["embeddings"], dtype=np.float32)
+            if matrix is None:
+                matrix = np.empty((total, vectors.shape[1]), dtype=np.float32)
+            matrix[len(ids):len(ids) + len(vectors)] = vectors
+            ids += page["ids"]
+            documents += page["documents"]
+        if matrix is None:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        return cls.build(ids, matrix[:len(ids)], documents, dtype)
+
+    # ---------------------------------------------------------------- поиск
+
+    def memory_bytes(self) -> int:
+        """Память, которую хранилище держит постоянно (коды и масштабы)"""
+        size = self.codes.nbytes
+        if self.scales is not None:
+            size += self.scales.nbytes
+        if self.full is not None and not isinstance(self.full, np.memmap):
+            size += self.full.nbytes
+        return size
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """Приближённые косинусы запроса со всеми векторами"""
+        if self.dtype == "float32":
+            return self.codes @ query
+        scores = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), EMBEDDING_STORE_BLOCK):
+            block = self.codes[start:start + EMBEDDING_STORE_BLOCK]
+            scores[start:start + len(block)] = block.astype(np.float32) @ query
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def search(self, query: Sequence[float], k: int, rescore: int = EMBEDDING_STORE_RESCORE) -> List[Tuple[int, float]]:
+        """(номер вектора, косинус) лучших k по убыванию близости"""
+        if not self.ids or k <= 0:
+            return []
+        query = np.asarray(query, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        scores = self.scores(query)
+
+        depth = min(max(k, rescore if self.full is not None else 0), len(scores))
+        top = np.argpartition(-scores, depth - 1)[:depth]
+        if self.full is not None and depth > k:
+            candidates = np.sort(top)  # memmap читается последовательнее
+            scores_top = np.asarray(self.full[candidates]) @ query
+            top = candidates
+        else:
+            scores_top = scores[top]
+        order = np.argsort(-scores_top)[:k]
+        return [(int(top[i]), float(scores_top[i])) for i in order]
+
+    def query(self, query: Sequence[float], k: int) -> Tuple[List[str], List[float]]:
+        """Тексты фрагментов и косинусные расстояния (1 - косинус), как у Chroma"""
+        found = self.search(query, k)
+        return [self.documents[i] for i, _ in found], [1.0 - score for _, score in found]
+
+    # ---------------------------------------------------------------- файлы
+
+    def save(self, prefix: str = EMBEDDING_STORE_PATH) -> None:
+        """
+        Запись через временные файлы и os.replace: хранилище, открытое
+        из этих файлов (memmap), продолжает читать прежнюю версию.
+        """
+        os.makedirs(os.path.dirname(prefix) or ".", exist_ok=True)
+        arrays = {"codes": self.codes}
+        if self.scales is not None:
+            arrays["scales"] = self.scales
+        with open(f"{prefix}.npz.tmp", "wb") as f:
+            np.savez(f, **arrays)
+        if self.full is not None:
+            with open(f"{prefix}.full.npy.tmp", "wb") as f:
+                np.save(f, np.asarray(self.full))
+            os.replace(f"{prefix}.full.npy.tmp", f"{prefix}.full.npy")
+        elif os.path.exists(f"{prefix}.full.npy"):
+            os.remove(f"{prefix}.full.npy")
+        os.replace(f"{prefix}.npz.tmp", f"{prefix}.npz")
+        meta = {
+            "dtype": self.dtype, "ids": self.ids, "documents": self.documents,
+            "fingerprint": fingerprint(self.ids, self.documents),
+        }
+        with open(f"{prefix}.json.tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(f"{prefix}.json.tmp", f"{prefix}.json")
+
+    @classmethod
+    def load(cls, prefix: str = EMBEDDING_STORE_PATH) -> Optional["EmbeddingStore"]:
+        """Хранилище с диска (float32 — через memmap); None, если файлов нет"""
+        if not (os.path.exists(f"{prefix}.json") and os.path.exists(f"{prefix}.npz")):
+            return None
+        with open(f"{prefix}.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with np.load(f"{prefix}.npz") as arrays:
+            codes = arrays["codes"]
+            scales = arrays["scales"] if "scales" in arrays else None
+        full_path = f"{prefix}.full.npy"
+        full = np.load(full_path, mmap_mode="r") if os.path.exists(full_path) else None
+        store = cls(meta["ids"], meta["documents"], codes, scales, meta["dtype"], full)
+        store.fingerprint = meta.get("fingerprint")  # файлы старого формата без отпечатка пересобираются
+        return store
@@ -0,0 +1,169 @@
+# bot/services/exporter.py
+"""
+Потоковая выгрузка лидов и журнала запросов в gzip CSV/JSONL.
+
+Запуск из командной строки:
+    python -m bot.services.exporter leads --format csv --from 2026-01-01 --to 2026-02-01
+    python -m bot.services.exporter queries --format jsonl --type technical -o queries.jsonl.gz
+    python -m bot.services.exporter queries --include-archive --from 2025-01-01
+"""
+import argparse
+import csv
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, date
+from typing import Iterable, Iterator, List, Optional, Sequence
+
+from sqlalchemy import select
+
+from bot.services.database import engine, Lead, UserQuery
+from bot.services.archiver import query_archiver
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+EXPORT_KINDS = ("leads", "queries")
+EXPORT_FORMATS = ("csv", "jsonl")
+
+LEAD_COLUMNS = ["id", "name", "email", "phone", "industry", "telegram_username", "user_id", "created_at"]
+QUERY_COLUMNS = ["id", "user_id", "username", "query_text", "response_text", "timestamp",
+                 "is_lead", "query_type", "outcome"]
+
+
+def _build_query(kind: str, date_from: Optional[datetime], date_to: Optional[datetime], type_filter: Optional[str]):
+    if kind == "leads":
+        model, columns, time_column = Lead, LEAD_COLUMNS, Lead.created_at
+    elif kind == "queries":
+        model, columns, time_column = UserQuery, QUERY_COLUMNS, UserQuery.timestamp
+    else:
+        raise ValueError(f"Неизвестный тип выгрузки: {kind}")
+
+    stmt = select(*[getattr(model, name) for name in columns]).order_by(model.id)
+    if date_from:
+        stmt = stmt.where(time_column >= date_from)
+    if date_to:
+        stmt = stmt.where(time_column < date_to)
+    if type_filter:
+        if kind == "queries":
+            stmt = stmt.where(UserQuery.query_type == type_filter)
+        else:
+            stmt = stmt.where(Lead.industry.ilike(f"%{type_filter}%"))
+    return stmt, columns
+
+
+def iter_batches(
+    kind: str,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    type_filter: Optional[str] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    include_archive: bool = False,
+) -> Iterator[List[Sequence]]:
+    """
+    Читает строки через потоковый курсор (stream_results + yield_per):
+    в памяти одновременно находится не больше одной пачки.
+    С include_archive для запросов сначала отдаются архивные записи.
+    """
+    stmt, columns = _build_query(kind, date_from, date_to, type_filter)
+    if include_archive and kind == "queries":
+        batch = []
+        for row in query_archiver.iter_archived(date_from, date_to, type_filter):
+            batch.append(tuple(row.get(name) for name in columns))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(stmt)
+        for partition in result.partitions(batch_size):
+            yield partition
+
+
+def _serialize(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def write_export(path: str, fmt: str, columns: List[str], batches: Iterable[List[Sequence]]) -> int:
+    """Пишет пачки в gzip-файл по мере чтения, возвращает количество строк"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+
+    rows_written = 0
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for batch in batches:
+                writer.writerows([[_serialize(value) for value in row] for row in batch])
+                rows_written += len(batch)
+        else:
+            for batch in batches:
+                f.writelines(
+                    json.dumps(dict(zip(columns, map(_serialize, row))), ensure_ascii=False) + "\n"
+                    for row in batch
+                )
+                rows_written += len(batch)
+    return rows_written
+
+
+def export(
+    kind: str,
+    fmt: str,
+    path: str,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    type_filter: Optional[str] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    include_archive: bool = False,
+) -> int:
+    """Выгружает лиды или запросы в файл, возвращает количество строк"""
+    _, columns = _build_query(kind, date_from, date_to, type_filter)
+    batches = iter_batches(kind, date_from, date_to, type_filter, batch_size, include_archive)
+    rows = write_export(path, fmt, columns, batches)
+    logger.info("Выгрузка %s (%s) → %s: %d строк", kind, fmt, path, rows)
+    return rows
+
+
+def default_filename(kind: str, fmt: str) -> str:
+    return f"ecofes_{kind}_{datetime.utcnow():%Y%m%d_%H%M%S}.{fmt}.gz"
+
+
+def parse_date(value: Optional[str]) -> Optional[datetime]:
+    return datetime.strptime(value, "%Y-%m-%d") if value else None
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Выгрузка лидов и журнала запросов ECOFES")
+    parser.add_argument("kind", choices=EXPORT_KINDS)
+    parser.add_argument("--format", dest="fmt", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--from", dest="date_from", help="начало периода, YYYY-MM-DD (включительно)")
+    parser.add_argument("--to", dest="date_to", help="конец периода, YYYY-MM-DD (не включительно)")
+    parser.add_argument("--type", dest="type_filter",
+                        help="тип запроса (queries) или подстрока сферы деятельности (leads)")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument("--include-archive", action="store_true",
+                        help="добавить записи из архива (только для queries)")
+    parser.add_argument("-o", "--output", help="путь к файлу .gz")
+    args = parser.parse_args(argv)
+
+    path = args.output or default_filename(args.kind, args.fmt)
+    rows = export(
+        args.kind, args.fmt, path,
+        date_from=parse_date(args.date_from),
+        date_to=parse_date(args.date_to),
+        type_filter=args.type_filter,
+        batch_size=args.batch_size,
+        include_archive=args.include_archive,
+    )
+    print(f"✅ Выгружено {rows} строк в {path}")
+
+
+if __name__ == "__main__":
+    main()
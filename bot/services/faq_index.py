@@ -0,0 +1,299 @@
+# bot/services/faq_index.py
+"""
+Быстрый путь для частых вопросов: пары вопрос/ответ из faq.txt и 2faq.txt
+отвечаются напрямую, без поиска по базе знаний и без LLM.
+
+Каждый вопрос FAQ даёт несколько вариантов (вопрос целиком и его
+отдельные предложения), нормализованных до основ слов. Вопрос клиента
+сравнивается с вариантами по TF-IDF-косинусу; совпадение выше строгого
+порога — ответ из FAQ за миллисекунды. В «серой зоне» решает косинус
+эмбеддингов (тот же эмбеддинг, что потом пойдёт в поиск по Chroma),
+если эмбеддинги вариантов загружены.
+"""
+import glob
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from bot.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+FAQ_DOCS_PATH = os.getenv("RAG_DOCS_PATH", "data/docs")
+FAQ_FILES = [name.strip() for name in os.getenv("FAQ_FILES", "faq.txt,2faq.txt").split(",") if name.strip()]
+# Лексическое совпадение, при котором отвечаем из FAQ без эмбеддинга
+FAQ_LEXICAL_THRESHOLD = float(os.getenv("FAQ_LEXICAL_THRESHOLD", "0.75"))
+# Нижняя граница «серой зоны»: ниже неё эмбеддинг не проверяем
+FAQ_LEXICAL_MIN = float(os.getenv("FAQ_LEXICAL_MIN", "0.35"))
+FAQ_EMBEDDING_THRESHOLD = float(os.getenv("FAQ_EMBEDDING_THRESHOLD", "0.92"))
+# Кэш эмбеддингов вариантов: при перезапуске GigaChat не запрашивается заново
+FAQ_EMBEDDINGS_CACHE = os.getenv("FAQ_EMBEDDINGS_CACHE", "data/faq_embeddings.json")
+# Меньше стольких значимых слов — вариант слишком общий, не используем
+FAQ_MIN_VARIANT_TOKENS = 3
+
+_QUESTION_RE = re.compile(r"^Вопрос:\s*", re.MULTILINE)
+_SENTENCE_RE = re.compile(r"(?<=[.?!…])\s+")
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+_STOP_WORDS = frozenset("""
+а без более бы был была были было быть в вам вас ведь во вот все всё всю вы где да даже для до его ее её
+если есть еще ещё же за и из или им их к как какая какие какое какой когда кто ли либо мне мы на над не
+нет ни но ну о об от по под при про с со так также там то того тоже только у уже что чтобы эта эти это
+этот я ваш ваше ваша ваши вообще просто очень можно нужно надо
+""".split())
+
+# Окончания по убыванию длины: грубый стемминг, чтобы «масло», «масла», «маслом» совпадали
+_ENDINGS = sorted("""
+иями ями ами ого его ему ому ыми ими ией иям иях ешь ете ишь ите ать ять ить еть уть ала ила ыла ели
+ов ев ей ой ый ий ая яя ое ее ые ие ых их ом ем ам ям ах ях ую юю ет ит ут ют ат ят ал ил ыл ть
+а я о е ы и у ю ь й
+""".split(), key=len, reverse=True)
+
+
+def _stem(word: str) -> str:
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[: -len(ending)]
+    return word
+
+
+def normalize(text: str) -> List[str]:
+    """Основы значимых слов: нижний регистр, ё→е, без стоп-слов"""
+    words = _WORD_RE.findall(text.lower().replace("ё", "е"))
+    return [_stem(word) for word in words if word not in _STOP_WORDS and len(word) > 1]
+
+
+@dataclass
+class FAQEntry:
+    id: str
+    question: str
+    answer: str
+    source: str
+
+
+@dataclass
+class FAQVariant:
+    entry: FAQEntry
+    text: str
+    weights: Dict[str, float] = field(default_factory=dict)  # основа → нормированный вес TF-IDF
+
+
+@dataclass
+class FAQMatch:
+    entry: FAQEntry
+    score: float
+    method: str  # lexical или embedding
+
+
+def parse_prefixed_faq(content: str) -> List[Tuple[str, str]]:
+    """faq.txt: «Вопрос: ...» и «Ответ: ...» до следующего вопроса"""
+    pairs = []
+    starts = [m.start() for m in _QUESTION_RE.finditer(content)] + [len(content)]
+    for begin, end in zip(starts, starts[1:]):
+        question, marker, answer = content[begin:end].partition("Ответ:")
+        if marker and answer.strip():
+            pairs.append((" ".join(question[len("Вопрос:"):].split()), answer.strip()))
+    return pairs
+
+
+def parse_paragraph_faq(content: str) -> List[Tuple[str, str]]:
+    """2faq.txt: строка, оканчивающаяся на «?», и абзац ответа под ней"""
+    pairs = []
+    for paragraph in re.split(r"\n\s*\n", content):
+        first_line, _, rest = paragraph.strip().partition("\n")
+        if first_line.rstrip().endswith("?") and rest.strip():
+            pairs.append((first_line.strip(), rest.strip()))
+    return pairs
+
+
+def _variant_texts(question: str) -> List[str]:
+    """Вопрос целиком и его предложения, в которых достаточно значимых слов"""
+    variants = [question]
+    sentences = _SENTENCE_RE.split(question)
+    if len(sentences) > 1:
+        variants += [s for s in sentences if len(normalize(s)) >= FAQ_MIN_VARIANT_TOKENS]
+    return variants
+
+
+def _cosine(a: Sequence[float], b: Sequence[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class FAQIndex:
+    """
+    Индекс вариантов вопросов FAQ → канонические ответы.
+    Файлы читаются при первом обращении; эмбеддинги вариантов — по
+    load_embeddings() (при прогреве базы знаний).
+    """
+
+    def __init__(self, docs_path: str = FAQ_DOCS_PATH, files: Sequence[str] = tuple(FAQ_FILES)):
+        self.docs_path = docs_path
+        self.files = list(files)
+        self.entries: List[FAQEntry] = []
+        self.variants: List[FAQVariant] = []
+        self._postings: Dict[str, List[int]] = {}  # основа → номера вариантов
+        self._idf: Dict[str, float] = {}
+        self._unknown_idf = 1.0
+        self._embeddings: Optional[List[List[float]]] = None  # по вариантам
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    # ---------------------------------------------------------------- загрузка
+
+    def load(self) -> None:
+        with self._lock:
+            if self._loaded:
+                return
+            for name in self.files:
+                for path in sorted(glob.glob(os.path.join(self.docs_path, name))):
+                    with open(path, "r", encoding="utf-8") as f:
+                        content = f.read().strip()
+                    pairs = parse_prefixed_faq(content) if _QUESTION_RE.search(content) else parse_paragraph_faq(content)
+                    for question, answer in pairs:
+                        entry_id = hashlib.sha1(f"{os.path.basename(path)}:{question}".encode()).hexdigest()[:12]
+                        self.entries.append(FAQEntry(entry_id, question, answer, path))
+            self._build()
+            self._loaded = True
+            logger.info("FAQ: %d вопросов, %d вариантов", len(self.entries), len(self.variants))
+
+    def _build(self) -> None:
+        tokenized = []
+        for entry in self.entries:
+            for text in _variant_texts(entry.question):
+                tokenized.append((entry, text, set(normalize(text))))
+
+        document_frequency: Dict[str, int] = {}
+        for _, _, tokens in tokenized:
+            for token in tokens:
+                document_frequency[token] = document_frequency.get(token, 0) + 1
+        total = len(tokenized)
+        self._idf = {token: math.log((1 + total) / (1 + df)) + 1 for token, df in document_frequency.items()}
+        # Слово, которого нет ни в одном варианте, весит как самое редкое
+        self._unknown_idf = math.log(1 + total) + 1
+
+        for number, (entry, text, tokens) in enumerate(tokenized):
+            self.variants.append(FAQVariant(entry, text, self._weights(tokens)))
+            for token in tokens:
+                self._postings.setdefault(token, []).append(number)
+
+    def _weights(self, tokens) -> Dict[str, float]:
+        """Нормированный бинарный TF-IDF: лишние слова вопроса снижают сходство"""
+        weights = {token: self._idf.get(token, self._unknown_idf) for token in tokens}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        return {token: w / norm for token, w in weights.items()}
+
+    def load_embeddings(self, embed: Callable[[str], List[float]], cache_path: Optional[str] = FAQ_EMBEDDINGS_CACHE) -> None:
+        """
+        Эмбеддинги всех вариантов для проверки «серой зоны». embed должен
+        готовить текст так же, как поиск готовит запрос клиента.
+        Посчитанные векторы кэшируются в файле по хэшу текста.
+        """
+        self.load()
+        cache: Dict[str, List[float]] = {}
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    cache = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning("Кэш эмбеддингов FAQ не прочитан: %s", e)
+
+        embeddings = []
+        missing = 0
+        for variant in self.variants:
+            key = hashlib.sha1(variant.text.encode()).hexdigest()
+            if key not in cache:
+                cache[key] = embed(variant.text)
+                missing += 1
+            embeddings.append(cache[key])
+
+        if missing and cache_path:
+            os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+            with open(cache_path, "w", encoding="utf-8") as f:
+                json.dump(cache, f)
+        self._embeddings = embeddings
+        logger.info("FAQ: эмбеддинги вариантов готовы (новых %d)", missing)
+
+    def rebuilt(self, embed: Optional[Callable[[str], List[float]]] = None) -> "FAQIndex":
+        """Новый индекс по текущим файлам (эмбеддинги — если они были у этого)"""
+        fresh = FAQIndex(self.docs_path, self.files)
+        fresh.load()
+        if embed is not None and self.has_embeddings:
+            fresh.load_embeddings(embed)
+        return fresh
+
+    def replace_with(self, other: "FAQIndex") -> None:
+        """Подменяет данные индекса собранными в other; вызывать из event loop"""
+        self.entries, self.variants, self._postings = other.entries, other.variants, other._postings
+        self._idf, self._unknown_idf, self._embeddings = other._idf, other._unknown_idf, other._embeddings
+        self._loaded = True
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    @property
+    def has_embeddings(self) -> bool:
+        return self._embeddings is not None
+
+    # ---------------------------------------------------------------- поиск
+
+    def _lexical(self, text: str) -> Tuple[Optional[FAQVariant], float]:
+        self.load()
+        query = self._weights(set(normalize(text)))
+        scores: Dict[int, float] = {}
+        for token, weight in query.items():
+            for number in self._postings.get(token, ()):
+                scores[number] = scores.get(number, 0.0) + weight * self.variants[number].weights[token]
+        if not scores:
+            return None, 0.0
+        best = max(scores, key=scores.__getitem__)
+        return self.variants[best], scores[best]
+
+    def match(self, text: str) -> Optional[FAQMatch]:
+        """Строгое лексическое совпадение; None — вопрос не из FAQ (или нужна проверка эмбеддингом)"""
+        with metrics.timed("faq_match"):
+            variant, score = self._lexical(text)
+        if variant is not None and score >= FAQ_LEXICAL_THRESHOLD:
+            metrics.inc("faq_lookups_total", result="lexical")
+            return FAQMatch(variant.entry, score, "lexical")
+        return None
+
+    def needs_embedding(self, text: str) -> bool:
+        """Вопрос в «серой зоне»: лексически похож, но не настолько, чтобы ответить сразу"""
+        if not self.has_embeddings:
+            return False
+        _, score = self._lexical(text)
+        return FAQ_LEXICAL_MIN <= score < FAQ_LEXICAL_THRESHOLD
+
+    def match_embedding(self, text: str, embedding: Sequence[float]) -> Optional[FAQMatch]:
+        """
+        Совпадение по эмбеддингу в «серой зоне»: лучший вариант по косинусу
+        должен пройти порог и относиться к тому же вопросу, что и лучший
+        лексический, — иначе ответа из FAQ нет.
+        """
+        if not self.has_embeddings:
+            return None
+        lexical, lexical_score = self._lexical(text)
+        if lexical is None or lexical_score < FAQ_LEXICAL_MIN:
+            return None
+        with metrics.timed("faq_match"):
+            scores = [_cosine(embedding, vector) for vector in self._embeddings]
+        best = max(range(len(scores)), key=scores.__getitem__)
+        if scores[best] >= FAQ_EMBEDDING_THRESHOLD and self.variants[best].entry is lexical.entry:
+            metrics.inc("faq_lookups_total", result="embedding")
+            return FAQMatch(lexical.entry, scores[best], "embedding")
+        return None
+
+    def record_miss(self) -> None:
+        metrics.inc("faq_lookups_total", result="miss")
+
+
+faq_index = FAQIndex()
@@ -0,0 +1,249 @@
+# bot/services/fsm_storage.py
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+logger = logging.getLogger(__name__)
+
+# memory — как раньше, sqlite — один узел, redis — несколько реплик
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite").lower()
+FSM_DB_PATH = os.getenv("FSM_DB_PATH", "data/fsm.db")
+FSM_REDIS_URL = os.getenv("FSM_REDIS_URL", "redis://localhost:6379/0")
+# Брошенные анкеты и флаг чата поддержки живут не дольше суток
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", str(24 * 3600)))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+# Для redis кэш должен быть коротким: апдейты одного пользователя могут прийти на разные реплики
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "0"))
+FSM_PURGE_INTERVAL = float(os.getenv("FSM_PURGE_INTERVAL", "600"))
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM в отдельном SQLite-файле (WAL).
+
+    Все обращения к БД идут через один рабочий поток — sqlite3-соединение
+    не делится между потоками, а записи сериализуются без блокировок.
+    Записи старше ttl считаются пустыми и периодически удаляются.
+    """
+
+    def __init__(self, path: str = FSM_DB_PATH, ttl: int = FSM_STATE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.key_builder = DefaultKeyBuilder(with_destiny=True)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite")
+        self._connection: Optional[sqlite3.Connection] = None
+        self._last_purge = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA busy_timeout=5000")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS fsm_states ("
+                " key TEXT PRIMARY KEY,"
+                " state TEXT,"
+                " data TEXT NOT NULL DEFAULT '{}',"
+                " updated_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_fsm_states_updated_at ON fsm_states (updated_at)")
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    # ---------------------------------------------------------------- синхронная часть
+
+    def _read(self, key: str) -> Tuple[Optional[str], Dict[str, Any], Optional[float]]:
+        row = self._connect().execute(
+            "SELECT state, data, updated_at FROM fsm_states WHERE key = ? AND updated_at >= ?",
+            (key, time.time() - self.ttl),
+        ).fetchone()
+        if row is None:
+            return None, {}, None
+        return row[0], json.loads(row[1]), row[2]
+
+    def _write(self, key: str, column: str, value: Optional[str]) -> None:
+        connection = self._connect()
+        now = time.time()
+        connection.execute(
+            f"INSERT INTO fsm_states (key, {column}, updated_at) VALUES (?, ?, ?) "
+            f"ON CONFLICT(key) DO UPDATE SET {column} = excluded.{column}, updated_at = excluded.updated_at",
+            (key, value, now),
+        )
+        # Пустые записи не храним
+        connection.execute("DELETE FROM fsm_states WHERE key = ? AND state IS NULL AND data = '{}'", (key,))
+        if now - self._last_purge > FSM_PURGE_INTERVAL:
+            connection.execute("DELETE FROM fsm_states WHERE updated_at < ?", (now - self.ttl,))
+            self._last_purge = now
+        connection.commit()
+
+    # ---------------------------------------------------------------- BaseStorage
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._run(self._write, self.key_builder.build(key), "state", _state_name(state))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _, _ = await self._run(self._read, self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        payload = json.dumps(data, ensure_ascii=False, default=str)
+        await self._run(self._write, self.key_builder.build(key), "data", payload)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data, _ = await self._run(self._read, self.key_builder.build(key))
+        return data
+
+    async def get_record(self, key: StorageKey) -> Tuple[Optional[str], Dict[str, Any], Optional[float]]:
+        """Состояние, данные и время последней записи (None — записи нет) за одно чтение"""
+        return await self._run(self._read, self.key_builder.build(key))
+
+    async def close(self) -> None:
+        def _close():
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+        await self._run(_close)
+        self._executor.shutdown(wait=True)
+
+
+class CachedStorage(BaseStorage):
+    """
+    Write-through кэш в памяти поверх любого хранилища FSM.
+
+    Чтение состояния на горячем пути обслуживается из словаря без обращения
+    к БД; запись сначала уходит во внутреннее хранилище, затем в кэш.
+    Запись кэша живёт не дольше, чем та же запись во внутреннем хранилище:
+    state_ttl отсчитывается от последней записи ключа (состояние и данные
+    продлеваются вместе, как updated_at в SQLite). cache_ttl — ещё более
+    короткий срок для нескольких реплик, 0 — без него. Размер ограничен
+    max_size с вытеснением давно не использованных ключей.
+    """
+
+    def __init__(self, inner: BaseStorage, max_size: int = FSM_CACHE_SIZE, cache_ttl: float = FSM_CACHE_TTL,
+                 state_ttl: float = FSM_STATE_TTL):
+        self.inner = inner
+        self.max_size = max_size
+        self.cache_ttl = cache_ttl
+        self.state_ttl = state_ttl
+        # ключ → (значение, когда закэшировано (monotonic), когда истекает во внутреннем хранилище (time))
+        self._states: "OrderedDict[StorageKey, Tuple[Optional[str], float, float]]" = OrderedDict()
+        self._data: "OrderedDict[StorageKey, Tuple[Dict[str, Any], float, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, cache: OrderedDict, key: StorageKey):
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        _, stored_at, expires_at = entry
+        if time.time() >= expires_at or (self.cache_ttl and time.monotonic() - stored_at > self.cache_ttl):
+            del cache[key]
+            return None
+        cache.move_to_end(key)
+        return entry
+
+    def _put(self, cache: OrderedDict, key: StorageKey, value, expires_at: float) -> None:
+        cache[key] = (value, time.monotonic(), expires_at)
+        cache.move_to_end(key)
+        while len(cache) > self.max_size:
+            cache.popitem(last=False)
+
+    def _written(self, cache: OrderedDict, other: OrderedDict, key: StorageKey, value) -> None:
+        """Запись продлевает срок ключа целиком — и состояния, и данных"""
+        expires_at = time.time() + self.state_ttl
+        self._put(cache, key, value, expires_at)
+        entry = other.get(key)
+        if entry is not None:
+            other[key] = (entry[0], entry[1], expires_at)
+
+    async def _load(self, key: StorageKey, cache: OrderedDict):
+        """Промах: читаем внутреннее хранилище, срок записи — от её последнего изменения"""
+        self.misses += 1
+        get_record = getattr(self.inner, "get_record", None)
+        if get_record is None:
+            if cache is self._states:
+                value = await self.inner.get_state(key)
+            else:
+                value = await self.inner.get_data(key)
+            self._put(cache, key, value.copy() if cache is self._data else value, time.time() + self.state_ttl)
+            return value
+        # Одно чтение заполняет и состояние, и данные
+        state, data, updated_at = await get_record(key)
+        expires_at = (updated_at if updated_at is not None else time.time()) + self.state_ttl
+        self._put(self._states, key, state, expires_at)
+        self._put(self._data, key, data.copy(), expires_at)
+        return state if cache is self._states else data
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self.inner.set_state(key, state)
+        self._written(self._states, self._data, key, _state_name(state))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        entry = self._get(self._states, key)
+        if entry is not None:
+            self.hits += 1
+            return entry[0]
+        return await self._load(key, self._states)
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self.inner.set_data(key, data)
+        self._written(self._data, self._states, key, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        entry = self._get(self._data, key)
+        if entry is not None:
+            self.hits += 1
+            return entry[0].copy()
+        data = await self._load(key, self._data)
+        return data.copy()
+
+    async def close(self) -> None:
+        self._states.clear()
+        self._data.clear()
+        await self.inner.close()
+
+
+def create_fsm_storage(kind: str = FSM_STORAGE) -> BaseStorage:
+    """Хранилище FSM по настройке FSM_STORAGE"""
+    if kind == "memory":
+        return MemoryStorage()
+
+    if kind == "redis":
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError as e:
+            raise RuntimeError("Для FSM_STORAGE=redis установите пакет redis") from e
+        inner = RedisStorage.from_url(
+            FSM_REDIS_URL,
+            key_builder=DefaultKeyBuilder(with_destiny=True),
+            state_ttl=FSM_STATE_TTL,
+            data_ttl=FSM_STATE_TTL,
+        )
+        logger.info("FSM: Redis (%s), кэш %s TTL", FSM_REDIS_URL, FSM_CACHE_TTL or "без")
+        return CachedStorage(inner, cache_ttl=FSM_CACHE_TTL, state_ttl=FSM_STATE_TTL) if FSM_CACHE_TTL else inner
+
+    if kind == "sqlite":
+        logger.info("FSM: SQLite (%s)", FSM_DB_PATH)
+        return CachedStorage(SQLiteStorage(FSM_DB_PATH, FSM_STATE_TTL), cache_ttl=FSM_CACHE_TTL, state_ttl=FSM_STATE_TTL)
+
+    raise ValueError(f"Неизвестный FSM_STORAGE: {kind}")
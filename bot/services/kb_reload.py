@@ -0,0 +1,162 @@
+# bot/services/kb_reload.py
+"""
+Обновление базы знаний без перезапуска бота.
+
+Наблюдатель раз в KB_WATCH_INTERVAL секунд сравнивает mtime и размер
+файлов в RAG_DOCS_PATH с прошлым проходом; /reload_kb из чата поддержки
+запускает проверку сразу. Изменённые файлы перечитываются, разбиваются
+на чанки и получают эмбеддинги в фоновом потоке — только они, остальная
+база не трогается. Затем публикуется новое поколение индекса:
+коллекция Chroma или хранилище эмбеддингов, FAQ и каталог подменяются
+одной операцией в event loop, поэтому поиск ни на момент не остаётся
+без индекса, не видит наполовину обновлённую базу и не ждёт
+переиндексации.
+
+Первый проход после запуска сверяет с коллекцией содержимое всех
+файлов: правки, сделанные пока бот был остановлен, тоже подхватываются.
+"""
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from bot.services.catalog import ProductCatalog, product_catalog
+from bot.services.faq_index import FAQIndex, faq_index
+from bot.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 0 — без наблюдателя, только /reload_kb
+KB_WATCH_INTERVAL = float(os.getenv("KB_WATCH_INTERVAL", "60"))
+
+
+@dataclass
+class ReloadResult:
+    generation: int
+    updated: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    seconds: float = 0.0
+
+
+class KnowledgeBaseReloader:
+    """Наблюдатель за data/docs и публикация новых поколений индекса"""
+
+    def __init__(self, engine, faq: FAQIndex = faq_index, catalog: ProductCatalog = product_catalog,
+                 interval: float = KB_WATCH_INTERVAL):
+        self.engine = engine
+        self.faq = faq
+        self.catalog = catalog
+        self.interval = interval
+        self._seen: Optional[Dict[str, Tuple[float, int]]] = None  # файл → (mtime, размер) прошлого прохода
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self.last_result: Optional[ReloadResult] = None
+
+    def start(self) -> None:
+        if self.interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run(), name="kb-watcher")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reload()
+            except Exception as e:
+                logger.error("Ошибка обновления базы знаний: %s", e)
+
+    def _snapshot(self) -> Dict[str, Tuple[float, int]]:
+        snapshot = {}
+        for path in self.engine._doc_files():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_mtime, stat.st_size)
+        return snapshot
+
+    def _remember(self, snapshot: Dict[str, Tuple[float, int]], failed: List[str]) -> None:
+        """Файлы, которые не удалось переиндексировать, проверяются снова на следующем проходе"""
+        previous = self._seen or {}
+        for path in failed:
+            if path in previous:
+                snapshot[path] = previous[path]
+            else:
+                snapshot.pop(path, None)
+        self._seen = snapshot
+
+    @property
+    def running(self) -> bool:
+        return self._lock is not None and self._lock.locked()
+
+    async def reload(self, force: bool = False) -> Optional[ReloadResult]:
+        """
+        Переиндексирует изменённые файлы и публикует новое поколение.
+        force — сверить содержимое всех файлов, а не только изменившихся
+        по mtime. None — изменений нет.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            started = time.perf_counter()
+            snapshot = await asyncio.to_thread(self._snapshot)
+            full_check = force or self._seen is None
+            if full_check:
+                candidates = None
+            else:
+                candidates = [path for path, stat in snapshot.items() if self._seen.get(path) != stat]
+                if not candidates and snapshot.keys() == self._seen.keys():
+                    return None
+
+            with metrics.timed("kb_reload"):
+                updated, removed, failed = await asyncio.to_thread(self.engine.sync_docs, candidates)
+                changed = updated + removed
+                if not changed:
+                    self._remember(snapshot, failed)
+                    return None
+                store = await asyncio.to_thread(self.engine.build_store)
+                # FAQ и каталог ещё не загружены — прочитают свежие файлы сами при первом обращении
+                fresh_faq = fresh_catalog = None
+                if self.faq.loaded and any(os.path.basename(path) in self.faq.files for path in changed):
+                    fresh_faq = await asyncio.to_thread(self.faq.rebuilt, self.engine.embed)
+                if self.catalog.loaded and any(path.endswith(".txt") for path in changed):
+                    fresh_catalog = await asyncio.to_thread(self.catalog.rebuilt)
+
+            # Подмена — в event loop, без await между шагами: обработчики видят
+            # либо целиком старое поколение, либо целиком новое
+            if fresh_faq is not None:
+                self.faq.replace_with(fresh_faq)
+            if fresh_catalog is not None:
+                self.catalog.replace_with(fresh_catalog)
+            generation = self.engine.publish(store)
+            self._remember(snapshot, failed)
+
+            result = ReloadResult(generation, updated, removed, time.perf_counter() - started)
+            self.last_result = result
+            metrics.inc("kb_reloads_total")
+            logger.info(
+                "База знаний: поколение %d, обновлено %d, удалено %d файлов за %.1f с",
+                generation, len(updated), len(removed), result.seconds,
+            )
+            return result
+
+
+def format_reload(result: Optional[ReloadResult]) -> str:
+    if result is None:
+        return "📚 База знаний не изменилась."
+    lines = [f"📚 Опубликовано поколение базы знаний #{result.generation} ({result.seconds:.1f} с)."]
+    if result.updated:
+        lines.append("Обновлены: " + ", ".join(os.path.basename(path) for path in result.updated))
+    if result.removed:
+        lines.append("Удалены: " + ", ".join(os.path.basename(path) for path in result.removed))
+    return "\n".join(lines)
@@ -0,0 +1,53 @@
+# bot/services/lexical_search.py
+"""
+Лексический поиск BM25 по чанкам базы знаний — запасной путь, когда
+эмбеддинги недоступны. Слова нормализуются так же, как в FAQ (основы
+без стоп-слов), индекс строится в памяти за миллисекунды.
+"""
+import heapq
+import math
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+
+from bot.services.faq_index import normalize
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+class BM25Index:
+    def __init__(self, documents: Sequence[str], k1: float = BM25_K1, b: float = BM25_B):
+        self.documents = list(documents)
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}  # основа → (номер чанка, частота)
+        self._lengths: List[int] = []
+        for number, document in enumerate(self.documents):
+            terms = Counter(normalize(document))
+            self._lengths.append(sum(terms.values()))
+            for term, frequency in terms.items():
+                self._postings.setdefault(term, []).append((number, frequency))
+        self._average = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+        total = len(self.documents)
+        self._idf = {
+            term: math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self._postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def search(self, query: str, n_results: int) -> List[Tuple[int, float]]:
+        """(номер чанка, оценка) лучших n_results с ненулевой оценкой"""
+        scores: Dict[int, float] = {}
+        for term in set(normalize(query)):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for number, frequency in self._postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[number] / (self._average or 1))
+                scores[number] = scores.get(number, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return heapq.nlargest(n_results, scores.items(), key=lambda item: item[1])
+
+    def documents_for(self, query: str, n_results: int) -> List[str]:
+        return [self.documents[number] for number, _ in self.search(query, n_results)]
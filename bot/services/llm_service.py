@@ -1,14 +1,37 @@
 # bot/services/llm_service.py
 import httpx
 import os
-from dotenv import load_dotenv
+from typing import Optional
+from bot.config import load_config
 import logging
+from bot.services.metrics import metrics
+from bot.services.tracing import correlation_id
 
-load_dotenv()
+load_config()
 logger = logging.getLogger(__name__)
 
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OPENROUTER_MODEL = os.getenv("OPENROUTER_MODEL", "deepseek/deepseek-chat-v3-0324:free")
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+
+# Общий клиент: соединения и TLS-сессии переиспользуются между запросами
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=30.0,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+    return _http_client
+
+async def close_http_client() -> None:
+    """Закрывает общий HTTP-клиент (при остановке бота)"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
 
 async def query_openrouter(system_prompt: str, user_query: str) -> str:
     """
@@ -17,14 +40,16 @@ async def query_openrouter(system_prompt: str, user_query: str) -> str:
     if not OPENROUTER_API_KEY:
         return "Ошибка конфигурации: API ключ OpenRouter не задан."
 
-    async with httpx.AsyncClient() as client:
-        try:
+    client = get_http_client()
+    try:
+        with metrics.timed("openrouter"):
             response = await client.post(
-                url="https://openrouter.ai/api/v1/chat/completions",
+                url=OPENROUTER_URL,
                 headers={
                     "Authorization": f"Bearer {OPENROUTER_API_KEY}",
                     "HTTP-Referer": "https://xn--j1aijl6bd.xn--p1ai/",
-                    "X-Title": "ECOFES Bot"
+                    "X-Title": "ECOFES Bot",
+                    "X-Request-ID": correlation_id.get(),
                 },
                 json={
                     "model": OPENROUTER_MODEL,
@@ -39,34 +64,36 @@ async def query_openrouter(system_prompt: str, user_query: str) -> str:
                 timeout=30.0
             )
 
-            if response.status_code == 200:
-                data = response.json()
-                raw_answer = data["choices"][0]["message"]["content"].strip()
-                
-                # Фильтруем и улучшаем ответ
+        if response.status_code == 200:
+            data = response.json()
+            raw_answer = data["choices"][0]["message"]["content"].strip()
+            
+            # Фильтруем и улучшаем ответ
+            with metrics.timed("answer_filter"):
                 filtered_answer = filter_and_improve_answer(raw_answer)
-                return filtered_answer
-                
-            else:
-                logger.error(f"OpenRouter API error {response.status_code}: {response.text}")
-                return (
-                    "К сожалению, временные технические проблемы с AI-системой. "
-                    "Для получения консультации обратитесь к менеджеру: +7 (800) 700-80-39"
-                )
-
-        except httpx.TimeoutException:
-            logger.error("OpenRouter API timeout")
-            return (
-                "Превышено время ожидания ответа. "
-                "Попробуйте переформулировать вопрос или обратитесь к специалисту."
-            )
-        except Exception as e:
-            logger.error(f"OpenRouter API exception: {str(e)}")
+            return filtered_answer
+            
+        else:
+            logger.error("OpenRouter API error %s: %s", response.status_code, response.text)
+            metrics.inc("stage_errors_total", stage="openrouter", error=f"http_{response.status_code}")
             return (
-                "Возникла ошибка при обработке запроса. "
-                "Рекомендую обратиться к менеджеру для персональной консультации."
+                "К сожалению, временные технические проблемы с AI-системой. "
+                "Для получения консультации обратитесь к менеджеру: +7 (800) 700-80-39"
             )
 
+    except httpx.TimeoutException:
+        logger.error("OpenRouter API timeout")
+        return (
+            "Превышено время ожидания ответа. "
+            "Попробуйте переформулировать вопрос или обратитесь к специалисту."
+        )
+    except Exception as e:
+        logger.error("OpenRouter API exception: %s", e)
+        return (
+            "Возникла ошибка при обработке запроса. "
+            "Рекомендую обратиться к менеджеру для персональной консультации."
+        )
+
 def filter_and_improve_answer(answer: str) -> str:
     """
     Фильтрует и улучшает ответ от LLM
@@ -0,0 +1,298 @@
+# bot/services/metrics.py
+import bisect
+import hmac
+import logging
+import os
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from bot.services.tracing import record_span
+
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = "ecofes"
+# Отдельный порт для /metrics в режиме polling; в режиме webhook эндпоинт висит на сервере вебхука
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+# Если задан — /metrics требует заголовок Authorization: Bearer <токен>
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Границы бакетов гистограмм, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Тип запроса текущего ответа: этапы внутри обработки получают его как метку
+current_query_type: ContextVar[str] = ContextVar("current_query_type", default="")
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Гистограмма с фиксированными бакетами: O(log n) на наблюдение, без хранения значений"""
+
+    __slots__ = ("buckets", "counts", "sum", "count", "max")
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последний — +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля линейной интерполяцией внутри бакета (не выше максимума)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = min(self.buckets[i] if i < len(self.buckets) else self.max, self.max)
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.max
+
+
+class Timer:
+    """
+    Контекстный менеджер замера этапа; работает и в sync-, и в async-коде.
+    Замер попадает и в гистограмму, и этапом в текущую трассировку.
+    """
+
+    __slots__ = ("registry", "stage", "labels", "started")
+
+    def __init__(self, registry: "MetricsRegistry", stage: str, labels: Dict[str, str]):
+        self.registry = registry
+        self.stage = stage
+        self.labels = labels
+        self.started = 0.0
+
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        elapsed = time.perf_counter() - self.started
+        self.registry.observe_stage(self.stage, elapsed, **self.labels)
+        error = exc_type.__name__ if exc_type is not None else None
+        if error is not None:
+            self.registry.inc("stage_errors_total", stage=self.stage, error=error)
+        record_span(self.stage, self.started, elapsed, error)
+        return False
+
+
+class MetricsRegistry:
+    """
+    Счётчики и гистограммы в памяти процесса с выдачей в текстовом
+    формате Prometheus.
+
+    Метрики:
+      stage_duration_seconds{stage, query_type} — длительность этапов
+      answer_duration_seconds{query_type, outcome} — ответ целиком
+      answers_total{query_type, outcome}, stage_errors_total{stage, error}
+    """
+
+    def __init__(self):
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self.started_at = time.time()
+
+    @staticmethod
+    def _key(labels: Dict[str, str]) -> LabelKey:
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        series = self._histograms.setdefault(name, {})
+        key = self._key(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        series = self._counters.setdefault(name, {})
+        key = self._key(labels)
+        series[key] = series.get(key, 0.0) + value
+
+    def observe_stage(self, stage: str, seconds: float, **labels) -> None:
+        labels.setdefault("query_type", current_query_type.get())
+        self.observe("stage_duration_seconds", seconds, stage=stage, **labels)
+
+    def timed(self, stage: str, **labels) -> Timer:
+        """with metrics.timed("embedding"): ..."""
+        return Timer(self, stage, labels)
+
+    def record_answer(self, query_type: str, outcome: str, seconds: float) -> None:
+        self.observe("answer_duration_seconds", seconds, query_type=query_type, outcome=outcome)
+        self.inc("answers_total", query_type=query_type, outcome=outcome)
+
+    # ---------------------------------------------------------------- выдача
+
+    @staticmethod
+    def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(key) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def render_prometheus(self) -> str:
+        lines: List[str] = []
+        for name, series in sorted(self._counters.items()):
+            full_name = f"{METRICS_PREFIX}_{name}"
+            lines.append(f"# TYPE {full_name} counter")
+            for key, value in list(series.items()):
+                lines.append(f"{full_name}{self._format_labels(key)} {value:g}")
+
+        for name, series in sorted(self._histograms.items()):
+            full_name = f"{METRICS_PREFIX}_{name}"
+            lines.append(f"# TYPE {full_name} histogram")
+            for key, histogram in list(series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f"{full_name}_bucket{self._format_labels(key, ('le', f'{bound:g}'))} {cumulative}")
+                lines.append(f"{full_name}_bucket{self._format_labels(key, ('le', '+Inf'))} {histogram.count}")
+                lines.append(f"{full_name}_sum{self._format_labels(key)} {histogram.sum:.6f}")
+                lines.append(f"{full_name}_count{self._format_labels(key)} {histogram.count}")
+
+        lines.append(f"# TYPE {METRICS_PREFIX}_process_start_time_seconds gauge")
+        lines.append(f"{METRICS_PREFIX}_process_start_time_seconds {self.started_at:.0f}")
+        return "\n".join(lines) + "\n"
+
+    def stage_summary(self) -> List[Dict]:
+        """Сводка по этапам (все типы запросов вместе): число, среднее, p50/p95/p99"""
+        merged: Dict[str, Histogram] = {}
+        for key, histogram in self._histograms.get("stage_duration_seconds", {}).items():
+            stage = dict(key)["stage"]
+            total = merged.setdefault(stage, Histogram(histogram.buckets))
+            total.counts = [a + b for a, b in zip(total.counts, histogram.counts)]
+            total.sum += histogram.sum
+            total.count += histogram.count
+            total.max = max(total.max, histogram.max)
+        return [
+            {
+                "stage": stage,
+                "count": h.count,
+                "avg": h.sum / h.count if h.count else 0.0,
+                "p50": h.quantile(0.5),
+                "p95": h.quantile(0.95),
+                "p99": h.quantile(0.99),
+            }
+            for stage, h in sorted(merged.items(), key=lambda item: -item[1].sum)
+        ]
+
+    def counter_by(self, name: str, label: str) -> Dict[str, int]:
+        """Значения счётчика, сложенные по одной метке"""
+        totals: Dict[str, int] = {}
+        for key, value in self._counters.get(name, {}).items():
+            label_value = dict(key).get(label, "")
+            totals[label_value] = totals.get(label_value, 0) + int(value)
+        return totals
+
+    def answer_counts(self) -> Dict[Tuple[str, str], int]:
+        return {
+            (dict(key)["query_type"], dict(key)["outcome"]): int(value)
+            for key, value in self._counters.get("answers_total", {}).items()
+        }
+
+
+def format_perf(registry: "MetricsRegistry") -> str:
+    """Сводка /perf для чата поддержки (HTML)"""
+    uptime_hours = (time.time() - registry.started_at) / 3600
+    lines = [f"<b>⏱ Производительность</b> (с запуска, {uptime_hours:.1f} ч)", ""]
+
+    summary = registry.stage_summary()
+    if not summary:
+        lines.append("Замеров пока нет.")
+    for row in summary:
+        lines.append(
+            f"<code>{row['stage']:<16}</code> n={row['count']} "
+            f"avg={row['avg'] * 1000:.0f} p50={row['p50'] * 1000:.0f} "
+            f"p95={row['p95'] * 1000:.0f} p99={row['p99'] * 1000:.0f} мс"
+        )
+
+    answers = registry.answer_counts()
+    if answers:
+        lines += ["", "<b>Ответы по типам и исходам:</b>"]
+        for (query_type, outcome), count in sorted(answers.items(), key=lambda item: -item[1]):
+            lines.append(f"• {query_type or '—'} / {outcome}: {count}")
+
+    faq = registry.counter_by("faq_lookups_total", "result")
+    lookups = sum(faq.values())
+    if lookups:
+        hits = lookups - faq.get("miss", 0)
+        lines += [
+            "",
+            f"<b>FAQ:</b> {hits} из {lookups} ({hits / lookups:.0%}), "
+            f"лексически {faq.get('lexical', 0)}, по эмбеддингу {faq.get('embedding', 0)}",
+        ]
+
+    prefetch = registry.counter_by("prefetch_total", "result")
+    if prefetch:
+        lines.append(
+            f"<b>Предвыборка подбора:</b> использована {prefetch.get('hit', 0)}, "
+            f"не подошла {prefetch.get('miss', 0)}, не успела {prefetch.get('timeout', 0)}, "
+            f"отменена {prefetch.get('cancelled', 0)}"
+        )
+    fallback = registry.counter_by("search_fallback_total", "reason")
+    if fallback:
+        breaker = registry.counter_by("embedding_breaker_total", "event")
+        lines.append(
+            f"<b>Поиск по словам вместо эмбеддингов:</b> {sum(fallback.values())} "
+            f"(цепь разомкнута {fallback.get('open', 0)}, ошибка {fallback.get('error', 0)}); "
+            f"размыканий {breaker.get('open', 0)}, восстановлений {breaker.get('close', 0)}"
+        )
+    cache = registry.counter_by("embedding_cache_total", "result")
+    if cache:
+        lines.append(f"<b>Кэш эмбеддингов:</b> {cache.get('hit', 0)} из {sum(cache.values())}")
+    return "\n".join(lines)
+
+
+async def handle_metrics(request) -> "web.Response":
+    """aiohttp-обработчик GET /metrics"""
+    from aiohttp import web
+
+    if METRICS_TOKEN:
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not hmac.compare_digest(token, METRICS_TOKEN):
+            return web.Response(status=401)
+    return web.Response(text=metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+
+class MetricsServer:
+    """Отдельный HTTP-сервер для /metrics (режим polling, METRICS_PORT > 0)"""
+
+    def __init__(self, host: str = METRICS_HOST, port: int = METRICS_PORT):
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def start(self) -> None:
+        if not self.port or self._runner is not None:
+            return
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info("Метрики доступны на %s:%s/metrics", self.host, self.port)
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+metrics = MetricsRegistry()
+metrics_server = MetricsServer()
@@ -0,0 +1,245 @@
+# bot/services/query_log.py
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Deque, Dict, List, Optional
+
+from sqlalchemy import insert, update
+
+from bot.services.database import SessionLocal, UserQuery
+from bot.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+QUERY_LOG_BATCH_SIZE = int(os.getenv("QUERY_LOG_BATCH_SIZE", "100"))
+QUERY_LOG_FLUSH_INTERVAL = float(os.getenv("QUERY_LOG_FLUSH_INTERVAL", "2.0"))
+QUERY_LOG_MAX_PENDING = int(os.getenv("QUERY_LOG_MAX_PENDING", "5000"))
+# Пустое значение отключает сброс на диск: при переполнении записи отбрасываются
+QUERY_LOG_SPILL_PATH = os.getenv("QUERY_LOG_SPILL_PATH", "data/query_log_spill.jsonl")
+# Запросы пользователя за это окно до заявки считаются приведшими к лиду
+LEAD_ATTRIBUTION_HOURS = float(os.getenv("LEAD_ATTRIBUTION_HOURS", "24"))
+
+
+class QueryLogQueue:
+    """
+    Отложенная (write-behind) запись журнала запросов в user_queries.
+
+    Обработчики только кладут событие в очередь в памяти, а фоновая задача
+    пишет их пачками в одной транзакции — по размеру пачки или по таймеру.
+    Очередь ограничена: при переполнении записи сбрасываются в JSONL-файл
+    и дозаписываются в БД при следующем сбросе.
+
+    Кроме самих запросов очередь переносит отметки о лидах: UPDATE is_lead
+    выполняется в той же транзакции после вставки пачки, поэтому
+    атрибуция видит и ещё не записанные к моменту заявки запросы.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = QUERY_LOG_BATCH_SIZE,
+        flush_interval: float = QUERY_LOG_FLUSH_INTERVAL,
+        max_pending: int = QUERY_LOG_MAX_PENDING,
+        spill_path: Optional[str] = QUERY_LOG_SPILL_PATH,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.spill_path = spill_path or None
+
+        self._pending: Deque[Dict] = deque()
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        # Счётчики для диагностики
+        self.written = 0
+        self.spilled = 0
+        self.dropped = 0
+
+    # ---------------------------------------------------------------- запись
+
+    def log(
+        self,
+        user_id: int,
+        username: Optional[str],
+        query_text: str,
+        response_text: Optional[str] = None,
+        timestamp: Optional[datetime] = None,
+        query_type: Optional[str] = None,
+        outcome: Optional[str] = None,
+    ) -> None:
+        """Ставит запись о запросе в очередь. Не блокирует и не ходит в БД."""
+        self._enqueue({
+            "kind": "query",
+            "user_id": user_id,
+            "username": username,
+            "query_text": query_text,
+            "response_text": response_text,
+            "timestamp": timestamp or datetime.utcnow(),
+            "query_type": query_type,
+            "outcome": outcome,
+        })
+
+    def mark_lead(self, user_id: int, timestamp: Optional[datetime] = None) -> None:
+        """Помечает is_lead у запросов пользователя за окно атрибуции до заявки"""
+        self._enqueue({
+            "kind": "lead",
+            "user_id": user_id,
+            "timestamp": timestamp or datetime.utcnow(),
+        })
+
+    def _enqueue(self, record: Dict) -> None:
+        if len(self._pending) >= self.max_pending:
+            self._spill([record])
+        else:
+            self._pending.append(record)
+
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    # ---------------------------------------------------------------- жизненный цикл
+
+    def start(self) -> None:
+        """Запускает фоновую задачу сброса (вызывать внутри работающего event loop)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="query-log-flusher")
+
+    async def stop(self) -> None:
+        """Останавливает фоновую задачу и дописывает всё, что осталось в очереди"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        logger.info(
+            "Журнал запросов остановлен: записано %s, сброшено на диск %s, потеряно %s",
+            self.written, self.spilled, self.dropped,
+        )
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Ошибка фонового сброса журнала запросов: %s", e)
+
+    # ---------------------------------------------------------------- сброс
+
+    async def flush(self) -> None:
+        """Пишет все накопленные записи пачками, затем дозаписывает файл переполнения"""
+        async with self._flush_lock:
+            while self._pending:
+                batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+                try:
+                    await asyncio.to_thread(self._write_batch, batch)
+                except Exception as e:
+                    logger.error("Ошибка пакетной записи журнала (%d записей): %s", len(batch), e)
+                    self._requeue(batch)
+                    return
+
+            if self.spill_path and os.path.exists(self.spill_path):
+                await asyncio.to_thread(self._replay_spill)
+
+    def _write_batch(self, batch: List[Dict]) -> None:
+        """Одна транзакция на пачку вместо INSERT + UPDATE на каждое сообщение"""
+        rows = [{k: v for k, v in record.items() if k != "kind"} for record in batch if record["kind"] == "query"]
+        leads = [record for record in batch if record["kind"] == "lead"]
+
+        db = SessionLocal()
+        try:
+            with metrics.timed("db_query_log"):
+                self._execute_batch(db, rows, leads)
+            self.written += len(rows)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    @staticmethod
+    def _execute_batch(db, rows: List[Dict], leads: List[Dict]) -> None:
+        if rows:
+            db.execute(insert(UserQuery), rows)
+        window = timedelta(hours=LEAD_ATTRIBUTION_HOURS)
+        for lead in leads:
+            db.execute(
+                update(UserQuery)
+                .where(
+                    UserQuery.user_id == lead["user_id"],
+                    UserQuery.timestamp >= lead["timestamp"] - window,
+                    UserQuery.timestamp <= lead["timestamp"],
+                )
+                .values(is_lead=True)
+            )
+        db.commit()
+
+    def _requeue(self, batch: List[Dict]) -> None:
+        """Возвращает неудачную пачку в начало очереди, излишек — на диск"""
+        room = max(self.max_pending - len(self._pending), 0)
+        keep, overflow = batch[:room], batch[room:]
+        self._pending.extendleft(reversed(keep))
+        if overflow:
+            self._spill(overflow)
+
+    # ---------------------------------------------------------------- переполнение
+
+    def _spill(self, records: List[Dict]) -> None:
+        if not self.spill_path:
+            self.dropped += len(records)
+            return
+        try:
+            os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(
+                        {**record, "timestamp": record["timestamp"].isoformat()},
+                        ensure_ascii=False,
+                    ) + "\n")
+            self.spilled += len(records)
+        except OSError as e:
+            logger.error("Не удалось сбросить журнал запросов на диск: %s", e)
+            self.dropped += len(records)
+
+    def _replay_spill(self) -> None:
+        """
+        Переносит записи из файла переполнения в БД одной транзакцией и
+        удаляет файл: при ошибке в БД не попадает ничего, и следующий
+        сброс повторяет файл целиком без дублей.
+        """
+        replay_path = f"{self.spill_path}.replay"
+        if not os.path.exists(replay_path):
+            os.replace(self.spill_path, replay_path)
+
+        records: List[Dict] = []
+        with open(replay_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                record.setdefault("kind", "query")
+                record["timestamp"] = datetime.fromisoformat(record["timestamp"])
+                records.append(record)
+        if records:
+            self._write_batch(records)
+
+        os.remove(replay_path)
+        logger.info("Файл переполнения журнала запросов перенесён в БД")
+
+
+query_log = QueryLogQueue()
@@ -1,22 +1,76 @@
 # bot/services/rag_engine.py
+import asyncio
+import logging
 import os
-import chromadb
+import threading
+import httpx
 import requests
 import base64
 import uuid
 import time
-from typing import List
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 import urllib3
 
+from bot.config import load_config
+from bot.services.metrics import metrics
+from bot.services.tracing import correlation_id
+from bot.utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+
+load_config()
+logger = logging.getLogger(__name__)
+
 tr_text = 1000
 chunk_size = 200
 n_res = 3
 
+# Адреса переопределяются для локальных стендов (python -m bot.devtools.api_stubs)
+GIGACHAT_OAUTH_URL = os.getenv("GIGACHAT_OAUTH_URL", "https://ngw.devices.sberbank.ru:9443/api/v2/oauth")
+GIGACHAT_EMBEDDINGS_URL = os.getenv("GIGACHAT_EMBEDDINGS_URL", "https://gigachat.devices.sberbank.ru/api/v1/embeddings")
+GIGACHAT_TIMEOUT = float(os.getenv("GIGACHAT_TIMEOUT", "20"))
+RAG_DOCS_PATH = os.getenv("RAG_DOCS_PATH", "data/docs")
+CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH", "data/chroma_db")
+# Где искать ближайшие фрагменты: chroma — запросом к коллекции;
+# float16 / int8 — в компактном хранилище в памяти (bot/services/embedding_store.py)
+VECTOR_STORE = os.getenv("VECTOR_STORE", "chroma")
+# Предохранитель эмбеддингов: столько ошибок подряд — и поиск идёт по словам (BM25),
+# пока фоновая проба не увидит, что GigaChat снова отвечает
+EMBEDDING_BREAKER_FAILURES = int(os.getenv("EMBEDDING_BREAKER_FAILURES", "3"))
+EMBEDDING_BREAKER_RESET = float(os.getenv("EMBEDDING_BREAKER_RESET", "30"))
+EMBEDDING_BREAKER_MAX_RESET = float(os.getenv("EMBEDDING_BREAKER_MAX_RESET", "300"))
+PROBE_TEXT = "проверка"
+# Эмбеддинги последних запросов: повторные фразы не ходят в GigaChat
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "512"))
+
+# Коллекция Chroma текущего поколения базы знаний: имя хранится в файле
+# рядом с базой, публикация обновления подменяет его (см. RAGEngine.publish)
+COLLECTION_NAME = "ecofes_docs"
+LIVE_COLLECTION_FILE = "live_collection"
+
 # Отключаем предупреждения о непроверенном SSL
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+
+def _provider_failure(error: Exception) -> bool:
+    """Ошибка на стороне GigaChat или сети (а не запроса): учитывается предохранителем"""
+    if isinstance(error, (httpx.TransportError, requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    return status is not None and (status >= 500 or status == 429)
+
+
+def live_collection_name(db_path: str = CHROMA_DB_PATH) -> str:
+    """Имя коллекции Chroma, опубликованной последней"""
+    try:
+        with open(os.path.join(db_path, LIVE_COLLECTION_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or COLLECTION_NAME
+    except FileNotFoundError:
+        return COLLECTION_NAME
+
+
 class RAGEngine:
-    def __init__(self, docs_path: str = "data/docs", db_path: str = "data/chroma_db"):
+    def __init__(self, docs_path: str = RAG_DOCS_PATH, db_path: str = CHROMA_DB_PATH):
         self.docs_path = docs_path
         self.db_path = db_path
 
@@ -26,42 +80,127 @@ class RAGEngine:
         if not self.GIGACHAT_CLIENT_ID or not self.GIGACHAT_SECRET:
             raise EnvironmentError("GIGACHAT_CLIENT_ID и GIGACHAT_SECRET должны быть заданы в .env")
 
+        # Общая HTTP-сессия: keep-alive соединения к GigaChat между запросами
+        self.http = requests.Session()
+        # Асинхронный клиент для поиска из обработчиков: запрос отменяется вместе с задачей
+        self._async_http: Optional[httpx.AsyncClient] = None
+        self._token_lock: Optional[asyncio.Lock] = None
+
         self.access_token = None
-        self._refresh_token()
+        self._embedding_cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.embedding_breaker = CircuitBreaker(
+            "GigaChat embeddings", EMBEDDING_BREAKER_FAILURES, EMBEDDING_BREAKER_RESET, EMBEDDING_BREAKER_MAX_RESET
+        )
+        self._probe_task: Optional[asyncio.Task] = None
+        self._lexical = None  # (поколение, BM25Index) — запасной поиск по словам
+        # Chroma, токен и индексация — в warm_up(): импорт модуля и создание движка ничего не ждут
+        self.client = None
+        self.collection = None
+        # Коллекция следующего поколения (VECTOR_STORE=chroma), ждёт publish()
+        self._staged_collection = None
+        self._retired_collection: Optional[str] = None
+        self.store = None
+        # Поколение базы знаний: растёт при каждой публикации обновлённого индекса
+        self.generation = 0
+        self._warm_up_lock = threading.Lock()
 
-        # ChromaDB
-        self.client = chromadb.PersistentClient(path=db_path)
-        self.collection = self.client.get_or_create_collection("ecofes_docs")
+    def warm_up(self) -> None:
+        """
+        Получает токен, открывает Chroma и индексирует базу знаний.
+        Вызывается при запуске бота в фоне или при первом поиске;
+        повторный вызов после успешного ничего не делает.
+        """
+        with self._warm_up_lock:
+            if self.collection is not None:
+                return
+            import chromadb  # тяжёлый импорт: только когда движок действительно нужен
 
-        # Загружаем и индексируем документы
-        self._load_and_index_docs()
+            if self.access_token is None:
+                try:
+                    self._refresh_token()
+                except Exception as e:
+                    # Chroma и поиск по словам работают и без GigaChat; токен получим позже
+                    logger.warning("GigaChat недоступен при прогреве: %s", e)
+                    self._record_embedding_failure(e)
+            self.client = chromadb.PersistentClient(path=self.db_path)
+            collection = self.client.get_or_create_collection(live_collection_name(self.db_path))
+            self._drop_collections(keep=collection.name)
+            self._load_and_index_docs(collection)
+            if VECTOR_STORE != "chroma":
+                self.store = self._open_store(collection)
+            self.collection = collection
 
-    def _refresh_token(self):
-        """Получает новый access_token через OAuth"""
+    def _open_store(self, collection):
+        """Квантованное хранилище эмбеддингов: с диска или заново из коллекции"""
+        from bot.services.embedding_store import EmbeddingStore, EMBEDDING_STORE_PATH, fingerprint
+
+        store = EmbeddingStore.load(EMBEDDING_STORE_PATH)
+        # Сверяем содержимое, а не только идентификаторы: правка файла без изменения
+        # числа чанков оставляет прежние идентификаторы при новых текстах
+        if store is not None and store.dtype == VECTOR_STORE:
+            data = collection.get(include=["documents"])
+            if store.fingerprint != fingerprint(data["ids"], data["documents"]):
+                store = None
+        if store is None or store.dtype != VECTOR_STORE:
+            store = EmbeddingStore.from_collection(collection, VECTOR_STORE)
+            store.save(EMBEDDING_STORE_PATH)
+            # Полноточные векторы дальше читаются с диска через memmap
+            store = EmbeddingStore.load(EMBEDDING_STORE_PATH)
+        logger.info(
+            "Хранилище эмбеддингов %s: %d векторов, %.1f МБ в памяти",
+            store.dtype, len(store), store.memory_bytes() / 2**20,
+        )
+        return store
+
+    def _nearest(self, embedding: List[float], n_results: int) -> Tuple[List[str], List[float]]:
+        """Ближайшие фрагменты и расстояния: из хранилища в памяти или из Chroma"""
+        store = self.store  # поколение фиксируется на весь запрос
+        if store is not None:
+            with metrics.timed("store_query"):
+                return store.query(embedding, n_results)
+        with metrics.timed("chroma_query"):
+            results = self.collection.query(query_embeddings=[embedding], n_results=n_results)
+        if not results["documents"]:
+            return [], []
+        return results["documents"][0], results["distances"][0]
+
+    async def _anearest(self, embedding: List[float], n_results: int) -> Tuple[List[str], List[float]]:
+        if self.store is not None:
+            # Поиск в памяти занимает доли миллисекунды — без пула потоков
+            return self._nearest(embedding, n_results)
+        return await asyncio.to_thread(self._nearest, embedding, n_results)
+
+    def _oauth_headers(self) -> dict:
         credentials = f"{self.GIGACHAT_CLIENT_ID}:{self.GIGACHAT_SECRET}"
         encoded_credentials = base64.b64encode(credentials.encode()).decode()
-
-        url = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
-        headers = {
+        return {
             "Authorization": f"Basic {encoded_credentials}",
             "RqUID": str(uuid.uuid4()),
             "Content-Type": "application/x-www-form-urlencoded",
             "Accept": "application/json"
         }
+
+    def _refresh_token(self):
+        """Получает новый access_token через OAuth"""
+        url = GIGACHAT_OAUTH_URL
+        headers = self._oauth_headers()
         data = {"scope": "GIGACHAT_API_PERS"}
 
         try:
-            response = requests.post(url, headers=headers, data=data, verify=False)
+            with metrics.timed("token_refresh"):
+                response = self.http.post(url, headers=headers, data=data, verify=False, timeout=GIGACHAT_TIMEOUT)
             response.raise_for_status()
             self.access_token = response.json()["access_token"]
-            print("✅ access_token успешно получен")
+            logger.info("access_token GigaChat получен")
         except requests.exceptions.HTTPError as e:
-            print(f"❌ Ошибка при получении токена: {e.response.status_code} {e.response.text}")
+            logger.error("Ошибка при получении токена: %s %s", e.response.status_code, e.response.text)
             raise
 
     def _get_embedding(self, text: str) -> List[float]:
         """Получает эмбеддинг через GigaChat API"""
-        url = "https://gigachat.devices.sberbank.ru/api/v1/embeddings"
+        if not self.embedding_breaker.allow():
+            raise CircuitOpenError("эмбеддинги GigaChat недоступны")
+        url = GIGACHAT_EMBEDDINGS_URL
         headers = {
             "Authorization": f"Bearer {self.access_token}",
             "Content-Type": "application/json",
@@ -75,98 +214,440 @@ class RAGEngine:
         }
 
         try:
-            response = requests.post(url, headers=headers, json=payload, verify=False)
+            with metrics.timed("embedding"):
+                response = self.http.post(url, headers=headers, json=payload, verify=False, timeout=GIGACHAT_TIMEOUT)
             if response.status_code == 401:  # Unauthorized
-                print("🔐 Токен устарел. Получаем новый...")
+                logger.info("Токен GigaChat устарел, получаем новый")
                 self._refresh_token()
                 headers["Authorization"] = f"Bearer {self.access_token}"
-                response = requests.post(url, headers=headers, json=payload, verify=False)
+                response = self.http.post(url, headers=headers, json=payload, verify=False, timeout=GIGACHAT_TIMEOUT)
 
             response.raise_for_status()
-            return response.json()["data"][0]["embedding"]
+            embedding = response.json()["data"][0]["embedding"]
+            self.embedding_breaker.record_success()
+            return embedding
 
         except requests.exceptions.HTTPError as e:
-            if response.status_code == 413:
-                print(f"❌ Текст слишком длинный для GigaChat: '{text[:500]}...'")
-            else:
-                print(f"❌ Ошибка {response.status_code}: {response.text}")
+            if e.response is not None and e.response.status_code == 413:
+                logger.error("Текст слишком длинный для GigaChat: %r...", text[:500])
+            elif e.response is not None:
+                logger.error("Ошибка эмбеддинга %s: %s", e.response.status_code, e.response.text)
+            self._record_embedding_failure(e)
             raise
         except Exception as e:
-            print(f"❌ Неизвестная ошибка: {e}")
+            logger.error("Ошибка получения эмбеддинга: %s", e)
+            self._record_embedding_failure(e)
             raise
 
+    def _record_embedding_failure(self, error: Exception) -> None:
+        if _provider_failure(error) and self.embedding_breaker.record_failure():
+            metrics.inc("embedding_breaker_total", event="open")
+            self._start_probe()
+
+    def _start_probe(self) -> None:
+        """Фоновая проба GigaChat, пока цепь разомкнута (из потока — при следующем асинхронном вызове)"""
+        if self._probe_task is not None and not self._probe_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._probe_task = loop.create_task(self._probe_embeddings(), name="embedding-probe")
+
+    async def _probe_embeddings(self) -> None:
+        breaker = self.embedding_breaker
+        while breaker.is_open:
+            await asyncio.sleep(breaker.probe_due())
+            try:
+                await self._afetch_embedding(PROBE_TEXT)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                breaker.probe_failed()
+                logger.info("GigaChat всё ещё недоступен (%s), следующая проба через %.0f с", e, breaker.probe_due())
+            else:
+                breaker.record_success()
+                metrics.inc("embedding_breaker_total", event="close")
+
     def _split_text(self, text: str, chunk_size: int = chunk_size) -> List[str]:
         """Разбивает текст на чанки по количеству слов"""
         words = text.split()
         return [" ".join(words[i:i+chunk_size]) for i in range(0, len(words), chunk_size)]
 
-    def _load_and_index_docs(self):
+    def _doc_files(self) -> List[str]:
         import glob
-        import os
 
-        doc_files = list(glob.glob(f"{self.docs_path}/**/*.*", recursive=True))
-        print(f"🔍 Найдено файлов: {len(doc_files)}")
+        return sorted(glob.glob(f"{self.docs_path}/**/*.*", recursive=True))
+
+    def _file_chunks(self, file_path: str) -> Tuple[List[str], List[str]]:
+        """Идентификаторы и тексты чанков файла базы знаний"""
+        with open(file_path, "r", encoding="utf-8") as f:
+            content = f.read().strip()
+        if len(content) < 10:
+            logger.warning("Пропускаем пустой файл: %s", file_path)
+            return [], []
+
+        chunks = self._split_text(content, chunk_size=chunk_size)  # Безопасный размер
+        logger.debug("Файл %s разбит на %d чанков", os.path.basename(file_path), len(chunks))
+
+        ids, documents = [], []
+        for i, chunk in enumerate(chunks):
+            doc_id = f"{os.path.basename(file_path)}_{i}"
+            # Проверка длины чанка перед добавлением
+            if len(chunk) > tr_text*2:
+                logger.warning("Чанк %s слишком длинный (%d символов), пропускаем", doc_id, len(chunk))
+                continue
+            ids.append(doc_id)
+            documents.append(chunk)
+        return ids, documents
+
+    def _load_and_index_docs(self, collection):
+        doc_files = self._doc_files()
+        logger.info("Найдено файлов базы знаний: %d", len(doc_files))
 
-        if self.collection.count() > 0:
-            print(f"✅ Коллекция уже содержит {self.collection.count()} документов.")
+        if collection.count() > 0:
+            logger.info("Коллекция уже содержит %d документов", collection.count())
             return
 
         documents = []
         metadatas = []
         ids = []
-        debug_file = dict()
 
         for file_path in doc_files:
             try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    content = f.read().strip()
-                    if len(content) < 10:
-                        print(f"⚠️ Пропускаем пустой файл: {file_path}")
-                        continue
-
-                    chunks = self._split_text(content, chunk_size=chunk_size)  # Безопасный размер
-                    print(f"✂️ Файл {os.path.basename(file_path)} разбит на {len(chunks)} чанков")
-
-                    for i, chunk in enumerate(chunks):
-                        doc_id = f"{os.path.basename(file_path)}_{i}"
-                        # Проверка длины чанка перед добавлением
-                        if len(chunk) > tr_text*2:
-                            print(f"⚠️ Чанк {doc_id} слишком длинный ({len(chunk)} символов), пропускаем")
-                            continue
-                        documents.append(chunk)
-                        metadatas.append({"source": file_path})
-                        ids.append(doc_id)
-                        debug_file[i] = [file_path,chunk]
+                file_ids, file_documents = self._file_chunks(file_path)
             except Exception as e:
-                print(f"❌ Ошибка чтения {file_path}: {e}")
+                logger.error("Ошибка чтения %s: %s", file_path, e)
+                continue
+            ids += file_ids
+            documents += file_documents
+            metadatas += [{"source": file_path}] * len(file_ids)
 
         if documents:
-            print(f"📦 Индексируем {len(documents)} чанков...")
+            logger.info("Индексируем %d чанков", len(documents))
             embeddings = []
             for i, doc in enumerate(documents):
-                print(f"🌐 Получаем эмбеддинг {i + 1}/{len(documents)}")
+                logger.debug("Эмбеддинг %d/%d", i + 1, len(documents))
                 try:
                     emb = self._get_embedding(doc)
                     embeddings.append(emb)
                 except Exception:
-                    print(f"❌ Пропускаем чанк {i + 1} из-за ошибки")
+                    logger.warning("Пропускаем чанк %d из-за ошибки", i + 1)
                     continue  # Пропускаем проблемный чанк
                 time.sleep(0.1)  # Анти-флуд
 
             if embeddings:
-                self.collection.add(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
-                print(f"✅ Успешно проиндексировано {len(embeddings)} чанков")
+                collection.add(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+                logger.info("Проиндексировано чанков: %d", len(embeddings))
             else:
-                print("❌ Не удалось получить ни одного эмбеддинга")
+                logger.error("Не удалось получить ни одного эмбеддинга")
+        else:
+            logger.error("Нет документов для индексации")
+
+    def indexed_chunks(self) -> Dict[str, Dict[str, str]]:
+        """Проиндексированные чанки по файлам: источник → {id: текст}"""
+        data = self.collection.get(include=["documents", "metadatas"])
+        indexed: Dict[str, Dict[str, str]] = {}
+        for doc_id, document, metadata in zip(data["ids"], data["documents"], data["metadatas"]):
+            indexed.setdefault((metadata or {}).get("source", ""), {})[doc_id] = document
+        return indexed
+
+    def sync_docs(self, paths: Optional[List[str]] = None) -> Tuple[List[str], List[str], List[str]]:
+        """
+        Приводит коллекцию к файлам базы знаний: файлы из paths (по
+        умолчанию все), чьи чанки разошлись с проиндексированными,
+        переиндексируются, чанки удалённых файлов убираются.
+
+        Эмбеддинги всех изменённых файлов считаются до первой записи.
+        С VECTOR_STORE=chroma поиск читает коллекцию напрямую, поэтому
+        изменения пишутся в копию — коллекцию следующего поколения, которую
+        подменяет publish(); до этого поиск видит базу целиком в прежней
+        версии. С хранилищем в памяти поиск коллекцию не читает, и она
+        обновляется на месте, а поколение подменяет build_store/publish.
+        Возвращает (обновлённые, удалённые, не переиндексированные из-за ошибки).
+        """
+        self.warm_up()
+        files = self._doc_files()
+        indexed = self.indexed_chunks()
+        updated, removed, failed = [], [], []
+        # файл → (идентификаторы, эмбеддинги, тексты, устаревшие идентификаторы)
+        changes: Dict[str, Tuple[List[str], List[List[float]], List[str], List[str]]] = {}
+
+        for file_path in (files if paths is None else [p for p in paths if p in files]):
+            try:
+                ids, documents = self._file_chunks(file_path)
+                current = indexed.get(file_path, {})
+                if dict(zip(ids, documents)) == current:
+                    continue
+                embeddings = []
+                for document in documents:
+                    embeddings.append(self._get_embedding(document))
+                    time.sleep(0.1)  # Анти-флуд
+            except Exception as e:
+                logger.error("Не удалось переиндексировать %s, остаётся прежняя версия: %s", file_path, e)
+                failed.append(file_path)
+                continue
+            new_ids = set(ids)
+            changes[file_path] = (ids, embeddings, documents, [doc_id for doc_id in current if doc_id not in new_ids])
+        removed = [source for source in indexed if source not in files]
+        if not changes and not removed:
+            return [], [], failed
+
+        target = self.collection if VECTOR_STORE != "chroma" else self._next_collection()
+        for file_path, (ids, embeddings, documents, stale) in changes.items():
+            if ids:
+                target.upsert(
+                    ids=ids, embeddings=embeddings, documents=documents,
+                    metadatas=[{"source": file_path}] * len(ids),
+                )
+            if stale:
+                target.delete(ids=stale)
+            updated.append(file_path)
+            logger.info("Переиндексирован %s: %d чанков", file_path, len(ids))
+        for source in removed:
+            target.delete(ids=list(indexed[source]))
+            logger.info("Удалены чанки файла %s: %d", source, len(indexed[source]))
+        if target is not self.collection:
+            self._staged_collection = target
+        return updated, removed, failed
+
+    def _collection_names(self) -> List[str]:
+        # chromadb до 0.6 возвращает объекты коллекций, после — имена
+        return [getattr(item, "name", item) for item in self.client.list_collections()]
+
+    def _next_collection(self):
+        """Копия текущей коллекции под именем следующего поколения"""
+        live = self.collection.name
+        number = int(live.rsplit("_g", 1)[1]) + 1 if "_g" in live else 1
+        name = f"{COLLECTION_NAME}_g{number}"
+        if name in self._collection_names():
+            self.client.delete_collection(name)  # остаток прерванного обновления
+        staged = self.client.create_collection(name, metadata=self.collection.metadata)
+        batch = 500
+        for offset in range(0, self.collection.count(), batch):
+            page = self.collection.get(include=["embeddings", "documents", "metadatas"], limit=batch, offset=offset)
+            staged.add(
+                ids=page["ids"], embeddings=page["embeddings"],
+                documents=page["documents"], metadatas=page["metadatas"],
+            )
+        return staged
+
+    def _drop_collections(self, keep: str) -> None:
+        """Удаляет коллекции прежних поколений (при запуске, когда их никто не читает)"""
+        for name in self._collection_names():
+            if name != keep and (name == COLLECTION_NAME or name.startswith(f"{COLLECTION_NAME}_g")):
+                self.client.delete_collection(name)
+                logger.info("Удалена коллекция прежнего поколения %s", name)
+
+    def build_store(self):
+        """Новое поколение хранилища эмбеддингов из коллекции (None — поиск через Chroma)"""
+        if VECTOR_STORE == "chroma":
+            return None
+        from bot.services.embedding_store import EmbeddingStore, EMBEDDING_STORE_PATH
+
+        store = EmbeddingStore.from_collection(self.collection, VECTOR_STORE)
+        store.save(EMBEDDING_STORE_PATH)
+        return EmbeddingStore.load(EMBEDDING_STORE_PATH)
+
+    def publish(self, store=None) -> int:
+        """
+        Публикует новое поколение индекса: поиски, начатые раньше,
+        доходят по старому хранилищу или коллекции, следующие берут новое.
+        Коллекция, вытесненная прошлой публикацией, удаляется — поиски по
+        ней к этому времени давно закончились.
+        """
+        if store is not None:
+            self.store = store
+        staged, self._staged_collection = self._staged_collection, None
+        if staged is not None:
+            previous, self.collection = self.collection, staged
+            path = os.path.join(self.db_path, LIVE_COLLECTION_FILE)
+            with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+                f.write(staged.name)
+            os.replace(f"{path}.tmp", path)
+            if self._retired_collection is not None:
+                try:
+                    self.client.delete_collection(self._retired_collection)
+                except Exception as e:
+                    logger.warning("Не удалось удалить коллекцию %s: %s", self._retired_collection, e)
+            self._retired_collection = previous.name
+        self.generation += 1
+        return self.generation
+
+    def _get_async_http(self) -> httpx.AsyncClient:
+        if self._async_http is None or self._async_http.is_closed:
+            self._async_http = httpx.AsyncClient(verify=False, timeout=GIGACHAT_TIMEOUT)
+        return self._async_http
+
+    async def _arefresh_token(self, expired_token: Optional[str]) -> None:
+        """Обновляет токен; параллельные запросы с тем же устаревшим токеном ждут одно обновление"""
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            if self.access_token != expired_token:
+                return
+            with metrics.timed("token_refresh"):
+                response = await self._get_async_http().post(
+                    GIGACHAT_OAUTH_URL, headers=self._oauth_headers(), data={"scope": "GIGACHAT_API_PERS"}
+                )
+            response.raise_for_status()
+            self.access_token = response.json()["access_token"]
+            logger.info("access_token GigaChat получен")
+
+    async def _aget_embedding(self, text: str) -> List[float]:
+        """Асинхронный вариант _get_embedding; недавние тексты берутся из LRU-кэша"""
+        key = text[:tr_text]
+        cached = self._embedding_cache.get(key)
+        if cached is not None:
+            self._embedding_cache.move_to_end(key)
+            metrics.inc("embedding_cache_total", result="hit")
+            return cached
+        metrics.inc("embedding_cache_total", result="miss")
+        if not self.embedding_breaker.allow():
+            self._start_probe()
+            raise CircuitOpenError("эмбеддинги GigaChat недоступны")
+        try:
+            embedding = await self._afetch_embedding(key)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._record_embedding_failure(e)
+            raise
+        self.embedding_breaker.record_success()
+        if EMBEDDING_CACHE_SIZE > 0:
+            self._embedding_cache[key] = embedding
+            if len(self._embedding_cache) > EMBEDDING_CACHE_SIZE:
+                self._embedding_cache.popitem(last=False)
+        return embedding
+
+    async def _afetch_embedding(self, text: str) -> List[float]:
+        client = self._get_async_http()
+        payload = {"model": "Embeddings", "input": [text]}
+
+        token = self.access_token
+        with metrics.timed("embedding"):
+            response = await client.post(
+                GIGACHAT_EMBEDDINGS_URL,
+                headers={"Authorization": f"Bearer {token}", "Accept": "application/json", "X-Request-ID": correlation_id.get()},
+                json=payload,
+            )
+        if response.status_code == 401:  # Unauthorized
+            logger.info("Токен GigaChat устарел, получаем новый")
+            await self._arefresh_token(token)
+            response = await client.post(
+                GIGACHAT_EMBEDDINGS_URL,
+                headers={"Authorization": f"Bearer {self.access_token}", "Accept": "application/json", "X-Request-ID": correlation_id.get()},
+                json=payload,
+            )
+        response.raise_for_status()
+        return response.json()["data"][0]["embedding"]
+
+    def _lexical_index(self):
+        """BM25 по чанкам файлов базы знаний; пересобирается с новым поколением"""
+        from bot.services.lexical_search import BM25Index
+
+        generation = self.generation
+        cached = self._lexical
+        if cached is None or cached[0] != generation:
+            documents = []
+            for file_path in self._doc_files():
+                try:
+                    documents += self._file_chunks(file_path)[1]
+                except Exception as e:
+                    logger.error("Ошибка чтения %s: %s", file_path, e)
+            cached = (generation, BM25Index(documents))
+            self._lexical = cached
+        return cached[1]
+
+    def lexical_search(self, query: str, n_results: int = n_res) -> List[str]:
+        """Поиск по словам без эмбеддингов — пока GigaChat недоступен"""
+        with metrics.timed("lexical_search"):
+            return self._lexical_index().documents_for(query, n_results)
+
+    def _count_fallback(self, error: Exception) -> None:
+        if isinstance(error, CircuitOpenError):
+            metrics.inc("search_fallback_total", reason="open")
         else:
-            print("❌ НЕТ документов для индексации.")
+            logger.warning("Эмбеддинг запроса не получен (%s), ищем по словам", error)
+            metrics.inc("search_fallback_total", reason="error")
+
+    def embed(self, text: str) -> List[float]:
+        """Эмбеддинг текста тем же способом, что и запросы поиска"""
+        if self.access_token is None:
+            self.warm_up()
+        return self._get_embedding(text)
+
+    async def aembed(self, text: str) -> List[float]:
+        """Асинхронный эмбеддинг запроса; его можно передать в asearch(embedding=...)"""
+        if self.collection is None:
+            await asyncio.to_thread(self.warm_up)
+        return await self._aget_embedding(text)
+
+    async def asearch(self, query: str, n_results: int = n_res, embedding: Optional[List[float]] = None) -> List[str]:
+        """
+        Поиск без блокировки event loop: эмбеддинг через httpx, запрос к
+        Chroma в пуле потоков. Отмена задачи прерывает HTTP-запрос.
+        Готовый эмбеддинг запроса (embedding) повторно не запрашивается.
+        Без эмбеддинга (GigaChat недоступен, цепь разомкнута) — поиск по словам.
+        """
+        try:
+            if self.collection is None:
+                await asyncio.to_thread(self.warm_up)
+            if embedding is None:
+                try:
+                    embedding = await self._aget_embedding(query)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self._count_fallback(e)
+                    return await asyncio.to_thread(self.lexical_search, query, n_results)
+            documents, _ = await self._anearest(embedding, n_results)
+            return documents
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Ошибка при поиске: %s", e)
+            return []
+
+    async def aquery(self, embedding: List[float], n_results: int = n_res) -> List[Tuple[str, float]]:
+        """Чанки, ближайшие к готовому эмбеддингу, с расстояниями (для предвыборки)"""
+        if self.collection is None:
+            await asyncio.to_thread(self.warm_up)
+        documents, distances = await self._anearest(embedding, n_results)
+        return list(zip(documents, distances))
 
     def search(self, query: str, n_results: int = n_res) -> List[str]:
         """Поиск по запросу"""
         try:
-            query_embedding = self._get_embedding(query)
-            results = self.collection.query(query_embeddings=[query_embedding], n_results=n_results)
-            return results["documents"][0] if results["documents"] else []
+            self.warm_up()
+            try:
+                query_embedding = self._get_embedding(query)
+            except Exception as e:
+                self._count_fallback(e)
+                return self.lexical_search(query, n_results)
+            documents, _ = self._nearest(query_embedding, n_results)
+            return documents
         except Exception as e:
-            print(f"❌ Ошибка при поиске: {e}")
+            logger.error("Ошибка при поиске: %s", e)
             return []
+
+    def is_ready(self) -> bool:
+        """Готов ли движок отвечать: есть проиндексированные документы (без GigaChat — поиск по словам)"""
+        try:
+            return self.collection is not None and self.collection.count() > 0
+        except Exception:
+            return False
+
+    def close(self):
+        """Освобождает HTTP-соединения (при остановке бота)"""
+        self.http.close()
+
+    async def aclose(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            await asyncio.gather(self._probe_task, return_exceptions=True)
+            self._probe_task = None
+        self.close()
+        if self._async_http is not None:
+            await self._async_http.aclose()
+            self._async_http = None
@@ -0,0 +1,160 @@
+# bot/services/selection_prefetch.py
+"""
+Предвыборка для подбора масла: пока клиент набирает марку и модель,
+бот уже достаёт из базы знаний чанки, относящиеся к выбранному типу
+техники.
+
+На select_* запускается фоновая задача: типовые формулировки запроса
+для этого типа техники превращаются в эмбеддинги (они оседают в
+LRU-кэше RAGEngine), по каждой берутся ближайшие чанки Chroma, и
+объединённый список, общий для всех клиентов, кэшируется на
+PREFETCH_TTL или до публикации нового поколения базы знаний.
+process_vehicle_info не ходит за эмбеддингом своего текста: он только
+переранжирует готовых кандидатов по словам сообщения.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from bot.services.faq_index import normalize
+from bot.services.metrics import metrics
+from bot.services.user_tasks import UserTaskRegistry
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() in ("1", "true", "yes")
+# Сколько чанков брать по каждой формулировке
+PREFETCH_CHUNKS = int(os.getenv("PREFETCH_CHUNKS", "6"))
+# Время жизни собранных кандидатов по типу техники
+PREFETCH_TTL = float(os.getenv("PREFETCH_TTL", "600"))
+# Сколько ждать незавершённую предвыборку, прежде чем искать обычным способом
+PREFETCH_WAIT = float(os.getenv("PREFETCH_WAIT", "3"))
+
+# Типовые формулировки подбора по типам техники (callback_data кнопок select_*)
+VEHICLE_PHRASINGS: Dict[str, Tuple[str, ...]] = {
+    "select_car": (
+        "Подбор моторного масла для легкового автомобиля",
+        "Масло для бензинового и дизельного двигателя легкового автомобиля, вязкость 5W-30 5W-40",
+        "Допуски автопроизводителей VW MB BMW для моторного масла",
+    ),
+    "select_truck": (
+        "Подбор моторного масла для грузового и коммерческого транспорта",
+        "Масло для дизельного двигателя грузовика, вязкость 10W-40 15W-40, ACEA E",
+        "Трансмиссионное масло для грузовиков и спецтехники",
+    ),
+    "select_moto": (
+        "Подбор масла для мотоцикла",
+        "Масло для четырёхтактного двигателя мотоцикла JASO MA",
+        "Масло для двухтактного двигателя мототехники",
+    ),
+    "select_snow": (
+        "Подбор масла для снегохода",
+        "Масло для двухтактного двигателя снегохода, низкие температуры",
+    ),
+    "select_water": (
+        "Подбор масла для водного транспорта и лодочных моторов",
+        "Масло для подвесного лодочного мотора и гидроцикла",
+    ),
+    "select_industrial": (
+        "Подбор индустриального масла для промышленной техники",
+        "Гидравлическое масло ISO VG 32 46 68",
+        "Редукторное и компрессорное масло для оборудования",
+    ),
+}
+
+
+def rerank(text: str, chunks: List[str], n_results: int) -> List[str]:
+    """
+    Переранжирование кандидатов по словам сообщения: доля основ текста,
+    найденных в чанке. При равенстве сохраняется порядок предвыборки.
+    Пустой список — ни один кандидат не пересекается с текстом.
+    """
+    query = set(normalize(text))
+    if not query:
+        return []
+    scored = []
+    for position, chunk in enumerate(chunks):
+        overlap = len(query & set(normalize(chunk)))
+        if overlap:
+            scored.append((-overlap, position, chunk))
+    scored.sort()
+    return [chunk for _, _, chunk in scored[:n_results]]
+
+
+class SelectionPrefetcher:
+    """
+    Предвыборка кандидатов базы знаний по типу техники.
+    Не больше одной задачи на пользователя; задача отменяется, когда
+    пользователь выходит из анкеты подбора (см. PrefetchCancelMiddleware).
+    """
+
+    def __init__(self, engine, ttl: float = PREFETCH_TTL, chunks: int = PREFETCH_CHUNKS):
+        self.engine = engine
+        self.ttl = ttl
+        self.chunks = chunks
+        # тип техники → (время сборки, поколение базы знаний, чанки)
+        self._pools: Dict[str, Tuple[float, int, List[str]]] = {}
+        self._tasks = UserTaskRegistry()
+
+    def start(self, user_id: int, vehicle_type: str) -> Optional[asyncio.Task]:
+        """Запускает предвыборку для пользователя; свежие кандидаты не пересобираются"""
+        if not PREFETCH_ENABLED or vehicle_type not in VEHICLE_PHRASINGS:
+            return None
+        if self._fresh_pool(vehicle_type) is not None:
+            self._tasks.cancel(user_id)
+            return None
+        return self._tasks.start(user_id, self._prefetch(vehicle_type), name=f"prefetch-{user_id}")
+
+    def pending(self, user_id: int) -> bool:
+        return self._tasks.get(user_id) is not None
+
+    def cancel(self, user_id: int) -> bool:
+        cancelled = self._tasks.cancel(user_id)
+        if cancelled:
+            metrics.inc("prefetch_total", result="cancelled")
+        return cancelled
+
+    def _fresh_pool(self, vehicle_type: str) -> Optional[List[str]]:
+        pool = self._pools.get(vehicle_type)
+        if pool is None or time.monotonic() - pool[0] > self.ttl or pool[1] != self.engine.generation:
+            return None
+        return pool[2]
+
+    async def _prefetch(self, vehicle_type: str) -> None:
+        generation = self.engine.generation
+        with metrics.timed("prefetch"):
+            best: Dict[str, float] = {}
+            for phrasing in VEHICLE_PHRASINGS[vehicle_type]:
+                embedding = await self.engine.aembed(phrasing)
+                for document, distance in await self.engine.aquery(embedding, self.chunks):
+                    best[document] = min(distance, best.get(document, distance))
+        self._pools[vehicle_type] = (time.monotonic(), generation, sorted(best, key=best.__getitem__))
+        logger.debug("Предвыборка %s: %d чанков", vehicle_type, len(best))
+
+    async def contexts(self, user_id: int, vehicle_type: str, text: str, n_results: int) -> Optional[List[str]]:
+        """
+        Лучшие предвыбранные чанки для текста клиента. None — кандидатов
+        нет (предвыборка не успела, упала или ни один чанк не подходит к
+        тексту): нужен обычный поиск.
+        """
+        task = self._tasks.get(user_id)
+        if task is not None:
+            await asyncio.wait({task}, timeout=PREFETCH_WAIT)
+            if not task.done():
+                self._tasks.cancel(user_id)
+                metrics.inc("prefetch_total", result="timeout")
+                return None
+            if task.cancelled() or task.exception() is not None:
+                # Ошибку задачи уже записал реестр; ищем обычным способом
+                metrics.inc("prefetch_total", result="error")
+                return None
+
+        pool = self._fresh_pool(vehicle_type)
+        contexts = rerank(text, pool, n_results) if pool else []
+        metrics.inc("prefetch_total", result="hit" if contexts else "miss")
+        return contexts or None
+
+    async def shutdown(self) -> None:
+        await self._tasks.shutdown(timeout=0)
@@ -0,0 +1,101 @@
+# bot/services/support_routing.py
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from bot.services.database import SessionLocal, SupportMessage
+
+logger = logging.getLogger(__name__)
+
+SUPPORT_ROUTING_CACHE_SIZE = int(os.getenv("SUPPORT_ROUTING_CACHE_SIZE", "5000"))
+
+
+@dataclass(frozen=True)
+class SupportThread:
+    """К какому клиенту относится сообщение в группе поддержки"""
+    user_id: int
+    user_message_id: Optional[int] = None
+
+
+class SupportRouter:
+    """
+    Таблица маршрутизации чата поддержки: (чат, message_id) → клиент.
+
+    Запись делается при пересылке сообщения клиента в группу и при
+    подтверждении ответа менеджера, поэтому ответить можно на любое из них.
+    Последние записи держатся в LRU-кэше в памяти, остальные читаются из
+    support_messages по уникальному индексу.
+    """
+
+    def __init__(self, cache_size: int = SUPPORT_ROUTING_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[int, int], SupportThread]" = OrderedDict()
+
+    def _cache_put(self, key: Tuple[int, int], thread: SupportThread) -> None:
+        self._cache[key] = thread
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def remember(self, chat_id: int, message_id: int, user_id: int, user_message_id: Optional[int] = None) -> None:
+        thread = SupportThread(user_id, user_message_id)
+        self._cache_put((chat_id, message_id), thread)
+        try:
+            await asyncio.to_thread(self._insert, chat_id, message_id, thread)
+        except Exception as e:
+            # Маршрут остаётся в кэше; после рестарта сработает разбор текста
+            logger.error("Не удалось сохранить маршрут сообщения %s: %s", message_id, e)
+
+    async def lookup(self, chat_id: int, message_id: int) -> Optional[SupportThread]:
+        key = (chat_id, message_id)
+        thread = self._cache.get(key)
+        if thread is not None:
+            self._cache.move_to_end(key)
+            return thread
+        thread = await asyncio.to_thread(self._select, chat_id, message_id)
+        if thread is not None:
+            self._cache_put(key, thread)
+        return thread
+
+    # ---------------------------------------------------------------- БД
+
+    def _insert(self, chat_id: int, message_id: int, thread: SupportThread) -> None:
+        db = SessionLocal()
+        try:
+            db.execute(
+                sqlite_insert(SupportMessage)
+                .values(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    user_id=thread.user_id,
+                    user_message_id=thread.user_message_id,
+                    created_at=datetime.utcnow(),
+                )
+                .on_conflict_do_nothing(index_elements=["chat_id", "message_id"])
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _select(self, chat_id: int, message_id: int) -> Optional[SupportThread]:
+        db = SessionLocal()
+        try:
+            row = db.execute(
+                select(SupportMessage.user_id, SupportMessage.user_message_id).where(
+                    SupportMessage.chat_id == chat_id,
+                    SupportMessage.message_id == message_id,
+                )
+            ).first()
+            return SupportThread(row.user_id, row.user_message_id) if row else None
+        finally:
+            db.close()
+
+
+support_router = SupportRouter()
@@ -1,12 +1,21 @@
-import requests
+# Ручная проверка OAuth GigaChat: python -m bot.services.test
+# Ключи берутся из .env (GIGACHAT_CLIENT_ID, GIGACHAT_SECRET), в коде их быть не должно
 import base64
+import os
 import uuid
 
-client_id = "5cb714b4-50fa-4408-a508-c3338c910bf9"
-secret = "afad7144-c646-46ef-97c2-962f503e60b5"
+import requests
+from bot.config import load_config
+
+load_config()
+
+client_id = os.getenv("GIGACHAT_CLIENT_ID")
+secret = os.getenv("GIGACHAT_SECRET")
+if not client_id or not secret:
+    raise SystemExit("GIGACHAT_CLIENT_ID и GIGACHAT_SECRET должны быть заданы в .env")
 encoded = base64.b64encode(f"{client_id}:{secret}".encode()).decode()
 
-url = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
+url = os.getenv("GIGACHAT_OAUTH_URL", "https://ngw.devices.sberbank.ru:9443/api/v2/oauth")
 headers = {
     "Authorization": f"Basic {encoded}",
     "RqUID": str(uuid.uuid4()),
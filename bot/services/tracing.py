@@ -0,0 +1,174 @@
+# bot/services/tracing.py
+import json
+import logging
+import os
+import random
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# json — одна JSON-строка на запись (для сборщиков логов), text — как раньше
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Доля апдейтов, трассировка которых пишется в лог целиком
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+# Обработка дольше порога пишется в лог всегда, со всеми этапами
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "5000"))
+# Не больше стольких этапов на трассировку — защита от циклов с замерами
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "200"))
+
+correlation_id: ContextVar[str] = ContextVar("correlation_id", default="-")
+current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+
+
+def new_correlation_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+@dataclass
+class Span:
+    name: str
+    offset_ms: float  # от начала трассировки
+    duration_ms: float
+    error: Optional[str] = None
+
+
+@dataclass
+class Trace:
+    """Этапы обработки одного апдейта (или фонового ответа) с общим correlation_id"""
+
+    name: str
+    correlation_id: str
+    sampled: bool
+    attrs: Dict[str, Any] = field(default_factory=dict)
+    spans: List[Span] = field(default_factory=list)
+    started: float = field(default_factory=time.perf_counter)
+
+    def add_span(self, name: str, started: float, duration: float, error: Optional[str] = None) -> None:
+        if len(self.spans) < TRACE_MAX_SPANS:
+            self.spans.append(Span(name, round((started - self.started) * 1000, 2), round(duration * 1000, 2), error))
+
+    def to_dict(self, duration_ms: float) -> Dict[str, Any]:
+        return {
+            "trace": self.name,
+            "duration_ms": round(duration_ms, 2),
+            **self.attrs,
+            "spans": [span.__dict__ for span in self.spans],
+        }
+
+
+def record_span(name: str, started: float, duration: float, error: Optional[str] = None) -> None:
+    """Добавляет завершённый этап в текущую трассировку (если она есть)"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_span(name, started, duration, error)
+
+
+class trace_context:
+    """
+    Открывает трассировку и задаёт correlation_id для всего, что выполняется
+    внутри, включая asyncio.to_thread и созданные здесь задачи.
+
+    Без явного correlation_id наследует текущий — так фоновый ответ RAG
+    остаётся связан с апдейтом, который его запустил. При выходе трассировка
+    пишется в лог, если попала в выборку или оказалась медленнее SLOW_REQUEST_MS.
+    """
+
+    def __init__(self, name: str, correlation: Optional[str] = None, **attrs):
+        parent = correlation_id.get()
+        self.correlation = correlation or (parent if parent != "-" else new_correlation_id())
+        self.trace = Trace(name, self.correlation, random.random() < TRACE_SAMPLE_RATE, attrs)
+        self._tokens = None
+
+    def __enter__(self) -> Trace:
+        self._tokens = (correlation_id.set(self.correlation), current_trace.set(self.trace))
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        duration_ms = (time.perf_counter() - self.trace.started) * 1000
+        if exc_type is not None:
+            self.trace.attrs["error"] = exc_type.__name__
+        if duration_ms >= SLOW_REQUEST_MS:
+            logger.warning("Медленная обработка %s: %.0f мс", self.trace.name, duration_ms,
+                           extra={"trace": self.trace.to_dict(duration_ms)})
+        elif self.trace.sampled:
+            logger.info("Трассировка %s: %.0f мс", self.trace.name, duration_ms,
+                        extra={"trace": self.trace.to_dict(duration_ms)})
+        correlation_token, trace_token = self._tokens
+        current_trace.reset(trace_token)
+        correlation_id.reset(correlation_token)
+        return False
+
+    async def __aenter__(self) -> Trace:
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        return self.__exit__(exc_type, exc, tb)
+
+
+# ---------------------------------------------------------------- логирование
+
+class CorrelationFilter(logging.Filter):
+    """Добавляет correlation_id в каждую запись лога"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+# Стандартные атрибуты LogRecord — всё остальное считаем полями из extra
+_RECORD_FIELDS = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime", "correlation_id"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, сообщение, correlation_id и поля из extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "correlation_id": getattr(record, "correlation_id", "-"),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Человекочитаемый формат; трассировка выводится компактной строкой этапов"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        trace = getattr(record, "trace", None)
+        if trace:
+            stages = ", ".join(f"{span['name']}={span['duration_ms']:.0f}мс" for span in trace["spans"])
+            line += f" [{stages}]"
+        return line
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> None:
+    """Настраивает корневой логгер; повторный вызов ничего не меняет"""
+    root = logging.getLogger()
+    if any(getattr(handler, "_ecofes", False) for handler in root.handlers):
+        return
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler._ecofes = True
+    handler.addFilter(CorrelationFilter())
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(TextFormatter("%(asctime)s %(levelname)s [%(correlation_id)s] %(name)s: %(message)s"))
+    root.handlers = [handler]
+    root.setLevel(level)
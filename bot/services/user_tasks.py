@@ -0,0 +1,76 @@
+# bot/services/user_tasks.py
+import asyncio
+import logging
+import os
+from typing import Coroutine, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать незавершённые ответы при остановке бота
+USER_TASKS_SHUTDOWN_TIMEOUT = float(os.getenv("USER_TASKS_SHUTDOWN_TIMEOUT", "20"))
+
+
+class UserTaskRegistry:
+    """
+    Фоновые задачи, не больше одной на пользователя.
+
+    Новая задача пользователя отменяет предыдущую, если та ещё не
+    завершилась: отмена доходит до ожидающих HTTP-запросов внутри неё,
+    устаревший ответ не отправляется и не тратит запросы к API.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self.started = 0
+        self.superseded = 0
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def start(self, key: Hashable, coro: Coroutine, name: Optional[str] = None) -> asyncio.Task:
+        """Запускает coro для key, отменяя предыдущую задачу этого key"""
+        self.supersede(key)
+        task = asyncio.create_task(coro, name=name)
+        self._tasks[key] = task
+        self.started += 1
+        task.add_done_callback(lambda t, key=key: self._done(key, t))
+        return task
+
+    def get(self, key: Hashable) -> Optional[asyncio.Task]:
+        """Текущая задача key (None, если её нет)"""
+        return self._tasks.get(key)
+
+    def supersede(self, key: Hashable) -> bool:
+        """Отменяет задачу key, потому что у пользователя появился новый запрос"""
+        if self.cancel(key):
+            self.superseded += 1
+            return True
+        return False
+
+    def cancel(self, key: Hashable) -> bool:
+        task = self._tasks.get(key)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        return True
+
+    def _done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Фоновая задача %s завершилась ошибкой: %s", task.get_name(), task.exception())
+
+    async def shutdown(self, timeout: float = USER_TASKS_SHUTDOWN_TIMEOUT) -> None:
+        """Даёт текущим задачам завершиться, оставшиеся отменяет"""
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        if not tasks:
+            return
+        logger.info("Ожидаем завершения %d фоновых ответов...", len(tasks))
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+user_tasks = UserTaskRegistry()
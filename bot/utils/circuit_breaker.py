@@ -0,0 +1,70 @@
+import logging
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Вызов не выполнялся: внешний сервис недоступен, цепь разомкнута"""
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для внешнего сервиса.
+
+    После failure_threshold ошибок подряд цепь размыкается: allow()
+    возвращает False, и вызывающий сразу идёт по запасному пути, не
+    дожидаясь очередного таймаута. Пробные вызовы делает владелец (в
+    фоне, см. probe_due); успешный вызов замыкает цепь. Интервал между
+    пробами удваивается от reset_timeout до max_reset_timeout.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 max_reset_timeout: float = 300.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.next_probe_at = 0.0
+        self._probe_delay = reset_timeout
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    @property
+    def state(self) -> str:
+        return "open" if self.is_open else "closed"
+
+    def allow(self) -> bool:
+        return not self.is_open
+
+    def record_success(self) -> None:
+        self.failures = 0
+        if self.is_open:
+            logger.info("%s: сервис снова доступен, цепь замкнута через %.0f с", self.name, time.monotonic() - self.opened_at)
+            self.opened_at = None
+            self._probe_delay = self.reset_timeout
+
+    def record_failure(self, now: Optional[float] = None) -> bool:
+        """Учитывает ошибку; True — цепь только что разомкнулась"""
+        self.failures += 1
+        if self.is_open or self.failures < self.failure_threshold:
+            return False
+        now = time.monotonic() if now is None else now
+        self.opened_at = now
+        self._probe_delay = self.reset_timeout
+        self.next_probe_at = now + self._probe_delay
+        logger.warning("%s: %d ошибок подряд, цепь разомкнута", self.name, self.failures)
+        return True
+
+    def probe_due(self, now: Optional[float] = None) -> float:
+        """Сколько секунд до следующей пробы (0 — пора)"""
+        return max(0.0, self.next_probe_at - (time.monotonic() if now is None else now))
+
+    def probe_failed(self, now: Optional[float] = None) -> None:
+        self._probe_delay = min(self._probe_delay * 2, self.max_reset_timeout)
+        self.next_probe_at = (time.monotonic() if now is None else now) + self._probe_delay
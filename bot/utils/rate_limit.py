@@ -0,0 +1,81 @@
+import time
+from typing import Dict, Hashable, Optional
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше burst накопленных"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated", "noticed_at")
+
+    def __init__(self, rate: float, burst: float, now: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+        # Когда пользователю последний раз сообщали об ограничении
+        self.noticed_at = 0.0
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def consume(self, amount: float = 1.0, now: Optional[float] = None) -> bool:
+        """Списывает токены, если их хватает"""
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def refund(self, amount: float = 1.0) -> None:
+        self.tokens = min(self.burst, self.tokens + amount)
+
+    def wait_time(self, amount: float = 1.0, now: Optional[float] = None) -> float:
+        """Сколько секунд ждать, пока наберётся amount токенов"""
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= amount or self.rate <= 0:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+
+class BucketRegistry:
+    """
+    Корзины по ключу (пользователь, чат) с вытеснением простаивающих.
+
+    Корзина, к которой не обращались дольше idle_seconds, давно полная —
+    её удаление ничего не меняет, поэтому словарь растёт только с числом
+    активных ключей. Очистка выполняется не чаще раза в sweep_interval.
+    """
+
+    def __init__(self, rate: float, burst: float, idle_seconds: float = 600.0, sweep_interval: float = 60.0):
+        self.rate = rate
+        self.burst = burst
+        self.idle_seconds = max(idle_seconds, burst / rate if rate > 0 else idle_seconds)
+        self.sweep_interval = sweep_interval
+        self._buckets: Dict[Hashable, TokenBucket] = {}
+        self._last_sweep = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def get(self, key: Hashable, now: Optional[float] = None) -> TokenBucket:
+        now = time.monotonic() if now is None else now
+        if now - self._last_sweep > self.sweep_interval:
+            self.sweep(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+        return bucket
+
+    def consume(self, key: Hashable, amount: float = 1.0, now: Optional[float] = None) -> bool:
+        return self.get(key, now).consume(amount, now)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Удаляет простаивающие корзины, возвращает их количество"""
+        now = time.monotonic() if now is None else now
+        idle = [key for key, bucket in self._buckets.items() if now - bucket.updated > self.idle_seconds]
+        for key in idle:
+            del self._buckets[key]
+        self._last_sweep = now
+        return len(idle)
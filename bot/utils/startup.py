@@ -0,0 +1,47 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class StartupReport:
+    """Длительность фаз запуска бота: импорты, БД, диспетчер, фоновые задачи"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """with startup_report.phase("database"): init_db()"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def add(self, name: str, seconds: float) -> None:
+        """Фаза, замеренная вне phase() (например, фоновый прогрев)"""
+        self.phases.append((name, seconds))
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def format(self) -> str:
+        total = self.elapsed
+        width = max((len(name) for name, _ in self.phases), default=0)
+        lines = ["Запуск по фазам:"]
+        for name, seconds in self.phases:
+            share = seconds / total * 100 if total else 0.0
+            lines.append(f"  {name:<{width}}  {seconds * 1000:8.1f} мс  {share:5.1f}%")
+        lines.append(f"  {'итого':<{width}}  {total * 1000:8.1f} мс")
+        return "\n".join(lines)
+
+    def log(self) -> None:
+        logger.info(self.format())
+
+
+startup_report = StartupReport()
@@ -0,0 +1,166 @@
+# bot/webhook.py
+import asyncio
+import hmac
+import logging
+import os
+import signal
+from typing import Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from sqlalchemy import text
+
+from bot.services.database import engine
+from bot.services.metrics import handle_metrics
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный https-адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Сколько ждать завершения уже принятых апдейтов при остановке
+WEBHOOK_SHUTDOWN_TIMEOUT = float(os.getenv("WEBHOOK_SHUTDOWN_TIMEOUT", "25"))
+
+BOT_KEY = web.AppKey("bot", Bot)
+DISPATCHER_KEY = web.AppKey("dispatcher", Dispatcher)
+TASKS_KEY = web.AppKey("tasks", set)
+STATE_KEY = web.AppKey("state", dict)
+
+
+async def handle_update(request: web.Request) -> web.Response:
+    """
+    Принимает апдейт от Telegram: проверяет секрет, сразу отвечает 200,
+    а сама обработка идёт в фоновой задаче.
+    """
+    if WEBHOOK_SECRET:
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token, WEBHOOK_SECRET):
+            return web.Response(status=401)
+
+    if not request.app[STATE_KEY]["accepting"]:
+        # Telegram повторит доставку — её примет другая реплика или мы после рестарта
+        return web.Response(status=503)
+
+    bot = request.app[BOT_KEY]
+    dp = request.app[DISPATCHER_KEY]
+    try:
+        update = Update.model_validate(await request.json(), context={"bot": bot})
+    except Exception as e:
+        logger.warning("Некорректный апдейт: %s", e)
+        return web.Response(status=400)
+
+    tasks: Set[asyncio.Task] = request.app[TASKS_KEY]
+    task = asyncio.create_task(_process_update(dp, bot, update))
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+    return web.Response(status=200)
+
+
+async def _process_update(dp: Dispatcher, bot: Bot, update: Update) -> None:
+    try:
+        await dp.feed_update(bot, update)
+    except Exception as e:
+        logger.error("Ошибка обработки апдейта %s: %s", update.update_id, e)
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    """Liveness: процесс жив и обслуживает HTTP"""
+    return web.json_response({"status": "ok"})
+
+
+async def handle_ready(request: web.Request) -> web.Response:
+    """Readiness: стартовые хуки выполнены, БД и база знаний доступны"""
+    from bot.handlers.lead_handler import rag_engine
+
+    state = request.app[STATE_KEY]
+    checks = {"started": state["accepting"]}
+    try:
+        await asyncio.to_thread(_ping_db)
+        checks["database"] = True
+    except Exception:
+        checks["database"] = False
+    checks["knowledge_base"] = await asyncio.to_thread(rag_engine.is_ready)
+
+    ready = all(checks.values())
+    return web.json_response({"ready": ready, "checks": checks}, status=200 if ready else 503)
+
+
+def _ping_db() -> None:
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+
+async def _on_startup(app: web.Application) -> None:
+    bot = app[BOT_KEY]
+    dp = app[DISPATCHER_KEY]
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logger.info("Webhook установлен: %s%s", WEBHOOK_URL, WEBHOOK_PATH)
+    app[STATE_KEY]["accepting"] = True
+
+
+async def _on_shutdown(app: web.Application) -> None:
+    # Вебхук не удаляем: его продолжают обслуживать остальные реплики
+    app[STATE_KEY]["accepting"] = False
+
+    tasks = app[TASKS_KEY]
+    if tasks:
+        logger.info("Ожидаем завершения %d апдейтов...", len(tasks))
+        _, pending = await asyncio.wait(tasks, timeout=WEBHOOK_SHUTDOWN_TIMEOUT)
+        for task in pending:
+            task.cancel()
+
+    bot = app[BOT_KEY]
+    dp = app[DISPATCHER_KEY]
+    await dp.emit_shutdown(bot=bot, dispatcher=dp)
+    await bot.session.close()
+
+
+def create_app(bot: Bot, dp: Dispatcher) -> web.Application:
+    app = web.Application()
+    app[BOT_KEY] = bot
+    app[DISPATCHER_KEY] = dp
+    app[TASKS_KEY] = set()
+    app[STATE_KEY] = {"accepting": False}
+
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get("/healthz", handle_health)
+    app.router.add_get("/readyz", handle_ready)
+    app.router.add_get("/metrics", handle_metrics)
+
+    app.on_startup.append(_on_startup)
+    app.on_shutdown.append(_on_shutdown)
+    return app
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher) -> None:
+    """Запускает aiohttp-сервер и работает до SIGTERM/SIGINT"""
+    if not WEBHOOK_SECRET:
+        logger.warning("WEBHOOK_SECRET не задан — запросы к вебхуку не проверяются")
+
+    runner = web.AppRunner(create_app(bot, dp))
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logger.info("Webhook-сервер слушает %s:%s", WEBHOOK_HOST, WEBHOOK_PORT)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
@@ -1,26 +1,39 @@
 # inspect_chroma.py
+# Запуск из корня проекта: python -m data.inspect_chroma
 import chromadb
-from chromadb.config import Settings
+
+from bot.services.embedding_store import EMBEDDING_STORE_PATH, EmbeddingStore, STORE_DTYPES
+from bot.services.rag_engine import live_collection_name
 
 # Подключаемся к той же БД, что и бот
 client = chromadb.PersistentClient(path="data/chroma_db")
 
-# Получаем коллекцию
-collection = client.get_collection("ecofes_docs")
+# Получаем коллекцию текущего поколения базы знаний
+collection = client.get_collection(live_collection_name("data/chroma_db"))
+total = collection.count()
+
+print(f"📊 Найдено документов: {total}\n")
 
-# Получаем все документы
-data = collection.get(include=["documents", "metadatas", "embeddings"])
+# Документы читаем страницами и без эмбеддингов: векторы списками Python
+# занимают в десятки раз больше памяти, чем сами тексты
+for offset in range(0, total, 200):
+    page = collection.get(include=["documents", "metadatas"], limit=200, offset=offset)
+    for i, (doc_id, doc, meta) in enumerate(zip(page["ids"], page["documents"], page["metadatas"]), start=offset):
+        print(f"📄 [{i+1}] ID: {doc_id}")
+        print(f"   📝 Текст: {doc[:300]}...")  # первые 300 символов
+        print(f"   🏷️  Метаданные: {meta}")
+        print("-" * 50)
 
-print(f"📊 Найдено документов: {len(data['ids'])}\n")
+if total:
+    dim = len(collection.get(include=["embeddings"], limit=1)["embeddings"][0])
+    print(f"\n🔤 Размерность эмбеддингов: {dim}")
+    print("💾 Память под векторы:")
+    print(f"   списки Python (float): ~{total * dim * 32 / 2**20:.1f} МБ")
+    for dtype, itemsize in zip(STORE_DTYPES, (4, 2, 1)):
+        extra = total * 4 if dtype == "int8" else 0  # масштаб на вектор
+        print(f"   {dtype:<8} ~{(total * dim * itemsize + extra) / 2**20:.1f} МБ")
 
-for i, (doc_id, doc, meta, emb) in enumerate(zip(
-    data["ids"],
-    data["documents"],
-    data["metadatas"],
-    data["embeddings"]
-)):
-    print(f"📄 [{i+1}] ID: {doc_id}")
-    print(f"   📝 Текст: {doc[:300]}...")  # первые 300 символов
-    print(f"   🏷️  Метаданные: {meta}")
-    print(f"   🔤 Эмбеддинг: длина {len(emb)} (вывод вектора отключён)")
-    print("-" * 50)
+    store = EmbeddingStore.load(EMBEDDING_STORE_PATH)
+    if store is not None:
+        print(f"📦 Хранилище {EMBEDDING_STORE_PATH}: {store.dtype}, {len(store)} векторов, "
+              f"{store.memory_bytes() / 2**20:.1f} МБ в памяти")
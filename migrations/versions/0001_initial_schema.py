@@ -0,0 +1,55 @@
+"""initial schema: leads, user_queries
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Базы, созданные раньше через Base.metadata.create_all, уже содержат таблицы:
+    # для них миграция только проставляет версию.
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if "leads" not in existing:
+        op.create_table(
+            "leads",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("name", sa.String(), nullable=False),
+            sa.Column("email", sa.String(), nullable=False, unique=True),
+            sa.Column("phone", sa.String()),
+            sa.Column("industry", sa.String()),
+            sa.Column("telegram_username", sa.String()),
+            sa.Column("created_at", sa.DateTime()),
+        )
+        op.create_index("ix_leads_id", "leads", ["id"])
+
+    if "user_queries" not in existing:
+        op.create_table(
+            "user_queries",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.BigInteger(), nullable=False),
+            sa.Column("username", sa.String()),
+            sa.Column("query_text", sa.String(), nullable=False),
+            sa.Column("response_text", sa.String()),
+            sa.Column("timestamp", sa.DateTime()),
+            sa.Column("is_lead", sa.Boolean()),
+        )
+        op.create_index("ix_user_queries_id", "user_queries", ["id"])
+
+
+def downgrade() -> None:
+    op.drop_table("user_queries")
+    op.drop_table("leads")
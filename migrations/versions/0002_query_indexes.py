@@ -0,0 +1,31 @@
+"""indexes for per-user and time-range queries
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CREATE INDEX не переписывает таблицу (в отличие от batch ALTER) —
+    # блокировка записи держится только на время построения индекса.
+    op.create_index("ix_user_queries_user_id_timestamp", "user_queries", ["user_id", "timestamp"])
+    op.create_index("ix_user_queries_timestamp", "user_queries", ["timestamp"])
+    op.create_index("ix_leads_created_at", "leads", ["created_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_leads_created_at", table_name="leads")
+    op.drop_index("ix_user_queries_timestamp", table_name="user_queries")
+    op.drop_index("ix_user_queries_user_id_timestamp", table_name="user_queries")
@@ -0,0 +1,53 @@
+"""analytics rollups and lead attribution columns
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # ADD COLUMN с NULL по умолчанию в SQLite меняет только схему, без перезаписи таблицы
+    op.add_column("user_queries", sa.Column("query_type", sa.String()))
+    op.add_column("user_queries", sa.Column("outcome", sa.String()))
+    op.add_column("leads", sa.Column("user_id", sa.BigInteger()))
+
+    op.create_table(
+        "query_rollups",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("granularity", sa.String(), nullable=False),
+        sa.Column("bucket_start", sa.DateTime(), nullable=False),
+        sa.Column("query_type", sa.String(), nullable=False),
+        sa.Column("outcome", sa.String(), nullable=False),
+        sa.Column("queries", sa.Integer(), nullable=False),
+        sa.Column("converted", sa.Integer(), nullable=False),
+        sa.UniqueConstraint("granularity", "bucket_start", "query_type", "outcome", name="uq_query_rollups_bucket"),
+    )
+    op.create_table(
+        "rollup_watermarks",
+        sa.Column("name", sa.String(), primary_key=True),
+        sa.Column("last_id", sa.Integer(), nullable=False),
+        sa.Column("updated_at", sa.DateTime()),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("rollup_watermarks")
+    op.drop_table("query_rollups")
+    with op.batch_alter_table("leads") as batch_op:
+        batch_op.drop_column("user_id")
+    with op.batch_alter_table("user_queries") as batch_op:
+        batch_op.drop_column("outcome")
+        batch_op.drop_column("query_type")
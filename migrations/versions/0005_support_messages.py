@@ -0,0 +1,37 @@
+"""support chat routing table
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "support_messages",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("chat_id", sa.BigInteger(), nullable=False),
+        sa.Column("message_id", sa.BigInteger(), nullable=False),
+        sa.Column("user_id", sa.BigInteger(), nullable=False),
+        sa.Column("user_message_id", sa.BigInteger()),
+        sa.Column("created_at", sa.DateTime()),
+        sa.UniqueConstraint("chat_id", "message_id", name="uq_support_messages_chat_message"),
+    )
+    op.create_index("ix_support_messages_user_id", "support_messages", ["user_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_support_messages_user_id", table_name="support_messages")
+    op.drop_table("support_messages")
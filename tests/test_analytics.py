@@ -0,0 +1,36 @@
+# tests/test_analytics.py
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+from bot.services import analytics
+from bot.services.analytics import RollupWorker
+from bot.services.database import Base, Lead, QueryRollup, UserQuery
+
+
+def test_query_converted_once_for_two_leads_in_window(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'analytics.db'}")
+    Base.metadata.create_all(engine)
+    monkeypatch.setattr(analytics, "SessionLocal", sessionmaker(bind=engine))
+
+    start = datetime.utcnow() - timedelta(hours=3)
+    db = analytics.SessionLocal()
+    db.add_all([
+        UserQuery(user_id=7, query_text="масло 5W-30", timestamp=start, is_lead=True, query_type="technical"),
+        UserQuery(user_id=7, query_text="а для КПП?", timestamp=start + timedelta(minutes=30), is_lead=True, query_type="technical"),
+        # Два лида одного пользователя в пределах окна атрибуции
+        Lead(name="Иван", email="a@example.com", user_id=7, created_at=start + timedelta(minutes=10)),
+        Lead(name="Иван", email="b@example.com", user_id=7, created_at=start + timedelta(minutes=40)),
+    ])
+    db.commit()
+    db.close()
+
+    RollupWorker().run_once()
+
+    db = analytics.SessionLocal()
+    queries, converted = db.execute(
+        select(func.sum(QueryRollup.queries), func.sum(QueryRollup.converted)).where(QueryRollup.granularity == "day")
+    ).one()
+    db.close()
+    assert (queries, converted) == (2, 2)
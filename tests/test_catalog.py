@@ -0,0 +1,100 @@
+# tests/test_catalog.py
+# Запуск из корня проекта: python -m pytest -q tests
+import os
+
+import pytest
+
+from bot.services.catalog import ProductCatalog, _REQUEST_CATEGORIES
+
+DOCS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "docs")
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    return ProductCatalog(DOCS_PATH)
+
+
+# Каждое ключевое слово _REQUEST_CATEGORIES в обычной форме, как его пишут клиенты
+CATEGORY_PHRASES = {
+    "кпп": "масло в кпп",
+    "коробк": "масло в коробку передач",
+    "трансмисс": "трансмиссионное масло",
+    "мост": "масло в задний мост",
+    "дифференциал": "масло в дифференциал",
+    "раздатк": "масло в раздатку",
+    "гидравли": "гидравлический пресс",
+    "гидросистем": "масло для гидросистемы погрузчика",
+    "компрессор": "винтовой компрессор",
+    "редуктор": "червячный редуктор",
+}
+
+
+def test_category_phrases_cover_every_keyword():
+    keywords = {word for _, words in _REQUEST_CATEGORIES for word in words}
+    assert keywords == set(CATEGORY_PHRASES)
+
+
+@pytest.mark.parametrize("category, word", [(category, word) for category, words in _REQUEST_CATEGORIES for word in words])
+def test_request_category_keyword(category, word):
+    assert ProductCatalog.parse_request(CATEGORY_PHRASES[word]).category == category
+
+
+@pytest.mark.parametrize("text", ["гидравлическое масло", "ГИДРАВЛИЧЕСКИЙ ПРЕСС", "гидравлика экскаватора"])
+def test_request_hydraulic_adjectives(text):
+    assert ProductCatalog.parse_request(text, "select_industrial").category == "hydraulic"
+
+
+@pytest.mark.parametrize("text, engine", [
+    ("двухтактный мотор", "2T"),
+    ("Двухтактный лодочный мотор Yamaha", "2T"),
+    ("четырехтактный мотор", "4T"),
+    ("четырёхтактный двигатель Honda", "4T"),
+    ("масло 2T для бензопилы", "2T"),
+    ("масло 4Т для мотоцикла", "4T"),  # кириллическая «Т»
+    ("Toyota Camry 2015", None),
+])
+def test_request_engine(text, engine):
+    assert ProductCatalog.parse_request(text, "select_moto").engine == engine
+
+
+def test_shortlist_hydraulic_request_has_no_motor_oils(catalog):
+    request = ProductCatalog.parse_request("гидравлический пресс, синтетика", "select_industrial")
+    products = catalog.shortlist(request)
+    assert products
+    assert all(product.category == "hydraulic" for product in products)
+
+
+def test_shortlist_matches_requested_viscosity(catalog):
+    request = ProductCatalog.parse_request("Toyota Camry 5W-30 API SP", "select_car")
+    products = catalog.shortlist(request)
+    assert products
+    assert all("5W-30" in product.sae for product in products)
+
+
+def test_shortlist_empty_without_matching_features(catalog):
+    # Ни вязкости, ни спецификаций, ни допусков — подбор уходит в базу знаний
+    assert catalog.shortlist(ProductCatalog.parse_request("Toyota Camry 2015", "select_car")) == []
+
+
+def test_shortlist_empty_when_category_not_offered_for_vehicle(catalog):
+    request = ProductCatalog.parse_request("масло в гидросистему 5W-30", "select_moto")
+    assert catalog.shortlist(request) == []
+
+
+def test_shortlist_empty_for_empty_catalog(tmp_path):
+    request = ProductCatalog.parse_request("5W-30 API SP", "select_car")
+    assert ProductCatalog(str(tmp_path)).shortlist(request) == []
+
+
+def test_shortlist_offers_atf_by_approval_for_car(catalog):
+    # Карточки АКПП без слова «легковых» тоже подбираются для легкового автомобиля
+    products = catalog.shortlist(ProductCatalog.parse_request("Мерседес, АКПП, допуск 236.15", "select_car"))
+    assert products
+    assert products[0].name == "ATF Special FLUID mb 236.15"
+
+
+def test_shortlist_prefers_dsg_fluid_for_dsg_gearbox(catalog):
+    products = catalog.shortlist(ProductCatalog.parse_request("Ауди А4, коробка DSG, масло синтетика", "select_car"))
+    assert products
+    assert products[0].name == "DCTF multi dct/dsg"
+    assert all(product.category == "transmission" for product in products)
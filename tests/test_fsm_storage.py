@@ -0,0 +1,46 @@
+# tests/test_fsm_storage.py
+import asyncio
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+
+from bot.services.fsm_storage import CachedStorage, SQLiteStorage
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+
+
+def test_cached_state_expires_with_inner_ttl(tmp_path, monkeypatch):
+    async def scenario():
+        storage = CachedStorage(SQLiteStorage(str(tmp_path / "fsm.db"), ttl=60), cache_ttl=0, state_ttl=60)
+        await storage.set_state(KEY, "SelectionForm:waiting_for_vehicle_info")
+        await storage.set_data(KEY, {"vehicle_type": "select_car"})
+        assert await storage.get_state(KEY) == "SelectionForm:waiting_for_vehicle_info"
+
+        now = time.time()
+        monkeypatch.setattr(time, "time", lambda: now + 61)
+        assert await storage.get_state(KEY) is None
+        assert await storage.get_data(KEY) == {}
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_cached_record_loaded_from_inner_keeps_its_age(tmp_path, monkeypatch):
+    async def scenario():
+        path = str(tmp_path / "fsm.db")
+        inner = SQLiteStorage(path, ttl=60)
+        await inner.set_state(KEY, "SupportForm:active")
+        written = time.time()
+
+        # Новый процесс: кэш пуст, запись в БД уже 50 секунд как сделана
+        monkeypatch.setattr(time, "time", lambda: written + 50)
+        storage = CachedStorage(inner, cache_ttl=0, state_ttl=60)
+        assert await storage.get_state(KEY) == "SupportForm:active"
+        assert await storage.get_data(KEY) == {}
+        assert storage.misses == 1
+
+        monkeypatch.setattr(time, "time", lambda: written + 61)
+        assert await storage.get_state(KEY) is None
+        await storage.close()
+
+    asyncio.run(scenario())
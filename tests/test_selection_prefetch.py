@@ -0,0 +1,71 @@
+# tests/test_selection_prefetch.py
+import asyncio
+import os
+
+from bot.services.catalog import ProductCatalog
+from bot.services.metrics import metrics
+from bot.services.selection_prefetch import VEHICLE_PHRASINGS, SelectionPrefetcher
+
+DOCS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "docs")
+
+CHUNKS = [
+    "Моторное масло 5W-30 для бензиновых двигателей легковых автомобилей Toyota и Honda",
+    "Трансмиссионное масло 75W-90 для механических коробок передач",
+    "Масло для дизельных двигателей грузовиков",
+]
+
+
+class FakeEngine:
+    """Движок без GigaChat и Chroma: считает обращения за эмбеддингами"""
+
+    def __init__(self):
+        self.generation = 0
+        self.embedded = []
+
+    async def aembed(self, text):
+        self.embedded.append(text)
+        return [1.0]
+
+    async def aquery(self, embedding, n_results):
+        return [(chunk, 0.1 * i) for i, chunk in enumerate(CHUNKS[:n_results])]
+
+
+def test_prefetched_pool_answers_request_not_covered_by_catalog():
+    text = "Toyota Camry 2015, бензиновый двигатель 2.5"
+    # Каталог такой запрос не покрывает — подбор идёт по базе знаний
+    assert ProductCatalog(DOCS_PATH).shortlist(ProductCatalog.parse_request(text, "select_car")) == []
+
+    async def scenario():
+        engine = FakeEngine()
+        prefetcher = SelectionPrefetcher(engine)
+        prefetcher.start(1, "select_car")
+        hits_before = metrics.counter_by("prefetch_total", "result").get("hit", 0)
+
+        contexts = await prefetcher.contexts(1, "select_car", text, 3)
+
+        assert contexts is not None and contexts[0] == CHUNKS[0]
+        # Эмбеддинги запрашивались только для типовых формулировок, не для текста клиента
+        assert engine.embedded == list(VEHICLE_PHRASINGS["select_car"])
+        assert metrics.counter_by("prefetch_total", "result")["hit"] == hits_before + 1
+        await prefetcher.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_pool_is_shared_until_generation_changes():
+    async def scenario():
+        engine = FakeEngine()
+        prefetcher = SelectionPrefetcher(engine)
+        prefetcher.start(1, "select_car")
+        await prefetcher.contexts(1, "select_car", "Toyota", 3)
+        calls = len(engine.embedded)
+
+        assert prefetcher.start(2, "select_car") is None  # свежие кандидаты не пересобираются
+        assert await prefetcher.contexts(2, "select_car", "Toyota", 3) is not None
+        assert len(engine.embedded) == calls
+
+        engine.generation += 1  # опубликовано новое поколение базы знаний
+        assert prefetcher.start(3, "select_car") is not None
+        await prefetcher.shutdown()
+
+    asyncio.run(scenario())